@@ -0,0 +1,339 @@
+"""
+Benchmarks of the `prairie` CLI, with a local history of results.
+
+Commands are run in-process against a :class:`~prairie.docker.fake.FakeDockerDaemon`,
+so no real Docker daemon is needed. The time the fake daemon spends sleeping
+on scripted latencies is subtracted from the wall-clock time of each run: what
+remains is the overhead of the CLI itself (imports aside), which is what
+regressions in `prairie` would change. Startup is measured separately, in
+fresh interpreters.
+
+Each ``prairie bench run`` appends its results to a JSON history file in the
+user cache directory, and ``prairie bench compare`` flags the benchmarks whose
+median got slower than a baseline run by more than a threshold.
+"""
+
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import click.testing
+import click_help_colors
+import loguru
+
+from . import __version__, paths
+from .course import index, synth
+from .docker.fake import FakeDockerDaemon
+
+PRAIRIELEARN_IMAGE = "prairielearn/prairielearn:us-prod-live"
+
+HISTORY_FILENAME = "bench-history.json"
+
+# Registry of benchmarks: name -> (description, function(repeat) -> list of seconds)
+BENCHMARKS = {}
+
+
+def benchmark(name: str, description: str):
+    """
+    Decorator registering a benchmark, i.e., a function taking a number of
+    repetitions and returning the list of measured durations in seconds.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = (description, func)
+        return func
+    return decorator
+
+
+def run_cli(args: list, env: dict = None) -> tuple:
+    """
+    Run the `prairie` CLI in-process, and return the click result and the
+    wall-clock duration in seconds.
+    """
+    from .main import cli
+
+    runner = click.testing.CliRunner()
+    start = time.perf_counter()
+    result = runner.invoke(cli, args, env=env, catch_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    # The CLI attached its sinks to the runner's (now closed) streams
+    loguru.logger.remove()
+    return result, elapsed
+
+
+def time_cli(args: list, daemon: FakeDockerDaemon, repeat: int = 5, warmup: int = 1) -> tuple:
+    """
+    Run a CLI command `repeat` times (after `warmup` untimed runs) against a
+    running fake daemon, and return the lists of wall-clock times and of
+    overheads (wall-clock time minus scripted daemon latency).
+    """
+    for _ in range(warmup):
+        run_cli(args, env=daemon.environ())
+
+    walls = []
+    overheads = []
+    for _ in range(repeat):
+        scripted_before = daemon.scripted_seconds
+        result, elapsed = run_cli(args, env=daemon.environ())
+        if result.exit_code != 0:
+            raise RuntimeError(f"`prairie {' '.join(args)}` failed: {result.output}") from result.exception
+        walls.append(elapsed)
+        overheads.append(elapsed - (daemon.scripted_seconds - scripted_before))
+    return walls, overheads
+
+
+def measure_cli_overhead(args: list, daemon: FakeDockerDaemon, repeat: int = 5, warmup: int = 1) -> dict:
+    """
+    Summarize the wall-clock time and overhead of a CLI command run against a
+    running fake daemon.
+    """
+    walls, overheads = time_cli(args, daemon, repeat=repeat, warmup=warmup)
+    return {
+        "command": " ".join(args),
+        "runs": repeat,
+        "wall_min": min(walls),
+        "wall_median": statistics.median(walls),
+        "overhead_min": min(overheads),
+        "overhead_median": statistics.median(overheads),
+    }
+
+
+def benchmark_docker_commands(repeat: int = 5, latencies: dict = None) -> list:
+    """
+    Measure the overhead of `docker status`, `docker update` and `docker launch`
+    against a fresh fake daemon with optional scripted `latencies`.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as course_dir, FakeDockerDaemon(latencies=latencies) as daemon:
+        daemon.add_image(PRAIRIELEARN_IMAGE)
+        daemon.add_container(PRAIRIELEARN_IMAGE, ports={3000: 3000}, volumes={course_dir: {"bind": "/course"}})
+
+        results.append(measure_cli_overhead(["docker", "status"], daemon, repeat=repeat))
+        results.append(measure_cli_overhead(["docker", "update"], daemon, repeat=repeat))
+        results.append(measure_cli_overhead(["docker", "launch", "--course-dir", course_dir], daemon, repeat=repeat))
+
+    return results
+
+
+# ---- registered benchmarks -----------------------------------------------
+
+def _time_startup(pycache_prefix: str) -> float:
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_root, env.get("PYTHONPATH")]))
+    env["PYTHONPYCACHEPREFIX"] = pycache_prefix
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "prairie.main", "--version"], env=env, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+@benchmark("startup-cold", "`prairie --version` in a fresh interpreter, without cached bytecode")
+def _startup_cold(repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as pycache_prefix:
+            samples.append(_time_startup(pycache_prefix))
+    return samples
+
+
+@benchmark("startup-warm", "`prairie --version` in a fresh interpreter, with cached bytecode")
+def _startup_warm(repeat: int) -> list:
+    with tempfile.TemporaryDirectory() as pycache_prefix:
+        _time_startup(pycache_prefix)
+        return [_time_startup(pycache_prefix) for _ in range(repeat)]
+
+
+def _status_benchmark(containers: int):
+    def run(repeat: int) -> list:
+        with FakeDockerDaemon() as daemon:
+            daemon.add_image(PRAIRIELEARN_IMAGE)
+            for idx in range(containers):
+                daemon.add_container(PRAIRIELEARN_IMAGE, ports={3000 + idx: 3000 + idx})
+            _, overheads = time_cli(["docker", "status"], daemon, repeat=repeat)
+        return overheads
+    return run
+
+
+for _count in (1, 10, 100):
+    benchmark(f"status-{_count}", f"`docker status` overhead with {_count} PrairieLearn container(s)")(_status_benchmark(_count))
+
+
+@benchmark("launch-to-ready", "`docker launch` until the container is reported running")
+def _launch_to_ready(repeat: int) -> list:
+    samples = []
+    with tempfile.TemporaryDirectory() as course_dir, FakeDockerDaemon() as daemon:
+        client = daemon.client()
+        args = ["docker", "launch", "--course-dir", course_dir]
+        run_cli(args, env=daemon.environ())
+        for _ in range(repeat):
+            known = set(daemon.containers)
+            start = time.perf_counter()
+            result, _ = run_cli(args, env=daemon.environ())
+            if result.exit_code != 0:
+                raise RuntimeError(f"`prairie {' '.join(args)}` failed: {result.output}") from result.exception
+            (container_id,) = set(daemon.containers) - known
+            while client.containers.get(container_id).status != "running":
+                time.sleep(0.001)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+
+def _index_benchmark(questions: int):
+    def run(repeat: int) -> list:
+        with tempfile.TemporaryDirectory() as course_dir:
+            synth.synthesize_course(course_dir, questions=questions, seed=questions)
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                index.index_course(course_dir)
+                samples.append(time.perf_counter() - start)
+        return samples
+    return run
+
+
+for _count in (100, 1000, 10000):
+    benchmark(f"index-{_count}", f"Indexing a synthetic course of {_count} questions")(_index_benchmark(_count))
+
+
+# ---- running and history ---------------------------------------------------
+
+def summarize(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def run_benchmarks(names: list = None, repeat: int = 5) -> dict:
+    """
+    Run the named benchmarks (all of them by default), and return a summary
+    of each, keyed by name.
+    """
+    names = names or list(BENCHMARKS)
+    results = {}
+    for name in names:
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark '{name}', expected one of: {', '.join(BENCHMARKS)}.")
+        _, func = BENCHMARKS[name]
+        loguru.logger.info(f"Running benchmark {name} ({repeat} runs).")
+        results[name] = summarize(func(repeat))
+    return results
+
+
+def default_history_path() -> str:
+    return os.path.join(paths.user_cache_dir(), HISTORY_FILENAME)
+
+
+def load_history(path: str) -> list:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f).get("runs", [])
+
+
+def append_history(path: str, results: dict, label: str = None) -> dict:
+    """
+    Append a run to the JSON history file (written atomically), and return it.
+    """
+    entry = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "label": label,
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    runs = load_history(path) + [entry]
+    with paths.atomic_write(path) as f:
+        json.dump({"runs": runs}, f, indent=2)
+    return entry
+
+
+def compare_runs(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    """
+    Compare the medians of two history entries, and return one row per
+    benchmark present in both: (name, baseline median, current median,
+    relative change, regressed?).
+    """
+    rows = []
+    for name, stats in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        after = stats["median"]
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+# ---- command line ------------------------------------------------------------
+
+@click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def bench():
+    """⏱️  Benchmark prairie commands and track the results over time."""
+
+
+@bench.command("list")
+def list_benchmarks():
+    """List the available benchmarks."""
+    for name, (description, _) in BENCHMARKS.items():
+        click.echo(f"{click.style(name, bold=True):<30} {description}")
+
+
+@bench.command("run")
+@click.option('--only', multiple=True, help='Only run this benchmark. Can specify multiple times.')
+@click.option('--repeat', default=5, type=int, help='Number of timed runs per benchmark.')
+@click.option('--label', default=None, help='Label stored with the results, e.g., a branch name.')
+@click.option('--save/--no-save', default=True, help='Append the results to the history file.')
+@click.option('--history', 'history_path', default=None, type=click.Path(dir_okay=False), help='History file (defaults to the user cache directory).')
+def run(only, repeat, label, save, history_path):
+    """Run benchmarks and record the results."""
+    try:
+        results = run_benchmarks(list(only), repeat=repeat)
+    except ValueError as ve:
+        raise click.BadParameter(str(ve), param_hint="--only")
+
+    for name, stats in results.items():
+        click.echo(f"{name:<20} median {stats['median'] * 1000:9.2f} ms   min {stats['min'] * 1000:9.2f} ms   ({stats['runs']} runs)")
+
+    if save:
+        history_path = history_path or default_history_path()
+        append_history(history_path, results, label=label)
+        click.echo(f"Results appended to {history_path}")
+
+
+@bench.command()
+@click.option('--baseline', default=-2, type=int, help='Index of the baseline run in the history (default: the run before the latest).')
+@click.option('--threshold', default=0.10, type=float, help='Relative slowdown of the median flagged as a regression (default: 0.10).')
+@click.option('--history', 'history_path', default=None, type=click.Path(dir_okay=False), help='History file (defaults to the user cache directory).')
+def compare(baseline, threshold, history_path):
+    """Compare the latest run with a baseline run, and flag regressions."""
+    runs = load_history(history_path or default_history_path())
+    if len(runs) < 2:
+        raise click.ClickException("At least two recorded runs are needed to compare.")
+    try:
+        base = runs[baseline]
+    except IndexError:
+        raise click.BadParameter(f"There are only {len(runs)} runs in the history.", param_hint="--baseline")
+    current = runs[-1]
+
+    click.echo(f"Baseline: {base['timestamp']} {base.get('label') or ''}")
+    click.echo(f"Current:  {current['timestamp']} {current.get('label') or ''}")
+    regressions = 0
+    for name, before, after, change, regressed in compare_runs(base, current, threshold):
+        color = "red" if regressed else ("green" if change < 0 else None)
+        click.echo(f"{name:<20} {before * 1000:9.2f} ms -> {after * 1000:9.2f} ms  " + click.style(f"{change:+.1%}", fg=color))
+        regressions += regressed
+
+    if regressions:
+        raise click.ClickException(f"{regressions} benchmark(s) regressed by more than {threshold:.0%}.")
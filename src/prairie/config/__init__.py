@@ -0,0 +1,35 @@
+import click
+import click_help_colors
+import loguru
+
+from . import profiles
+
+@click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def config():
+    """Configuration related commands (prairie.yaml)."""
+    loguru.logger.info("Executing configuration related commands.")
+
+
+@config.command("explain")
+@click.option('--profile', 'profile_name', default=None, help='📋 Profile of prairie.yaml to resolve (defaults to the "defaults" section only).')
+@click.option('--config', 'config_path', default=None, type=click.Path(exists=True, dir_okay=False), help='📄 Path of prairie.yaml (defaults to the nearest one in this directory or its parents).')
+def explain_command(profile_name, config_path):
+    """🔎 Show the resolved launch settings, and where each one comes from."""
+    config_path = config_path or profiles.find_config()
+    try:
+        resolved = profiles.resolve(profile_name, config_path=config_path)
+    except profiles.ConfigError as e:
+        raise click.ClickException(str(e))
+
+    click.echo(click.style(f"Configuration: {config_path or 'no ' + profiles.CONFIG_FILENAME + ' found'}", bold=True, fg="green"))
+    if profile_name:
+        click.echo(click.style(f"Profile: {profile_name}", bold=True, fg="green"))
+    width = max(len(setting) for setting in resolved)
+    for setting, (value, source) in resolved.items():
+        if isinstance(value, list):
+            value = ", ".join(value) or "-"
+        elif value is None:
+            value = "-"
+        click.echo(f"{setting:<{width}}  {str(value):<30} " + click.style(f"[{source}]", fg="blue"))
+    mirror, source = profiles.registry_mirror(config_path)
+    click.echo(f"{'mirror':<{width}}  {mirror or '-':<30} " + click.style(f"[{source or 'not configured'}]", fg="blue"))
@@ -0,0 +1,279 @@
+"""
+Launch profiles declared in a project-level ``prairie.yaml``.
+
+A ``prairie.yaml`` (looked up from the current directory upwards) declares
+default launch settings and named profiles::
+
+    defaults:
+      version: us-prod-live
+    profiles:
+      dev:
+        course_dirs: [./my-course]
+        port: 3001
+        external_grader: true
+        job_dir: ~/var/pl_jobs
+        cpus: 2
+        memory: 4g
+    mirror: lab-server.local:5000
+
+Relative paths are relative to the directory of ``prairie.yaml``. A setting
+comes, by decreasing priority, from the command line, the profile, the
+``defaults`` section, or the built-in default; every resolved value keeps
+track of its source, which ``prairie config explain`` shows.
+
+The optional ``mirror`` is a pull-through registry (see ``prairie docker
+mirror``) that images are pulled from, rather than from Docker Hub; the
+PRAIRIE_MIRROR environment variable takes precedence over it.
+
+Parsing YAML and validating every profile is by far the slowest part of a
+launch that does not pull: the validated profiles are cached (as JSON, in the
+user cache directory) along with the mtime and size of ``prairie.yaml``, and
+only re-resolved when the file changes.
+"""
+
+import os
+import re
+
+import loguru
+
+from .. import paths
+
+CONFIG_FILENAME = "prairie.yaml"
+CACHE_DIRNAME = "config"
+CACHE_VERSION = 2
+
+# Launch settings, with their built-in defaults
+SETTINGS = {
+    "course_dirs": [],
+    "version": "us-prod-live",
+    "port": 3000,
+    "job_dir": None,
+    "force_job_dir": False,
+    "external_grader": False,
+    "archive_logs": False,
+    "cpus": None,
+    "cpuset": None,
+    "memory": None,
+    "shm_size": None,
+}
+PATH_SETTINGS = ("course_dirs", "job_dir")
+
+_SIZE = re.compile(r"^\d+(\.\d+)?\s*[bkmg]?b?$", re.IGNORECASE)
+_MIRROR = re.compile(r"^[A-Za-z0-9.\-]+(:\d+)?$")
+_CPUSET = re.compile(r"^(auto|\d+(-\d+)?(,\d+(-\d+)?)*)$")
+
+DEFAULT_SOURCE = "built-in default"
+COMMAND_LINE_SOURCE = "command line"
+MIRROR_ENVIRONMENT_VARIABLE = "PRAIRIE_MIRROR"
+
+
+class ConfigError(ValueError):
+    """
+    An invalid ``prairie.yaml``, or an unknown profile.
+    """
+
+
+def find_config(start: str = None) -> str:
+    """
+    Return the path of the nearest ``prairie.yaml`` in `start` (by default, the
+    current directory) or its parents, or None.
+    """
+    directory = os.path.abspath(start or os.getcwd())
+    while True:
+        candidate = os.path.join(directory, CONFIG_FILENAME)
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def _validate(key: str, value, where: str, base_dir: str):
+    """
+    Check (and normalize) the value of a setting.
+    """
+    def fail(expected):
+        raise ConfigError(f"{where}: expected {expected}, got {value!r}.")
+
+    if key not in SETTINGS:
+        raise ConfigError(f"{where}: unknown setting '{key}' (expected one of: {', '.join(SETTINGS)}).")
+    if value is None:
+        return None
+    if key == "course_dirs":
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            fail("a list of directories")
+        return [os.path.normpath(os.path.join(base_dir, os.path.expanduser(item))) for item in value]
+    if key == "job_dir":
+        if not isinstance(value, str):
+            fail("a directory")
+        return os.path.normpath(os.path.join(base_dir, os.path.expanduser(value)))
+    if key == "port":
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 < value < 65536:
+            fail("a port number")
+        return value
+    if key in ("force_job_dir", "external_grader", "archive_logs"):
+        if not isinstance(value, bool):
+            fail("true or false")
+        return value
+    if key == "cpus":
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            fail("a positive number of CPUs")
+        return float(value)
+    if key == "cpuset":
+        if not _CPUSET.match(str(value)):
+            fail("a list of cores such as 0-3,6, or auto")
+        return str(value)
+    if key in ("memory", "shm_size"):
+        if not _SIZE.match(str(value)):
+            fail("a size such as 512m or 4g")
+        return str(value)
+    if not isinstance(value, str):
+        fail("a string")
+    return value
+
+
+def _line_numbers(node, prefix: tuple = (), lines: dict = None) -> dict:
+    """
+    Map the key paths of a composed YAML mapping to their line numbers.
+    """
+    import yaml
+
+    lines = {} if lines is None else lines
+    if isinstance(node, yaml.MappingNode):
+        for key_node, value_node in node.value:
+            path = prefix + (key_node.value,)
+            lines[path] = key_node.start_mark.line + 1
+            _line_numbers(value_node, path, lines)
+    return lines
+
+
+def parse_config(path: str) -> dict:
+    """
+    Parse and validate ``prairie.yaml``, and return its resolved sections:
+    {"defaults": {setting: (value, source)}, "profiles": {name: {...}},
+    "mirror": (value, source) or None}.
+    """
+    import yaml
+
+    with open(path) as f:
+        text = f.read()
+    name = os.path.basename(path)
+    try:
+        loader = yaml.SafeLoader(text)
+        try:
+            node = loader.get_single_node()
+            data = loader.construct_document(node) if node is not None else None
+        finally:
+            loader.dispose()
+    except yaml.YAMLError as e:
+        raise ConfigError(f"{path}: invalid YAML: {e}")
+    data = data or {}
+    if not isinstance(data, dict):
+        raise ConfigError(f"{path}: expected a mapping with 'defaults' and 'profiles'.")
+    unknown = set(data) - {"defaults", "profiles", "mirror"}
+    if unknown:
+        raise ConfigError(f"{path}: unknown section(s): {', '.join(sorted(map(str, unknown)))} (expected 'defaults', 'profiles' and 'mirror').")
+
+    lines = _line_numbers(node) if node is not None else {}
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    def section(values, key_path: tuple) -> dict:
+        if values is None:
+            return {}
+        if not isinstance(values, dict):
+            raise ConfigError(f"{name}:{lines.get(key_path, 1)}: '{'.'.join(key_path)}' should be a mapping of settings.")
+        resolved = {}
+        for key, value in values.items():
+            setting_path = key_path + (key,)
+            where = f"{name}:{lines.get(setting_path, 1)} ({'.'.join(map(str, setting_path))})"
+            resolved[key] = (_validate(key, value, where, base_dir), where)
+        return resolved
+
+    profiles = data.get("profiles") or {}
+    if not isinstance(profiles, dict):
+        raise ConfigError(f"{name}:{lines.get(('profiles',), 1)}: 'profiles' should be a mapping of profile names to settings.")
+    mirror = data.get("mirror")
+    if mirror is not None and not _MIRROR.match(str(mirror)):
+        raise ConfigError(f"{name}:{lines.get(('mirror',), 1)} (mirror): expected a registry such as lab-server.local:5000, got {mirror!r}.")
+    return {
+        "defaults": section(data.get("defaults"), ("defaults",)),
+        "profiles": {str(profile): section(values, ("profiles", profile)) for profile, values in profiles.items()},
+        "mirror": None if mirror is None else (str(mirror), f"{name}:{lines.get(('mirror',), 1)} (mirror)"),
+    }
+
+
+def load_config(path: str) -> dict:
+    """
+    Return the resolved sections of ``prairie.yaml`` (see :func:`parse_config`),
+    from the cache if the file has not changed since it was last resolved.
+    """
+    stat = os.stat(path)
+    # The cache is only used while the file has the same path, size and modification time
+    key = {"version": CACHE_VERSION, "path": os.path.abspath(path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    cache_path = paths.cache_path(CACHE_DIRNAME, os.path.abspath(path))
+    cached = paths.load_json_cache(cache_path, key, config=None)["config"]
+    if cached is not None:
+        loguru.logger.debug(f"Using the cached resolution of {path}.")
+        return {
+            "defaults": {setting: tuple(entry) for setting, entry in cached["defaults"].items()},
+            "profiles": {
+                profile: {setting: tuple(entry) for setting, entry in settings.items()}
+                for profile, settings in cached["profiles"].items()
+            },
+            "mirror": tuple(cached["mirror"]) if cached["mirror"] else None,
+        }
+
+    config = parse_config(path)
+    paths.save_json_cache(cache_path, {"version": key, "config": config})
+    return config
+
+
+def resolve(profile: str = None, overrides: dict = None, config_path: str = None) -> dict:
+    """
+    Resolve the launch settings as {setting: (value, source)}.
+
+    `overrides` are the values given on the command line (None for options
+    that were not given); `config_path` defaults to the nearest
+    ``prairie.yaml``.
+    """
+    config_path = config_path or find_config()
+    config = load_config(config_path) if config_path else {"defaults": {}, "profiles": {}, "mirror": None}
+    if profile is not None and profile not in config["profiles"]:
+        if not config_path:
+            raise ConfigError(f"Unknown profile '{profile}': no {CONFIG_FILENAME} found in this directory or its parents.")
+        available = ", ".join(config["profiles"]) or "none"
+        raise ConfigError(f"Unknown profile '{profile}' in {config_path} (available profiles: {available}).")
+
+    resolved = {setting: (default, DEFAULT_SOURCE) for setting, default in SETTINGS.items()}
+    resolved.update(config["defaults"])
+    if profile is not None:
+        resolved.update(config["profiles"][profile])
+    for setting, value in (overrides or {}).items():
+        if value is not None and value != ():
+            resolved[setting] = (list(value) if isinstance(value, tuple) else value, COMMAND_LINE_SOURCE)
+    return resolved
+
+
+def values(resolved: dict) -> dict:
+    """
+    Drop the sources of resolved settings.
+    """
+    return {setting: value for setting, (value, _) in resolved.items()}
+
+
+def registry_mirror(config_path: str = None) -> tuple:
+    """
+    Return the registry mirror to pull images through and its source, from
+    the PRAIRIE_MIRROR environment variable or the nearest ``prairie.yaml``,
+    or (None, None).
+    """
+    mirror = os.environ.get(MIRROR_ENVIRONMENT_VARIABLE)
+    if mirror:
+        return mirror, f"{MIRROR_ENVIRONMENT_VARIABLE} environment variable"
+    config_path = config_path or find_config()
+    if not config_path:
+        return None, None
+    return load_config(config_path)["mirror"] or (None, None)
@@ -0,0 +1,356 @@
+import json
+import os
+import time
+
+import click
+import click_help_colors
+import loguru
+
+from .. import profiling
+from ..daemon import server as daemon_server
+from ..docker import bundle as bundle_helpers
+from . import assets, diff, elements, helpers, images, index, lint, pack, search, synth
+
+@click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def course():
+    """Course related commands."""
+    loguru.logger.info("Executing course related commands.")
+
+
+@course.command("synth")
+@click.option('--output', '-o', 'output_dir', required=True, type=click.Path(file_okay=False), help='📁 Directory to write the synthetic course to. (Mandatory)')
+@click.option('--questions', default=100, type=int, help='Number of questions to generate.')
+@click.option('--instances', default=1, type=int, help='Number of course instances to generate.')
+@click.option('--assessments', default=10, type=int, help='Number of assessments per course instance.')
+@click.option('--assets-size', default="0", help='Size of the client file generated per question (e.g., 64K, 1M); 0 for none.')
+@click.option('--seed', default=0, type=int, help='Seed of the generator: the same seed always produces the same course.')
+@click.option('--force', is_flag=True, default=False, help='Write into the output directory even if it is not empty.')
+def synth_command(output_dir, questions, instances, assessments, assets_size, seed, force):
+    """🧪 Generate a synthetic PrairieLearn course for scale testing."""
+    try:
+        assets_size = helpers.parse_size(assets_size)
+    except ValueError as ve:
+        raise click.BadParameter(str(ve), param_hint="--assets-size")
+
+    if os.path.isdir(output_dir) and os.listdir(output_dir) and not force:
+        raise click.ClickException(f"The output directory '{output_dir}' is not empty (use --force to write into it anyway).")
+
+    start = time.perf_counter()
+    with profiling.span("course.synth", questions=questions):
+        stats = synth.synthesize_course(
+            output_dir,
+            questions=questions,
+            instances=instances,
+            assessments_per_instance=assessments,
+            assets_size=assets_size,
+            seed=seed,
+        )
+    elapsed = time.perf_counter() - start
+
+    click.echo(f"Generated {stats['questions']} question(s) and {stats['assessments']} assessment(s) in {output_dir}: "
+               f"{stats['files']} file(s), {helpers.format_size(stats['bytes'])} in {elapsed:.2f}s.")
+
+
+@course.command("info")
+@click.argument('course_dir', type=click.Path(exists=True, file_okay=False))
+def info_command(course_dir):
+    """📚 Summarize the content of a course."""
+    try:
+        summary = daemon_server.execute("course.summary", root=os.path.abspath(course_dir))
+    except daemon_server.DaemonError as e:
+        raise click.ClickException(str(e))
+    click.echo(click.style(f"{summary['name'] or '?'}: {summary['title'] or 'untitled'}", bold=True, fg="green"))
+    click.echo(f"{summary['questions']} question(s), {summary['course_instances']} course instance(s), {summary['assessments']} assessment(s).")
+    for path, error in summary["errors"]:
+        click.echo(click.style(f"• {path}: {error}", fg="red"))
+
+
+@course.command("search")
+@click.argument('query')
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to search (defaults to the current directory).')
+@click.option('--limit', default=10, type=int, help='Maximum number of questions to show.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the results as JSON.')
+def search_command(query, course_dir, limit, as_json):
+    """🔎 Search the questions of a course (titles, topics, tags, question.html and server.py)."""
+    with profiling.span("course.search"):
+        try:
+            results = daemon_server.execute("course.search", root=os.path.abspath(course_dir), query=query, limit=limit)
+        except daemon_server.DaemonError as e:
+            raise click.ClickException(str(e))
+    if as_json:
+        click.echo(json.dumps(results, indent=2))
+        return
+    if not results:
+        click.echo(f"No question matches '{query}'.")
+        return
+    for result in results:
+        click.echo(click.style(result["qid"], bold=True, fg="green") + f"  {result['title']}  " + click.style(f"({result['score']:.2f})", fg="blue"))
+        if result["snippet"]:
+            click.echo(f"    {result['snippet']}")
+
+
+@course.command("elements")
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to scan (defaults to the current directory).')
+@click.option('--jobs', '-j', default=None, type=int, help='Number of processes scanning files (defaults to the number of CPUs).')
+@click.option('--attributes', 'show_attributes', is_flag=True, default=False, help='Also show the usage of every attribute.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the usage as JSON.')
+def elements_command(course_dir, jobs, show_attributes, as_json):
+    """🧩 Count the pl-* elements and attributes the questions use, and flag deprecated ones."""
+    start = time.perf_counter()
+    with profiling.span("course.elements"):
+        usage = elements.element_usage(course_dir, jobs=jobs)
+    elapsed = time.perf_counter() - start
+    if as_json:
+        click.echo(json.dumps(usage, indent=2))
+        return
+
+    click.echo(click.style(f"{'Element':<32} {'Uses':>8} {'Questions':>10}", bold=True, fg="green"))
+    for element, entry in usage["elements"].items():
+        click.echo(f"{element:<32} {entry['occurrences']:>8} {entry['questions']:>10}")
+        if show_attributes:
+            for attribute, attribute_entry in sorted(entry["attributes"].items()):
+                click.echo(click.style(f"  {attribute:<30} {attribute_entry['occurrences']:>8} {attribute_entry['questions']:>10}", fg="blue"))
+    if usage["deprecated"]:
+        click.echo(click.style("\nDeprecated:", bold=True, fg="yellow"))
+        for name, entry in usage["deprecated"].items():
+            qids = entry["questions"]
+            more = f" and {len(qids) - 10} more" if len(qids) > 10 else ""
+            click.echo(click.style(f"• {name}", fg="yellow") + f" ({entry['replacement']}): {', '.join(qids[:10])}{more}")
+    click.echo(f"\n{usage['files']} question(s), {usage['scanned']} file(s) scanned in {elapsed:.2f}s.")
+
+
+@course.command("assets")
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to inspect (defaults to the current directory).')
+@click.option('--top', default=10, type=int, help='Number of largest files to show.')
+@click.option('--link', 'link_duplicates', is_flag=True, default=False, help='🔗 Replace duplicates with symbolic links to one copy in clientFilesCourse.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the report as JSON.')
+def assets_command(course_dir, top, link_duplicates, as_json):
+    """🗂️  Report duplicated and large client files (and optionally deduplicate them)."""
+    start = time.perf_counter()
+    with profiling.span("course.assets"):
+        report = assets.asset_report(course_dir, top=top)
+        if link_duplicates:
+            report["freed"] = assets.link_duplicates(os.path.abspath(course_dir), report["duplicates"])
+    elapsed = time.perf_counter() - start
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    click.echo(f"{report['files']} client file(s), {helpers.format_size(report['bytes'])}, checked in {elapsed:.2f}s.")
+    if report["duplicates"]:
+        click.echo(click.style(f"\nDuplicates ({helpers.format_size(report['wasted'])} wasted):", bold=True, fg="yellow"))
+        for duplicate in report["duplicates"]:
+            click.echo(f"• {len(duplicate['paths'])} copies of {helpers.format_size(duplicate['size'])}:")
+            for path in duplicate["paths"]:
+                click.echo(click.style(f"    {path}", fg="blue"))
+    else:
+        click.echo("No duplicated client files.")
+    click.echo(click.style("\nLargest files:", bold=True, fg="green"))
+    for asset in report["largest"]:
+        click.echo(f"{helpers.format_size(asset['size']):>12}  {asset['path']}")
+    if link_duplicates:
+        click.echo(f"\nReplaced the duplicates with links, freeing {helpers.format_size(report['freed'])}.")
+
+
+@course.command("optimize-images")
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course whose client files to optimize (defaults to the current directory).')
+@click.option('--max-dimension', default=images.MAX_DIMENSION, type=int, help='📐 Downsize images to at most this many pixels on their longest side.')
+@click.option('--quality', default=images.JPEG_QUALITY, type=click.IntRange(1, 95), help='Quality of recompressed JPEG images.')
+@click.option('--jobs', '-j', default=None, type=int, help='Number of processes recompressing images (defaults to the number of CPUs).')
+@click.option('--manifest', default=None, type=click.Path(dir_okay=False), help='📄 Manifest of processed images (defaults to one in the user cache directory).')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the report as JSON.')
+def optimize_images_command(course_dir, max_dimension, quality, jobs, manifest, as_json):
+    """🖼️  Downsize and recompress the PNG and JPEG client files (requires Pillow)."""
+    start = time.perf_counter()
+    with profiling.span("course.optimize_images"):
+        try:
+            report = images.optimize_images(course_dir, max_dimension=max_dimension, quality=quality, jobs=jobs, manifest=manifest)
+        except ValueError as ve:
+            raise click.ClickException(str(ve))
+    elapsed = time.perf_counter() - start
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    for owner, saved in report["saved"].items():
+        click.echo(f"{helpers.format_size(saved):>12}  {owner}")
+    for path, error in report["errors"]:
+        click.echo(click.style(f"• {path}: {error}", fg="red"))
+    click.echo(f"Optimized {report['optimized']} image(s), saving {helpers.format_size(sum(report['saved'].values()))}; "
+               f"{report['unchanged']} left as is, {report['skipped']} already processed ({elapsed:.2f}s).")
+
+
+@course.command("pack")
+@click.option('--output', '-o', required=True, help='📦 Archive to write, or - for the standard output. (Mandatory)')
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to pack (defaults to the current directory).')
+@click.option('--exclude', '-x', 'excludes', multiple=True, help='Pattern of files or directories to leave out, besides .git, node_modules and caches (repeatable).')
+@click.option('--compression', type=click.Choice(bundle_helpers.COMPRESSIONS), default="gzip", help='🗜️  Compression of the archive (zstd requires the zstandard package).')
+@click.option('--level', default=None, type=int, help='Compression level (defaults to 6 for gzip, 3 for zstd).')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the manifest of the archive as JSON.')
+def pack_command(output, course_dir, excludes, compression, level, as_json):
+    """📦 Pack the files of a course into a deterministic compressed archive."""
+    to_stdout = output == "-"
+    start = time.perf_counter()
+    try:
+        manifest = pack.pack_course(course_dir, click.get_binary_stream("stdout") if to_stdout else output,
+                                    excludes=excludes, compression=compression, level=level)
+    except ValueError as ve:
+        raise click.ClickException(str(ve))
+    # With the archive on the standard output, reports go to the standard error
+    if as_json:
+        click.echo(json.dumps(manifest, indent=2), err=to_stdout)
+        return
+    size = sum(entry["size"] for entry in manifest["files"].values())
+    compressed = "" if to_stdout else f", {helpers.format_size(os.path.getsize(output))} compressed"
+    click.echo(f"Packed {len(manifest['files'])} file(s) ({helpers.format_size(size)}{compressed}) "
+               f"and {len(manifest['links'])} link(s) in {time.perf_counter() - start:.2f}s.", err=to_stdout)
+
+
+@course.command("unpack")
+@click.argument('archive')
+@click.option('--into', 'destination', default=".", type=click.Path(file_okay=False), help='📁 Directory to unpack the course into (defaults to the current directory).')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the counts as JSON.')
+def unpack_command(archive, destination, as_json):
+    """📂 Unpack a course archive (- for the standard input), skipping identical files."""
+    if archive != "-" and not os.path.isfile(archive):
+        raise click.BadParameter(f"File '{archive}' does not exist.", param_hint="ARCHIVE")
+    start = time.perf_counter()
+    try:
+        counts = pack.unpack_course(click.get_binary_stream("stdin") if archive == "-" else archive, destination)
+    except ValueError as ve:
+        raise click.ClickException(str(ve))
+    if as_json:
+        click.echo(json.dumps(counts, indent=2))
+        return
+    click.echo(f"Unpacked {counts['written']} file(s) and {counts['links']} link(s) into {destination}, "
+               f"skipping {counts['skipped']} identical file(s) ({time.perf_counter() - start:.2f}s).")
+
+
+def _echo_section(title: str, section: dict):
+    lines = [f"  + {key}" for key in section["added"]] + [f"  - {key}" for key in section["removed"]]
+    lines += [f"  → {old} renamed to {new}" for old, new in section.get("renamed", [])]
+    for key, changes in section["changed"].items():
+        lines.append(f"  ~ {key}")
+        # Questions and course instances only have changed fields, assessments have their own
+        fields = changes.get("fields", {}) if "fields" in changes or "questions" in changes or "zones" in changes else changes
+        for field, values in fields.items():
+            if field != "other":
+                lines.append(f"      {field}: {json.dumps(values[0])} → {json.dumps(values[1])}")
+        if changes.get("other"):
+            lines.append(f"      also changed: {', '.join(changes['other'])}")
+        if "zones" in changes:
+            lines.append(f"      zones: {json.dumps(changes['zones'][0])} → {json.dumps(changes['zones'][1])}")
+        questions = changes.get("questions", {})
+        lines += [f"      + {qid} in {zone}" for qid, zone in questions.get("added", {}).items()]
+        lines += [f"      - {qid} from {zone}" for qid, zone in questions.get("removed", {}).items()]
+        lines += [f"      {qid} moved from {old} to {new}" for qid, (old, new) in questions.get("moved", {}).items()]
+        lines += [f"      {qid} points: {json.dumps(old)} → {json.dumps(new)}" for qid, (old, new) in questions.get("points", {}).items()]
+    if lines:
+        click.echo(click.style(title, fg="green"))
+        click.echo("\n".join(lines))
+
+
+@course.command("diff")
+@click.argument('old')
+@click.argument('new', required=False)
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course whose git repository the revisions belong to (defaults to the current directory).')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the differences as JSON.')
+def diff_command(old, new, course_dir, as_json):
+    """🔀 Show the semantic differences between two revisions (git revisions or directories) of a course.
+
+    NEW defaults to the course directory itself."""
+    start = time.perf_counter()
+    with profiling.span("course.diff"):
+        try:
+            report = diff.diff_courses(diff.open_side(course_dir, old), diff.open_side(course_dir, new or course_dir))
+        except ValueError as ve:
+            raise click.ClickException(str(ve))
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+        return
+
+    if report["course"]:
+        _echo_section("Course", {"added": [], "removed": [], "changed": {"infoCourse.json": report["course"]}})
+    _echo_section("Questions", report["questions"])
+    if report["tags"]:
+        click.echo(click.style("Tags", fg="green"))
+        for tag, moves in report["tags"].items():
+            click.echo(f"  {tag}: " + " ".join([f"+{qid}" for qid in moves["added"]] + [f"-{qid}" for qid in moves["removed"]]))
+    _echo_section("Course instances", report["course_instances"])
+    _echo_section("Assessments", report["assessments"])
+    for path, error in report["errors"]:
+        click.echo(click.style(f"• Could not parse {path}: {error}", fg="red"))
+    click.echo(f"Compared {report['files']} changed file(s) across {report['directories']} director(ies) "
+               f"in {time.perf_counter() - start:.2f}s.")
+
+
+@course.command("lint")
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to lint (defaults to the current directory).')
+@click.option('--rule', '-r', 'rules', multiple=True, help='Only run this rule (repeatable; see --list-rules).')
+@click.option('--list-rules', is_flag=True, default=False, help='📋 List the rules, including those of plugins, and exit.')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the findings as JSON.')
+def lint_command(course_dir, rules, list_rules, as_json):
+    """🧹 Check the questions and assessments of a course, re-running only the rules whose files changed."""
+    plugins = lint.load_plugins()
+    if plugins:
+        loguru.logger.debug(f"Loaded lint plugins: {', '.join(plugins)}")
+    if list_rules:
+        for name, lint_rule in sorted(lint.RULES.items()):
+            click.echo(f"{click.style(name, fg='green')} (v{lint_rule.version}, {lint_rule.severity}): {lint_rule.description}")
+        return
+    unknown = sorted(set(rules) - set(lint.RULES))
+    if unknown:
+        raise click.BadParameter(f"Unknown rule(s): {', '.join(unknown)}.", param_hint="--rule")
+
+    start = time.perf_counter()
+    with profiling.span("course.lint"):
+        report = lint.lint_course(course_dir, rules=list(rules))
+    errors = sum(finding["severity"] == "error" for finding in report["findings"])
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        for finding in report["findings"]:
+            color = "red" if finding["severity"] == "error" else "yellow"
+            click.echo(f"{finding['path']}: {click.style(finding['rule'], fg=color)} {finding['message']}")
+        click.echo(f"{len(report['findings'])} finding(s) in {report['units']} question(s) and assessment(s); "
+                   f"{report['evaluated']} rule run(s), {report['cached']} cached ({time.perf_counter() - start:.2f}s).")
+    if errors:
+        raise click.ClickException(f"{errors} error(s) found.")
+
+
+@course.command("memory")
+@click.option('--course-dir', default=".", type=click.Path(exists=True, file_okay=False), help='📁 Course to index (defaults to the current directory).')
+@click.option('--budget', default=None, help='Fail if indexing needs more memory than this (e.g., 64M).')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='Print the report as JSON.')
+def memory_command(course_dir, budget, as_json):
+    """🧮 Report the memory that the index of a course uses, per kind of record."""
+    try:
+        budget = helpers.parse_size(budget) if budget is not None else None
+    except ValueError as ve:
+        raise click.BadParameter(str(ve), param_hint="--budget")
+
+    import tracemalloc
+
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        course_index = index.index_course(course_dir)
+        elapsed = time.perf_counter() - start
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    report = {"records": index.memory_usage(course_index), "retained": retained, "peak": peak, "budget": budget, "seconds": elapsed}
+
+    if as_json:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(f"{'':18}{'records':>10}{'bytes':>12}{'per record':>12}")
+        for kind, usage in report["records"].items():
+            per_record = f"{usage['bytes'] / usage['records']:.0f} B" if usage["records"] else "-"
+            click.echo(f"{kind:18}{usage['records']:>10}{helpers.format_size(usage['bytes']):>12}{per_record:>12}")
+            for column, size in usage.get("columns", {}).items():
+                click.echo(click.style(f"  {column:16}{'':>10}{helpers.format_size(size):>12}", dim=True))
+        click.echo(f"Indexing took {elapsed:.2f}s (traced), peaking at {helpers.format_size(peak)}; "
+                   f"the index retains {helpers.format_size(retained)}.")
+    if budget is not None and peak > budget:
+        raise click.ClickException(f"Indexing peaked at {helpers.format_size(peak)}, over the budget of {helpers.format_size(budget)}.")
@@ -0,0 +1,167 @@
+"""
+Duplicated and large client files of a course.
+
+Client files (``clientFilesCourse``, and the ``clientFiles*`` directories of
+course instances, assessments and questions) are bind-mounted into the
+PrairieLearn container and synced with the course: copies of the same PDF or
+image in many questions slow both down.
+
+Finding duplicates does not require hashing every file: files are first
+grouped by size, and only files whose size collides with another's are
+hashed, first on their first :data:`HEAD_BYTES`, and then, if these collide
+too, in full (in a thread pool: hashing releases the GIL). Hard links of the
+same file are counted once.
+
+Duplicates can be replaced with relative symbolic links to a single copy in
+``clientFilesCourse/shared``; each link replaces its file atomically.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import shutil
+
+import loguru
+
+from .. import paths as prairie_paths
+
+CLIENT_FILES_PREFIX = "clientFiles"
+COURSE_FILES_DIR = "clientFilesCourse"
+SHARED_DIR = "shared"
+
+HEAD_BYTES = 1 << 16
+CHUNK_SIZE = 1 << 20
+
+
+def find_assets(root: str) -> list:
+    """
+    Return (relative path, size, (device, inode)) of the regular files in the
+    client file directories of the course at `root`.
+    """
+    assets = []
+
+    def walk(directory: str, in_client_files: bool):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                walk(entry.path, in_client_files or entry.name.startswith(CLIENT_FILES_PREFIX))
+            elif in_client_files and entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                assets.append((os.path.relpath(entry.path, root), stat.st_size, (stat.st_dev, stat.st_ino)))
+
+    walk(root, False)
+    return assets
+
+
+def _hash(path: str, limit: int = None) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    remaining = limit
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            data = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            digest.update(data)
+            if remaining is not None:
+                remaining -= len(data)
+    return digest.hexdigest()
+
+
+def _split(groups, key, executor) -> dict:
+    """
+    Split groups of candidate duplicates by `key` (computed concurrently), and
+    keep the groups that still have several files, as {(size, key): group}.
+    """
+    candidates = [asset for group in groups for asset in group]
+    keys = executor.map(key, candidates)
+    split = {}
+    for asset, asset_key in zip(candidates, keys):
+        split.setdefault((asset[1], asset_key), []).append(asset)
+    return {group_key: group for group_key, group in split.items() if len(group) > 1}
+
+
+def find_duplicates(root: str, assets: list = None, jobs: int = None) -> list:
+    """
+    Return the groups of identical client files, largest waste first, as
+    dictionaries with the size, content hash and relative paths of the files,
+    and the bytes wasted by the copies.
+    """
+    assets = find_assets(root) if assets is None else assets
+    by_size = {}
+    inodes = set()
+    for asset in assets:
+        # A hard link of a file already seen is not a copy
+        if asset[1] == 0 or asset[2] in inodes:
+            continue
+        inodes.add(asset[2])
+        by_size.setdefault(asset[1], []).append(asset)
+    groups = [group for group in by_size.values() if len(group) > 1]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        heads = _split(groups, lambda asset: _hash(os.path.join(root, asset[0]), HEAD_BYTES), executor)
+        # Files no larger than the head are already fully hashed
+        groups = {key: group for key, group in heads.items() if key[0] <= HEAD_BYTES}
+        groups.update(_split([group for key, group in heads.items() if key[0] > HEAD_BYTES], lambda asset: _hash(os.path.join(root, asset[0])), executor))
+
+    duplicates = []
+    for (size, content_hash), group in groups.items():
+        paths = sorted(asset[0] for asset in group)
+        duplicates.append({"hash": content_hash, "size": size, "paths": paths, "wasted": size * (len(paths) - 1)})
+    duplicates.sort(key=lambda duplicate: (-duplicate["wasted"], duplicate["paths"][0]))
+    return duplicates
+
+
+def asset_report(root: str, top: int = 10, jobs: int = None) -> dict:
+    """
+    Return the duplicates and the `top` largest client files of a course.
+    """
+    assets = find_assets(root)
+    duplicates = find_duplicates(root, assets, jobs=jobs)
+    largest = sorted(assets, key=lambda asset: (-asset[1], asset[0]))[:top]
+    return {
+        "files": len(assets),
+        "bytes": sum(asset[1] for asset in assets),
+        "duplicates": duplicates,
+        "wasted": sum(duplicate["wasted"] for duplicate in duplicates),
+        "largest": [{"path": path, "size": size} for path, size, _ in largest],
+    }
+
+
+def _replace_with_link(root: str, path: str, target: str):
+    absolute = os.path.join(root, path)
+    with prairie_paths.atomic_path(absolute) as tmp_path:
+        os.symlink(os.path.relpath(os.path.join(root, target), os.path.dirname(absolute)), tmp_path)
+
+
+def link_duplicates(root: str, duplicates: list) -> int:
+    """
+    Replace duplicated client files with relative symbolic links to one copy
+    in ``clientFilesCourse`` (an existing copy there, or a new one in its
+    ``shared`` directory); return the number of bytes freed.
+    """
+    freed = 0
+    for duplicate in duplicates:
+        paths = duplicate["paths"]
+        in_course = [path for path in paths if path.split(os.sep)[0] == COURSE_FILES_DIR]
+        if in_course:
+            target = in_course[0]
+        else:
+            name = os.path.basename(paths[0])
+            target = os.path.join(COURSE_FILES_DIR, SHARED_DIR, f"{duplicate['hash'][:12]}-{name}")
+            os.makedirs(os.path.join(root, os.path.dirname(target)), exist_ok=True)
+            with prairie_paths.atomic_path(os.path.join(root, target)) as tmp_path:
+                try:
+                    os.link(os.path.join(root, paths[0]), tmp_path)
+                except OSError:
+                    shutil.copy2(os.path.join(root, paths[0]), tmp_path)
+        for path in paths:
+            if path != target:
+                _replace_with_link(root, path, target)
+        freed += duplicate["wasted"]
+        loguru.logger.debug(f"Linked {len(paths)} copies of {target}")
+    return freed
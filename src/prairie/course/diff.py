@@ -0,0 +1,405 @@
+"""
+Semantic differences between two revisions of a course.
+
+Each side of a diff is a git revision of the repository that contains the
+course, or a course directory. Both are seen as Merkle trees: git already
+stores a hash for every tree and file, and a directory is hashed the same way
+(its files like git blobs, its directories from their sorted entries), over
+the ``info*.json`` files only. The two trees are walked level by level, and a
+subtree whose hash is the same on both sides is skipped without being listed:
+diffing two revisions of a huge course only reads the few ``info*.json``
+files that changed, and git is only asked for one listing per level (split
+into as many calls as the limit on the length of command lines requires).
+
+The hashes of files are the same on both kinds of sides, but not those of
+directories (git hashes all the files of a tree): diffing a directory and a
+revision lists every directory of the course, and compares the files.
+
+The files that changed are then parsed into the entries of the course index
+(see :mod:`prairie.course.index`) and compared: questions added, removed,
+renamed (same UUID, new QID) or changed, tags moved between questions, and
+assessments whose questions changed zones or point values.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+
+import loguru
+
+from . import index
+from .index import ASSESSMENTS_DIR, COURSE_INSTANCES_DIR, QUESTIONS_DIR
+
+COURSE_INFO = "infoCourse.json"
+QUESTION_INFO = "info.json"
+COURSE_INSTANCE_INFO = "infoCourseInstance.json"
+ASSESSMENT_INFO = "infoAssessment.json"
+
+# Fields of the questions of assessments that set their points
+POINTS_FIELDS = ("points", "maxPoints", "autoPoints", "maxAutoPoints", "manualPoints")
+
+_TREE, _BLOB = "tree", "blob"
+# Bytes of paths passed to one git call, well under the limit of command lines (32 KiB on Windows)
+_ARGUMENTS_BYTES = 30_000
+# Fields of info files that the index entries keep under another name
+_RENAMED_FIELDS = {"longName"}
+
+
+def _blob_hash(data: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def _tree_hash(entries: dict) -> str:
+    digest = hashlib.sha1()
+    for name, (kind, entry_hash) in sorted(entries.items()):
+        digest.update(f"{kind} {name} {entry_hash}\n".encode())
+    return digest.hexdigest()
+
+
+class GitRevision:
+    """
+    A revision of the git repository that contains the course at `course_dir`.
+    """
+
+    def __init__(self, course_dir: str, revision: str):
+        self.label = revision
+        self.revision = revision
+        self.repository = self._git(course_dir, "rev-parse", "--show-toplevel").strip()
+        self.prefix = self._git(course_dir, "rev-parse", "--show-prefix").strip()
+        try:
+            self._git(self.repository, "rev-parse", "--verify", "--quiet", f"{revision}^{{tree}}")
+        except ValueError:
+            raise ValueError(f"'{revision}' is neither a directory nor a revision of {self.repository}.")
+
+    @staticmethod
+    def _git(directory: str, *args, stdin: bytes = None) -> str:
+        try:
+            result = subprocess.run(["git", "-C", directory, *args], input=stdin, capture_output=True, check=True)
+        except FileNotFoundError:
+            raise ValueError("Diffing revisions requires git.")
+        except OSError as e:
+            # E.g., E2BIG
+            raise ValueError(f"git {args[0]} failed: {e}")
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f"git {args[0]} failed: {e.stderr.decode(errors='replace').strip()}")
+        return result.stdout.decode() if stdin is None else result.stdout
+
+    def listing(self, directories: list) -> dict:
+        """
+        Return {directory: {name: (kind, hash)}} for course directories
+        (relative to the course, "" for its root), in as few git calls as the
+        length of command lines allows.
+        """
+        paths = [f"{self.prefix}{directory}/" if directory else (self.prefix or ".") for directory in directories]
+        batches, size = [[]], 0
+        for path in paths:
+            if batches[-1] and size + len(path) + 1 > _ARGUMENTS_BYTES:
+                batches.append([])
+                size = 0
+            batches[-1].append(path)
+            size += len(path) + 1
+        output = "".join(self._git(self.repository, "ls-tree", "-z", "--full-tree", self.revision, "--", *batch) for batch in batches)
+        listing = {directory: {} for directory in directories}
+        for record in output.split("\0"):
+            if not record:
+                continue
+            meta, path = record.split("\t", 1)
+            _, kind, object_hash = meta.split()
+            directory, _, name = path[len(self.prefix):].rpartition("/")
+            if directory in listing and kind in (_TREE, _BLOB):
+                listing[directory][name] = (kind, object_hash)
+        return listing
+
+    def read(self, files: dict) -> dict:
+        """
+        Return the content of {path: hash} files, in a single git call.
+        """
+        output = self._git(self.repository, "cat-file", "--batch", stdin="".join(f"{h}\n" for h in files.values()).encode())
+        contents = {}
+        position = 0
+        for path in files:
+            header_end = output.index(b"\n", position)
+            size = int(output[position:header_end].split()[2])
+            contents[path] = output[header_end + 1:header_end + 1 + size]
+            position = header_end + 2 + size
+        return contents
+
+
+class Directory:
+    """
+    A course directory, hashed as a Merkle tree of its ``info*.json`` files.
+    """
+
+    def __init__(self, root: str):
+        self.label = root
+        self.root = os.path.abspath(root)
+        self._trees = {}
+        self._hash_tree("", [COURSE_INFO, QUESTIONS_DIR, COURSE_INSTANCES_DIR])
+
+    def _hash_tree(self, directory: str, names: list = None) -> str:
+        absolute = os.path.join(self.root, *directory.split("/"))
+        if names is None:
+            try:
+                names = sorted(entry.name for entry in os.scandir(absolute) if not entry.name.startswith("."))
+            except (FileNotFoundError, NotADirectoryError):
+                return None
+        entries = {}
+        for name in _relevant(directory, names):
+            path = f"{directory}/{name}" if directory else name
+            if os.path.isdir(os.path.join(absolute, name)):
+                tree_hash = self._hash_tree(path)
+                if tree_hash is not None:
+                    entries[name] = (_TREE, tree_hash)
+            elif name.endswith(".json") and os.path.isfile(os.path.join(absolute, name)):
+                with open(os.path.join(absolute, name), "rb") as f:
+                    entries[name] = (_BLOB, _blob_hash(f.read()))
+        if not entries:
+            return None
+        self._trees[directory] = entries
+        return _tree_hash(entries)
+
+    def listing(self, directories: list) -> dict:
+        return {directory: self._trees.get(directory, {}) for directory in directories}
+
+    def read(self, files: dict) -> dict:
+        contents = {}
+        for path in files:
+            with open(os.path.join(self.root, *path.split("/")), "rb") as f:
+                contents[path] = f.read()
+        return contents
+
+
+def _relevant(directory: str, names) -> list:
+    """
+    Return the entries of a course directory that can hold ``info*.json``
+    files of the course index (like :func:`index._find_info_dirs`, the
+    directory of a question or an assessment is not searched further).
+    """
+    names = set(names)
+    top = directory.split("/", 1)[0]
+    if not directory:
+        return sorted(names & {COURSE_INFO, QUESTIONS_DIR, COURSE_INSTANCES_DIR})
+    if top == QUESTIONS_DIR and QUESTION_INFO in names:
+        return [QUESTION_INFO]
+    if top == COURSE_INSTANCES_DIR:
+        if f"/{ASSESSMENTS_DIR}/" in f"{directory}/" and ASSESSMENT_INFO in names:
+            return [ASSESSMENT_INFO]
+        if COURSE_INSTANCE_INFO in names:
+            return sorted(names & {COURSE_INSTANCE_INFO, ASSESSMENTS_DIR})
+    return sorted(name for name in names if not name.startswith("."))
+
+
+def changed_files(old, new) -> tuple:
+    """
+    Walk two Merkle trees level by level, skipping identical subtrees; return
+    ({path: (old hash, new hash)} of the ``info*.json`` files that differ,
+    the number of directories listed).
+    """
+    changed = {}
+    pending = [""]
+    listed = 0
+    while pending:
+        old_listing, new_listing = old.listing(pending), new.listing(pending)
+        listed += len(pending)
+        next_pending = []
+        for directory in pending:
+            old_entries, new_entries = old_listing[directory], new_listing[directory]
+            for name in _relevant(directory, set(old_entries) | set(new_entries)):
+                old_entry, new_entry = old_entries.get(name), new_entries.get(name)
+                if old_entry == new_entry:
+                    continue
+                path = f"{directory}/{name}" if directory else name
+                if any(entry and entry[0] == _TREE for entry in (old_entry, new_entry)):
+                    next_pending.append(path)
+                if name.endswith(".json"):
+                    old_blob = old_entry[1] if old_entry and old_entry[0] == _BLOB else None
+                    new_blob = new_entry[1] if new_entry and new_entry[0] == _BLOB else None
+                    if old_blob != new_blob:
+                        changed[path] = (old_blob, new_blob)
+        pending = next_pending
+    return changed, listed
+
+
+def open_side(course_dir: str, side: str):
+    """
+    Return the tree of one side of a diff: a directory, or a git revision of
+    the repository of `course_dir`.
+    """
+    if os.path.isdir(side):
+        return Directory(side)
+    return GitRevision(course_dir, side)
+
+
+def _parse(path: str, data: bytes, errors: list) -> dict:
+    if data is None:
+        return None
+    try:
+        return json.loads(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        errors.append((path, str(e)))
+        return None
+
+
+def _entity(path: str) -> tuple:
+    """
+    Return the kind and the key (QID, course instance or (instance, AID)) of
+    an ``info*.json`` file.
+    """
+    directory, _, name = path.rpartition("/")
+    if name == COURSE_INFO and not directory:
+        return "course", None
+    if name == QUESTION_INFO and directory.startswith(f"{QUESTIONS_DIR}/"):
+        return "question", directory[len(QUESTIONS_DIR) + 1:]
+    if directory.startswith(f"{COURSE_INSTANCES_DIR}/"):
+        directory = directory[len(COURSE_INSTANCES_DIR) + 1:]
+        if name == COURSE_INSTANCE_INFO:
+            return "course_instance", directory
+        if name == ASSESSMENT_INFO and f"/{ASSESSMENTS_DIR}/" in directory:
+            ciid, _, aid = directory.partition(f"/{ASSESSMENTS_DIR}/")
+            return "assessment", f"{ciid}/{aid}"
+    return None, None
+
+
+def _changed_fields(old: dict, new: dict, ignore=()) -> dict:
+    return {field: [old.get(field), new.get(field)] for field in sorted(set(old) | set(new))
+            if field not in ignore and old.get(field) != new.get(field)}
+
+
+def assessment_questions(zones: list) -> dict:
+    """
+    Return {QID: [(zone, points)]} for the questions of assessment zones,
+    including alternatives (which inherit the points of their group); a
+    question can appear several times.
+    """
+    questions = {}
+    for position, zone in enumerate(zones):
+        zone_name = zone.get("title") or f"zone {position + 1}"
+        for question in zone.get("questions") or []:
+            inherited = {field: question[field] for field in POINTS_FIELDS if field in question}
+            for alternative in question.get("alternatives") or [question]:
+                if "id" in alternative:
+                    points = dict(inherited, **{field: alternative[field] for field in POINTS_FIELDS if field in alternative})
+                    questions.setdefault(alternative["id"], []).append((zone_name, points))
+    return questions
+
+
+def _placements(placements: list, position: int):
+    values = [placement[position] for placement in placements]
+    return values[0] if len(values) == 1 else values
+
+
+def _diff_assessment(old: dict, new: dict) -> dict:
+    changes = {"fields": _changed_fields(old, new, ignore=("zones",))}
+    old_zones, new_zones = old["zones"], new["zones"]
+    old_titles = [zone.get("title") for zone in old_zones]
+    new_titles = [zone.get("title") for zone in new_zones]
+    if old_titles != new_titles:
+        changes["zones"] = [old_titles, new_titles]
+    old_questions, new_questions = assessment_questions(old_zones), assessment_questions(new_zones)
+    questions = {
+        "added": {qid: _placements(new_questions[qid], 0) for qid in sorted(set(new_questions) - set(old_questions))},
+        "removed": {qid: _placements(old_questions[qid], 0) for qid in sorted(set(old_questions) - set(new_questions))},
+        "moved": {},
+        "points": {},
+    }
+    for qid in sorted(set(old_questions) & set(new_questions)):
+        for kind, position in (("moved", 0), ("points", 1)):
+            old_value, new_value = _placements(old_questions[qid], position), _placements(new_questions[qid], position)
+            if old_value != new_value:
+                questions[kind][qid] = [old_value, new_value]
+    changes["questions"] = {kind: entries for kind, entries in questions.items() if entries}
+    return {kind: entries for kind, entries in changes.items() if entries}
+
+
+def diff_courses(old, new) -> dict:
+    """
+    Return the semantic differences between two sides (see :func:`open_side`).
+    """
+    changed, listed = changed_files(old, new)
+    old_contents = old.read({path: hashes[0] for path, hashes in changed.items() if hashes[0]})
+    new_contents = new.read({path: hashes[1] for path, hashes in changed.items() if hashes[1]})
+
+    errors = []
+    entities = {"course": {}, "question": {}, "course_instance": {}, "assessment": {}}
+    entry_functions = {"question": index.question_entry, "course_instance": index.course_instance_entry, "assessment": index.assessment_entry}
+    for path in sorted(changed):
+        kind, key = _entity(path)
+        if kind is None:
+            continue
+        old_info, new_info = _parse(path, old_contents.get(path), errors), _parse(path, new_contents.get(path), errors)
+        entities[kind][key] = (old_info, new_info)
+
+    report = {
+        "from": old.label,
+        "to": new.label,
+        "course": {},
+        "questions": {"added": [], "removed": [], "renamed": [], "changed": {}},
+        "tags": {},
+        "course_instances": {"added": [], "removed": [], "changed": {}},
+        "assessments": {"added": [], "removed": [], "changed": {}},
+        "files": len(changed),
+        "directories": listed,
+        "errors": errors,
+    }
+    if None in entities["course"]:
+        old_info, new_info = entities["course"][None]
+        report["course"] = _changed_fields(old_info or {}, new_info or {})
+
+    for kind, section in (("question", "questions"), ("course_instance", "course_instances"), ("assessment", "assessments")):
+        to_entry = entry_functions[kind]
+        for key, (old_info, new_info) in entities[kind].items():
+            if old_info is None and new_info is None:
+                continue
+            if old_info is None:
+                report[section]["added"].append(key)
+            elif new_info is None:
+                report[section]["removed"].append(key)
+            else:
+                old_entry, new_entry = to_entry(old_info), to_entry(new_info)
+                if kind == "assessment":
+                    changes = _diff_assessment(old_entry, new_entry)
+                else:
+                    changes = _changed_fields(old_entry, new_entry)
+                    # Other keys (e.g., grading options) are only listed by name
+                    others = sorted(field for field in _changed_fields(old_info, new_info) if field not in old_entry and field not in _RENAMED_FIELDS)
+                    if others:
+                        changes["other"] = others
+                if changes:
+                    report[section]["changed"][key] = changes
+
+    renamed = _find_renames(report["questions"], entities["question"])
+    _tag_moves(report, entities["question"], renamed)
+    loguru.logger.debug(f"Diffed {old.label} and {new.label}: listed {listed} director(ies), compared {len(changed)} file(s).")
+    return report
+
+
+def _find_renames(questions: dict, entities: dict) -> dict:
+    """
+    Pair the questions removed and added with the same UUID as renamed;
+    return {new QID: old QID}.
+    """
+    renamed = {}
+    removed = {entities[qid][0].get("uuid"): qid for qid in questions["removed"] if entities[qid][0].get("uuid")}
+    for qid in list(questions["added"]):
+        old_qid = removed.pop(entities[qid][1].get("uuid"), None)
+        if old_qid is not None:
+            questions["renamed"].append([old_qid, qid])
+            questions["added"].remove(qid)
+            questions["removed"].remove(old_qid)
+            renamed[qid] = old_qid
+    return renamed
+
+
+def _tag_moves(report: dict, entities: dict, renamed: dict):
+    for qid, (old_info, new_info) in sorted(entities.items()):
+        if qid in renamed.values():
+            continue
+        if qid in renamed:
+            old_info = entities[renamed[qid]][0]
+        old_tags = set((old_info or {}).get("tags") or [])
+        new_tags = set((new_info or {}).get("tags") or [])
+        for tag in sorted(new_tags - old_tags):
+            report["tags"].setdefault(tag, {"added": [], "removed": []})["added"].append(qid)
+        for tag in sorted(old_tags - new_tags):
+            report["tags"].setdefault(tag, {"added": [], "removed": []})["removed"].append(qid)
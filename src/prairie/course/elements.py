@@ -0,0 +1,172 @@
+"""
+Usage of PrairieLearn elements (``pl-*`` tags) across the questions of a course.
+
+Rather than parsing every ``question.html`` into a DOM, a streaming scanner
+reads each file in chunks and only recognizes the start tags of elements
+(skipping comments), keeping no more than the unfinished tag at the end of a
+chunk between reads. Files are scanned in parallel, in a process pool, and
+while a file is scanned its content is hashed: the results are cached by
+content hash, and the hash of every file by its size and modification time,
+so that a re-run only reads the files that changed.
+"""
+
+import codecs
+import concurrent.futures
+import hashlib
+import os
+import re
+
+from .. import paths
+from .index import QUESTIONS_DIR, _find_info_dirs
+
+CACHE_DIRNAME = "elements"
+CACHE_VERSION = 2
+CHUNK_SIZE = 1 << 16
+
+# Below this number of files to scan, a process pool costs more than it saves
+PARALLEL_THRESHOLD = 64
+
+# Deprecated elements and attributes (as "element" or "element.attribute"),
+# with what to do instead
+DEPRECATED = {
+    "pl-variable-score": "remove it: elements show their own scores",
+    "pl-prairiedraw-figure": "use pl-drawing",
+    "pl-threejs": "use pl-drawing or client-side code",
+    "pl-checkbox.partial-credit-method": "use partial-credit",
+}
+
+_START_TAG = re.compile(
+    r"<!--.*?-->"
+    r"|<(pl-[\w\-]+)((?:\s+[^\s=>/\"']+(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s>\"']+))?)*)\s*/?>",
+    re.DOTALL | re.IGNORECASE,
+)
+_TAG_OPEN = re.compile(r"<pl-", re.IGNORECASE)
+_ATTRIBUTE = re.compile(r"([^\s=>/\"']+)(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s>\"']+))?")
+# An unfinished tag longer than this is not a tag after all
+MAX_PENDING = 1 << 16
+
+
+def scan_tags(chunks):
+    """
+    Yield (element, [attributes]) for every ``pl-*`` start tag in a stream of
+    text chunks.
+    """
+    pending = ""
+    for chunk in chunks:
+        buffer = pending + chunk
+        # Tags are only recognized before a comment that is not closed yet
+        limit, position = len(buffer), 0
+        while True:
+            start = buffer.find("<!--", position)
+            if start < 0:
+                break
+            position = buffer.find("-->", start + 4)
+            if position < 0:
+                limit = start
+                break
+            position += 3
+
+        end = 0
+        for match in _START_TAG.finditer(buffer, 0, limit):
+            end = match.end()
+            if match.group(1):
+                yield match.group(1).lower(), [attribute.lower() for attribute in _ATTRIBUTE.findall(match.group(2))]
+
+        if limit < len(buffer):
+            # Only the end of the comment matters: keep its opening and its last characters
+            pending = "<!--" + buffer[max(limit + 4, len(buffer) - 2):]
+        else:
+            # Keep what may be the beginning of a tag cut by the chunk: the last unmatched "<pl-", or else the last "<"
+            start = buffer.rfind("<", end)
+            for match in _TAG_OPEN.finditer(buffer, end):
+                start = match.start()
+            pending = buffer[start:] if start >= 0 and len(buffer) - start < MAX_PENDING else ""
+
+
+def scan_file(path: str) -> tuple:
+    """
+    Scan a file, and return (the SHA-256 of its content, its element usage as
+    {element: [occurrences, {attribute: occurrences}]}).
+    """
+    digest = hashlib.sha256()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    usage = {}
+
+    def chunks():
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(CHUNK_SIZE)
+                digest.update(data)
+                yield decoder.decode(data, final=not data)
+                if not data:
+                    return
+
+    for element, attributes in scan_tags(chunks()):
+        entry = usage.setdefault(element, [0, {}])
+        entry[0] += 1
+        for attribute in attributes:
+            entry[1][attribute] = entry[1].get(attribute, 0) + 1
+    return digest.hexdigest(), usage
+
+
+def element_usage(root: str, jobs: int = None, deprecated: dict = None) -> dict:
+    """
+    Return the usage of ``pl-*`` elements in the questions of the course at
+    `root`: occurrences and questions per element and attribute, the QIDs that
+    use deprecated elements or attributes, and how many files were scanned.
+    """
+    root = os.path.abspath(root)
+    deprecated = DEPRECATED if deprecated is None else deprecated
+    cache = paths.load_json_cache(paths.cache_path(CACHE_DIRNAME, root), CACHE_VERSION, files={}, results={})
+    files = {}
+    to_scan = []
+    for qid, path in _find_info_dirs(os.path.join(root, QUESTIONS_DIR), "info.json"):
+        html_path = os.path.join(path, "question.html")
+        try:
+            stat = os.stat(html_path)
+        except FileNotFoundError:
+            continue
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cached = cache["files"].get(qid)
+        if cached and cached[:2] == stamp and cached[2] in cache["results"]:
+            files[qid] = cached
+        else:
+            files[qid] = stamp + [None]
+            to_scan.append(qid)
+
+    paths_to_scan = [os.path.join(root, QUESTIONS_DIR, qid, "question.html") for qid in to_scan]
+    if len(paths_to_scan) >= PARALLEL_THRESHOLD and jobs != 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            scanned = list(executor.map(scan_file, paths_to_scan, chunksize=max(len(paths_to_scan) // (4 * (jobs or os.cpu_count() or 1)), 1)))
+    else:
+        scanned = [scan_file(path) for path in paths_to_scan]
+    for qid, (content_hash, usage) in zip(to_scan, scanned):
+        files[qid][2] = content_hash
+        cache["results"][content_hash] = usage
+
+    if to_scan or files.keys() != cache["files"].keys():
+        used_hashes = {stamp[2] for stamp in files.values()}
+        cache = {"version": CACHE_VERSION, "files": files, "results": {h: r for h, r in cache["results"].items() if h in used_hashes}}
+        paths.save_json_cache(paths.cache_path(CACHE_DIRNAME, root), cache)
+
+    elements = {}
+    flagged = {}
+    for qid in sorted(files):
+        for element, (occurrences, attributes) in cache["results"][files[qid][2]].items():
+            entry = elements.setdefault(element, {"occurrences": 0, "questions": 0, "attributes": {}})
+            entry["occurrences"] += occurrences
+            entry["questions"] += 1
+            for attribute, count in attributes.items():
+                attribute_entry = entry["attributes"].setdefault(attribute, {"occurrences": 0, "questions": 0})
+                attribute_entry["occurrences"] += count
+                attribute_entry["questions"] += 1
+            for name in [element] + [f"{element}.{attribute}" for attribute in attributes]:
+                if name in deprecated:
+                    flagged.setdefault(name, []).append(qid)
+
+    return {
+        "elements": dict(sorted(elements.items(), key=lambda item: (-item[1]["occurrences"], item[0]))),
+        "deprecated": {name: {"replacement": deprecated[name], "questions": qids} for name, qids in sorted(flagged.items())},
+        "files": len(files),
+        "scanned": len(to_scan),
+    }
@@ -0,0 +1,52 @@
+import json
+import os
+import re
+
+_SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+_SIZE_UNITS = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_size(value) -> int:
+    """
+    Parse a size such as "512", "64K", "1.5MB" or "2GiB" into a number of bytes.
+    """
+    if isinstance(value, int):
+        return value
+    match = _SIZE_PATTERN.match(str(value))
+    if match is None:
+        raise ValueError(f"Invalid size: '{value}' (expected e.g. 512, 64K, 10MB).")
+    number, unit = match.groups()
+    return int(float(number) * _SIZE_UNITS[unit.lower()])
+
+
+def format_size(size: int) -> str:
+    """
+    Format a number of bytes for humans, e.g., "1.5 MiB".
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if abs(size) < 1024 or unit == "GiB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def read_json(path: str) -> dict:
+    """
+    Read a JSON file, returning None if it does not exist.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_json(path: str, payload: dict) -> int:
+    """
+    Write a JSON file the way PrairieLearn courses format them, and return the
+    number of bytes written.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = (json.dumps(payload, indent=4) + "\n").encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
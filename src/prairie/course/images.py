@@ -0,0 +1,166 @@
+"""
+Recompression of the PNG and JPEG client files of a course.
+
+Every image under the ``clientFiles*`` directories is downsized to at most
+:data:`MAX_DIMENSION` pixels on its longest side and recompressed, in a
+process pool; the result replaces the image (atomically) only if it is
+smaller by at least :data:`MIN_SAVING`.
+
+A manifest, in the user cache directory, records the content hash of every
+image once it has been processed with given settings (whether it was
+replaced or not), along with the size and modification time of the file: a
+re-run only hashes the images whose stamps changed, and only recompresses
+the ones whose content is new, so it is cheap to run after every edit.
+
+Recompression requires the optional `Pillow` package.
+"""
+
+import concurrent.futures
+import hashlib
+import io
+import os
+
+import loguru
+
+from .. import paths
+from . import assets
+
+CACHE_DIRNAME = "images"
+MANIFEST_VERSION = 1
+
+IMAGE_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+MAX_DIMENSION = 1600
+JPEG_QUALITY = 85
+# Recompressed images that do not save at least this fraction are left alone
+MIN_SAVING = 0.02
+
+
+def _pillow():
+    try:
+        import PIL.Image
+        import PIL.ImageOps
+    except ImportError:
+        raise ValueError("Optimizing images requires the optional 'Pillow' package (pip install Pillow).")
+    return PIL
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(1 << 20), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def recompress(path: str, max_dimension: int = MAX_DIMENSION, quality: int = JPEG_QUALITY) -> bytes:
+    """
+    Return the downsized and recompressed content of an image.
+    """
+    PIL = _pillow()
+    image_format = IMAGE_FORMATS[os.path.splitext(path)[1].lower()]
+    with PIL.Image.open(path) as image:
+        if image_format == "JPEG":
+            # The orientation is applied to the pixels, since the EXIF data is not kept
+            image = PIL.ImageOps.exif_transpose(image)
+        if max(image.size) > max_dimension:
+            image.thumbnail((max_dimension, max_dimension), PIL.Image.LANCZOS)
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+        else:
+            image.save(output, "PNG", optimize=True)
+    return output.getvalue()
+
+
+def optimize_image(path: str, max_dimension: int = MAX_DIMENSION, quality: int = JPEG_QUALITY) -> tuple:
+    """
+    Recompress an image in place if that saves enough; return its sizes
+    before and after, and the content hash of the result.
+    """
+    before = os.path.getsize(path)
+    data = recompress(path, max_dimension, quality)
+    if len(data) > before * (1 - MIN_SAVING):
+        return before, before, _hash_file(path)
+
+    with paths.atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+    return before, len(data), hashlib.sha256(data).hexdigest()
+
+
+def _owner(path: str) -> str:
+    """
+    Return the QID (or the course instance, assessment or course directory)
+    that a client file belongs to.
+    """
+    parts = path.split(os.sep)
+    for position, part in enumerate(parts):
+        if part.startswith(assets.CLIENT_FILES_PREFIX):
+            owner = parts[:position]
+            if owner[:1] == ["questions"]:
+                return "/".join(owner[1:])
+            return "/".join(owner) or "(course)"
+    return "(course)"
+
+
+def manifest_path(root: str) -> str:
+    return paths.cache_path(CACHE_DIRNAME, os.path.abspath(root))
+
+
+def optimize_images(root: str, max_dimension: int = MAX_DIMENSION, quality: int = JPEG_QUALITY, jobs: int = None, manifest: str = None) -> dict:
+    """
+    Optimize the new images of the course at `root`, and return the bytes
+    saved per question (or other owner of client files), and the numbers of
+    images optimized, left alone and skipped.
+    """
+    root = os.path.abspath(root)
+    _pillow()
+    settings = f"{max_dimension}/{quality}"
+    manifest_file = manifest or manifest_path(root)
+    state = paths.load_json_cache(manifest_file, MANIFEST_VERSION, files={}, processed={})
+    images = [path for path, _, _ in assets.find_assets(root) if os.path.splitext(path)[1].lower() in IMAGE_FORMATS]
+
+    report = {"optimized": 0, "unchanged": 0, "skipped": 0, "saved": {}, "errors": []}
+    to_process = []
+    for path in images:
+        stat = os.stat(os.path.join(root, path))
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cached = state["files"].get(path)
+        content_hash = cached[2] if cached and cached[:2] == stamp else _hash_file(os.path.join(root, path))
+        state["files"][path] = stamp + [content_hash]
+        if state["processed"].get(content_hash) == settings:
+            report["skipped"] += 1
+        else:
+            to_process.append(path)
+    state["files"] = {path: state["files"][path] for path in images}
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(optimize_image, os.path.join(root, path), max_dimension, quality): path for path in to_process}
+            for future in concurrent.futures.as_completed(futures):
+                path = futures[future]
+                try:
+                    before, after, content_hash = future.result()
+                except Exception as e:
+                    # E.g., a corrupted image, or a file with the wrong extension
+                    report["errors"].append((path, f"{type(e).__name__}: {e}"))
+                    loguru.logger.warning(f"Could not optimize {path}: {e}")
+                    continue
+                stat = os.stat(os.path.join(root, path))
+                state["files"][path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+                state["processed"][content_hash] = settings
+                if after < before:
+                    report["optimized"] += 1
+                    owner = _owner(path)
+                    report["saved"][owner] = report["saved"].get(owner, 0) + before - after
+                else:
+                    report["unchanged"] += 1
+    finally:
+        # Processed images are recorded even if the run is interrupted
+        current = {stamp[2] for stamp in state["files"].values()}
+        state["processed"] = {content_hash: value for content_hash, value in state["processed"].items() if content_hash in current}
+        paths.save_json_cache(manifest_file, state)
+
+    report["saved"] = dict(sorted(report["saved"].items(), key=lambda item: (-item[1], item[0])))
+    return report
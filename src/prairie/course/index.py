@@ -0,0 +1,433 @@
+"""
+In-memory index of the content of a PrairieLearn course.
+
+:func:`index_course` walks a course directory once, with :func:`os.scandir`,
+and collects the course information, every question (found by its
+``info.json``, at any depth under ``questions/``), every course instance and
+every assessment with its zones.
+
+Courses can have 100k questions, so the index is laid out compactly: the
+questions are stored column by column in a :class:`QuestionTable` (UUIDs as
+16 bytes, titles in one UTF-8 buffer, topics, types and tag lists as numbers
+in a :class:`StringTable` of distinct values), and only turned into
+:class:`Question` records when looked up. Records use ``__slots__``, and the
+strings that repeat (tags, topics, QIDs in assessment zones...) are interned.
+:func:`memory_usage` reports the bytes used by each kind of record.
+"""
+
+import array
+import collections.abc
+import hashlib
+import json
+import os
+import re
+import sys
+
+import loguru
+
+from .helpers import read_json
+
+QUESTIONS_DIR = "questions"
+COURSE_INSTANCES_DIR = "courseInstances"
+ASSESSMENTS_DIR = "assessments"
+
+
+class CourseIndex:
+    """
+    The indexed content of a course: questions keyed by QID, course instances
+    keyed by their directory name, and assessments keyed by (instance, AID).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.info = {}
+        self.strings = StringTable()
+        self.questions = QuestionTable(self.strings)
+        self.course_instances = {}
+        self.assessments = {}
+        self.errors = []
+
+    def __repr__(self):
+        return (f"<CourseIndex {self.root!r}: {len(self.questions)} question(s), "
+                f"{len(self.course_instances)} instance(s), {len(self.assessments)} assessment(s)>")
+
+
+class StringTable:
+    """
+    Distinct values (strings, or tuples of strings), numbered in order of
+    first appearance: each is stored once, however many records use it.
+    Lists are stored as tuples; unhashable values raise TypeError.
+    """
+
+    def __init__(self):
+        self.values = []
+        self._numbers = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def number(self, value) -> int:
+        if isinstance(value, list):
+            value = tuple(value)
+        number = self._numbers.get(value)
+        if number is None:
+            number = self._numbers[value] = len(self.values)
+            self.values.append(_intern(value))
+        return number
+
+
+class _Record:
+    """
+    Base of the index records: slotted objects that can also be read like
+    dictionaries (``question["title"]``).
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, field: str):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default=None):
+        return getattr(self, field, default) if field in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+
+class Question(_Record):
+    __slots__ = ("uuid", "title", "topic", "tags", "type")
+
+    def __init__(self, uuid: str, title: str, topic: str, tags: list, type: str):
+        self.uuid = uuid
+        self.title = title
+        self.topic = topic
+        self.tags = tags
+        self.type = type
+
+
+class CourseInstance(_Record):
+    __slots__ = ("uuid", "long_name")
+
+    def __init__(self, uuid: str, long_name: str):
+        self.uuid = uuid
+        self.long_name = long_name
+
+
+class Assessment(_Record):
+    __slots__ = ("uuid", "title", "type", "set", "number", "zones")
+
+    def __init__(self, uuid: str, title: str, type: str, set: str, number: str, zones: list):
+        self.uuid = uuid
+        self.title = title
+        self.type = type
+        self.set = set
+        self.number = number
+        self.zones = zones
+
+
+_NO_UUID = bytes(16)
+_UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+def _pack_uuid(value) -> bytes:
+    """
+    Return the 16 bytes of a UUID in canonical form (None for anything else,
+    which could not be restored exactly).
+    """
+    if isinstance(value, str) and _UUID.fullmatch(value):
+        return bytes.fromhex(value.replace("-", ""))
+    return None
+
+
+class QuestionTable(collections.abc.Mapping):
+    """
+    The questions of a course keyed by QID, stored as a struct of arrays: one
+    compact column per field, and a row number per QID. Looking a question up
+    builds its :class:`Question` record.
+    """
+
+    def __init__(self, strings: StringTable):
+        self._strings = strings
+        self._rows = {}
+        self._uuids = bytearray()
+        self._titles = bytearray()
+        self._title_ends = array.array("Q")
+        self._topics = array.array("I")
+        self._tags = array.array("I")
+        self._types = array.array("I")
+        # Values that do not fit their column (UUIDs that are not UUIDs, titles that are not strings,
+        # unhashable topics, tags and types, e.g. a dictionary in a malformed info file), by row
+        self._other_uuids = {}
+        self._other_titles = {}
+        self._other_topics = {}
+        self._other_tags = {}
+        self._other_types = {}
+
+    def add(self, qid: str, info: dict):
+        """
+        Add a question, from its ``info.json``.
+        """
+        if qid in self._rows:
+            raise ValueError(f"Question {qid} is already indexed.")
+        row = self._rows[sys.intern(qid)] = len(self._rows)
+        entry = question_entry(info)
+
+        packed = _pack_uuid(entry["uuid"])
+        self._uuids += packed or _NO_UUID
+        if packed is None:
+            self._other_uuids[row] = entry["uuid"]
+        if isinstance(entry["title"], str):
+            self._titles += entry["title"].encode("utf-8", "surrogatepass")
+        else:
+            self._other_titles[row] = entry["title"]
+        self._title_ends.append(len(self._titles))
+        for field, column, others in (("topic", self._topics, self._other_topics), ("tags", self._tags, self._other_tags),
+                                      ("type", self._types, self._other_types)):
+            try:
+                column.append(self._strings.number(entry[field]))
+            except TypeError:
+                others[row] = entry[field]
+                column.append(0)
+
+    def __getitem__(self, qid: str) -> Question:
+        row = self._rows[qid]
+        if row in self._other_uuids:
+            question_uuid = self._other_uuids[row]
+        else:
+            digits = self._uuids[16 * row:16 * row + 16].hex()
+            question_uuid = f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+        if row in self._other_titles:
+            title = self._other_titles[row]
+        else:
+            title = self._titles[self._title_ends[row - 1] if row else 0:self._title_ends[row]].decode("utf-8", "surrogatepass")
+        return Question(
+            question_uuid,
+            title,
+            self._value(row, self._topics, self._other_topics),
+            self._value(row, self._tags, self._other_tags),
+            self._value(row, self._types, self._other_types),
+        )
+
+    def _value(self, row: int, column: array.array, others: dict):
+        if row in others:
+            return others[row]
+        value = self._strings.values[column[row]]
+        # JSON has no tuples: they were lists
+        return list(value) if isinstance(value, tuple) else value
+
+    def __contains__(self, qid) -> bool:
+        return qid in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def columns(self) -> dict:
+        """
+        Return the storage of every column, for :func:`memory_usage`.
+        """
+        return {
+            "qids": self._rows,
+            "uuids": (self._uuids, self._other_uuids),
+            "titles": (self._titles, self._title_ends, self._other_titles),
+            "topics": (self._topics, self._other_topics),
+            "tags": (self._tags, self._other_tags),
+            "types": (self._types, self._other_types),
+        }
+
+
+def _find_info_dirs(root: str, info_name: str, rel: str = ""):
+    """
+    Yield (relative path, absolute path) of the directories below `root` that
+    contain `info_name`, without descending into them.
+    """
+    # Only the names of subdirectories are kept while descending: not a DirEntry per question
+    has_info, directories = False, []
+    try:
+        with os.scandir(os.path.join(root, rel) if rel else root) as entries:
+            for entry in entries:
+                if entry.name == info_name and entry.is_file():
+                    has_info = True
+                elif entry.is_dir() and not entry.name.startswith("."):
+                    directories.append(entry.name)
+    except FileNotFoundError:
+        return
+    if has_info:
+        yield rel, os.path.join(root, rel)
+        return
+    for name in sorted(directories):
+        yield from _find_info_dirs(root, info_name, f"{rel}/{name}" if rel else name)
+
+
+def question_entry(info: dict) -> dict:
+    return {
+        "uuid": info.get("uuid"),
+        "title": info.get("title"),
+        "topic": info.get("topic"),
+        "tags": info.get("tags") or [],
+        "type": info.get("type"),
+    }
+
+
+def course_instance_entry(info: dict) -> dict:
+    return {"uuid": info.get("uuid"), "long_name": info.get("longName")}
+
+
+def assessment_entry(info: dict) -> dict:
+    return {
+        "uuid": info.get("uuid"),
+        "title": info.get("title"),
+        "type": info.get("type"),
+        "set": info.get("set"),
+        "number": info.get("number"),
+        "zones": info.get("zones") or [],
+    }
+
+
+def _intern(value):
+    """
+    Return `value` with the strings it contains (values, keys and items, at
+    any depth) interned.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(key): _intern(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_intern(item) for item in value)
+    return value
+
+
+def _load(index: CourseIndex, path: str) -> dict:
+    try:
+        info = read_json(path)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        index.errors.append((os.path.relpath(path, index.root), str(e)))
+        loguru.logger.warning(f"Could not parse {path}: {e}")
+        return None
+    if info is not None and not isinstance(info, dict):
+        index.errors.append((os.path.relpath(path, index.root), f"expected a JSON object, not {type(info).__name__}"))
+        loguru.logger.warning(f"Skipping {path}: it is not a JSON object.")
+        return None
+    return info
+
+
+def index_course(root: str) -> CourseIndex:
+    """
+    Build the index of the course at `root`.
+    """
+    index = CourseIndex(root)
+    index.info = _load(index, os.path.join(root, "infoCourse.json")) or {}
+
+    for qid, path in _find_info_dirs(os.path.join(root, QUESTIONS_DIR), "info.json"):
+        info = _load(index, os.path.join(path, "info.json"))
+        if info is None:
+            continue
+        index.questions.add(qid, info)
+
+    for ciid, path in _find_info_dirs(os.path.join(root, COURSE_INSTANCES_DIR), "infoCourseInstance.json"):
+        info = _load(index, os.path.join(path, "infoCourseInstance.json"))
+        if info is None:
+            continue
+        index.course_instances[ciid] = CourseInstance(**_intern(course_instance_entry(info)))
+
+        for aid, assessment_path in _find_info_dirs(os.path.join(path, ASSESSMENTS_DIR), "infoAssessment.json"):
+            assessment = _load(index, os.path.join(assessment_path, "infoAssessment.json"))
+            if assessment is None:
+                continue
+            index.assessments[(ciid, aid)] = Assessment(**_intern(assessment_entry(assessment)))
+
+    loguru.logger.debug(f"Indexed {index!r}")
+    return index
+
+
+def _deep_size(value, seen: set) -> int:
+    """
+    Return the bytes of `value` and of what it refers to, not counting the
+    objects in `seen` (objects shared by several records are counted once).
+    """
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_deep_size(key, seen) + _deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(_deep_size(item, seen) for item in value)
+    elif isinstance(value, _Record):
+        size += sum(_deep_size(getattr(value, field), seen) for field in value.__slots__)
+    return size
+
+
+def memory_usage(index: CourseIndex) -> dict:
+    """
+    Return the records and bytes of each kind of record of an index (and of
+    each column of its questions).
+    """
+    seen = set()
+    # Shared values first, so that they are not counted in the first record that uses them
+    usage = {"strings": {"records": len(index.strings), "bytes": _deep_size(index.strings.values, seen)}}
+    columns = {name: _deep_size(column, seen) for name, column in index.questions.columns().items()}
+    usage["questions"] = {"records": len(index.questions), "bytes": sum(columns.values()), "columns": columns}
+    usage["course_instances"] = {"records": len(index.course_instances), "bytes": _deep_size(index.course_instances, seen)}
+    usage["assessments"] = {"records": len(index.assessments), "bytes": _deep_size(index.assessments, seen)}
+    usage["course"] = {"records": 1, "bytes": _deep_size(index.info, seen)}
+    return usage
+
+
+def fingerprint(root: str) -> str:
+    """
+    Return a digest of the paths, sizes and modification times of the JSON
+    files of the course at `root`: it changes whenever its index would.
+    """
+    digest = hashlib.sha1()
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                if directory != root or entry.name in (QUESTIONS_DIR, COURSE_INSTANCES_DIR):
+                    stack.append(entry.path)
+            elif entry.name.endswith(".json"):
+                stat = entry.stat()
+                digest.update(f"{entry.path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def referenced_images(root: str) -> list:
+    """
+    Return the Docker images (external graders and workspaces) that the
+    questions of the course at `root` use.
+    """
+    images = set()
+    for _, path in _find_info_dirs(os.path.join(root, QUESTIONS_DIR), "info.json"):
+        try:
+            info = read_json(os.path.join(path, "info.json")) or {}
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+        if not isinstance(info, dict):
+            continue
+        for options in ("externalGradingOptions", "workspaceOptions"):
+            image = info.get(options).get("image") if isinstance(info.get(options), dict) else None
+            if image:
+                images.add(image)
+    return sorted(images)
@@ -0,0 +1,315 @@
+"""
+Rule engine checking the questions and assessments of a course.
+
+Rules are registered with :func:`rule`, and run on one unit at a time (a
+question or an assessment directory), yielding (file, message) findings.
+Each rule declares the files of the unit it reads, as patterns relative to
+the unit directory (and whether it reads ``infoCourse.json``): its findings
+are cached under a key made of its name, its version and the content hashes
+of these files only, so that after an edit only the rules reading the edited
+files re-run, on the units that contain them. Content hashes are themselves
+cached by size and modification time, in the user cache directory.
+
+House rules are plugins: packages registering rules with :func:`rule` when
+imported, and declaring an entry point in the :data:`ENTRY_POINT_GROUP`
+group, e.g. in their ``pyproject.toml``::
+
+    [project.entry-points."prairie.lint_rules"]
+    house = "my_course_rules"
+
+Bump the version of a rule whenever its logic changes, to invalidate its
+cached findings.
+"""
+
+import fnmatch
+import hashlib
+import importlib.metadata
+import os
+import re
+
+import loguru
+
+from .. import paths
+from . import elements
+from .helpers import read_json
+from .index import ASSESSMENTS_DIR, COURSE_INSTANCES_DIR, QUESTIONS_DIR, _find_info_dirs
+
+CACHE_DIRNAME = "lint"
+CACHE_VERSION = 1
+ENTRY_POINT_GROUP = "prairie.lint_rules"
+
+SCOPES = ("question", "assessment")
+SEVERITIES = ("error", "warning")
+
+# Registry of rules: name -> Rule
+RULES = {}
+
+
+class Rule:
+    """
+    A lint rule: `func(context)` yields (file, message) findings for a unit.
+    """
+
+    def __init__(self, name: str, version: int, description: str, scopes, files, course: bool, severity: str, func):
+        self.name = name
+        self.version = version
+        self.description = description
+        self.scopes = tuple(scopes)
+        self.files = tuple(files)
+        self.course = course
+        self.severity = severity
+        self.func = func
+        self._pattern = re.compile("|".join(fnmatch.translate(pattern) for pattern in self.files) or "(?!)")
+
+    def reads(self, path: str) -> bool:
+        return self._pattern.match(path) is not None
+
+
+def rule(name: str, description: str, files, scopes=("question",), version: int = 1, course: bool = False, severity: str = "error"):
+    """
+    Decorator registering a lint rule, reading the `files` (patterns relative
+    to the unit directory) of the units of the given `scopes`, and
+    ``infoCourse.json`` if `course` is set.
+    """
+    if severity not in SEVERITIES:
+        raise ValueError(f"Unknown severity '{severity}', expected one of: {', '.join(SEVERITIES)}.")
+
+    def decorator(func):
+        RULES[name] = Rule(name, version, description, scopes, files, course, severity, func)
+        return func
+    return decorator
+
+
+def load_plugins() -> list:
+    """
+    Import the packages that declare lint rules as entry points; return the
+    names of the entry points loaded.
+    """
+    loaded = []
+    for entry_point in importlib.metadata.entry_points(group=ENTRY_POINT_GROUP):
+        try:
+            entry_point.load()
+            loaded.append(entry_point.name)
+        except Exception as e:
+            loguru.logger.warning(f"Could not load the lint rules of plugin '{entry_point.name}': {e}")
+    return loaded
+
+
+class Context:
+    """
+    What rules see of a unit: its kind, key (QID, or "instance/AID") and
+    directory, its parsed info file, the course information, and its files.
+    """
+
+    def __init__(self, kind: str, key: str, path: str, files: list, course_info: dict):
+        self.kind = kind
+        self.key = key
+        self.path = path
+        self.files = files
+        self.course_info = course_info
+        self._texts = {}
+        self._info = None
+
+    @property
+    def info(self) -> dict:
+        if self._info is None:
+            try:
+                self._info = read_json(os.path.join(self.path, "info.json" if self.kind == "question" else "infoAssessment.json")) or {}
+            except (ValueError, UnicodeDecodeError, FileNotFoundError):
+                self._info = {}
+            if not isinstance(self._info, dict):
+                self._info = {}
+        return self._info
+
+    def read(self, name: str) -> str:
+        """
+        Return the text of a file of the unit ("" if there is none).
+        """
+        if name not in self._texts:
+            try:
+                with open(os.path.join(self.path, name), encoding="utf-8", errors="replace") as f:
+                    self._texts[name] = f.read()
+            except (FileNotFoundError, IsADirectoryError):
+                self._texts[name] = ""
+        return self._texts[name]
+
+
+# ---- built-in rules -------------------------------------------------------
+
+@rule("missing-title", "Questions and assessments need a title.", files=("info.json", "infoAssessment.json"), scopes=SCOPES)
+def _missing_title(context: Context):
+    if not str(context.info.get("title") or "").strip():
+        yield "info.json" if context.kind == "question" else "infoAssessment.json", "no title"
+
+
+@rule("invalid-topic", "The topic of a question must be one of the topics of infoCourse.json.", files=("info.json",), course=True)
+def _invalid_topic(context: Context):
+    topics = {topic.get("name") for topic in context.course_info.get("topics") or [] if isinstance(topic, dict)}
+    topic = context.info.get("topic")
+    if not topic:
+        yield "info.json", "no topic"
+    elif topic not in topics:
+        yield "info.json", f"topic '{topic}' is not defined in infoCourse.json"
+
+
+@rule("deprecated-element", "Elements and attributes that PrairieLearn deprecated.", files=("question.html",))
+def _deprecated_element(context: Context):
+    usage = {}
+    for element, attributes in elements.scan_tags([context.read("question.html")]):
+        for name in [element] + [f"{element}.{attribute}" for attribute in attributes]:
+            usage[name] = usage.get(name, 0) + 1
+    for name, count in sorted(usage.items()):
+        if name in elements.DEPRECATED:
+            yield "question.html", f"{name} is deprecated ({count} use(s)): {elements.DEPRECATED[name]}"
+
+
+_UNSEEDED_RANDOMNESS = [
+    (re.compile(r"\brandom\.seed\(\s*\)"), "random.seed() reseeds from the system"),
+    (re.compile(r"\bseed\(\s*(?:int\()?\s*(?:time|datetime)\b"), "seeding from the clock"),
+    (re.compile(r"\bdefault_rng\(\s*\)"), "numpy.random.default_rng() without a seed"),
+    (re.compile(r"\bRandomState\(\s*\)"), "numpy.random.RandomState() without a seed"),
+    (re.compile(r"\bSystemRandom\b"), "random.SystemRandom cannot be seeded"),
+    (re.compile(r"\bos\.urandom\("), "os.urandom cannot be seeded"),
+    (re.compile(r"\bsecrets\."), "the secrets module cannot be seeded"),
+    (re.compile(r"\buuid\.uuid4\("), "uuid.uuid4 cannot be seeded"),
+]
+
+
+@rule("unseeded-random", "server.py must only use randomness that PrairieLearn seeds for each variant.", files=("server.py",))
+def _unseeded_random(context: Context):
+    for number, line in enumerate(context.read("server.py").splitlines(), 1):
+        code = line.split("#", 1)[0]
+        for pattern, reason in _UNSEEDED_RANDOMNESS:
+            if pattern.search(code):
+                yield f"server.py:{number}", f"variants are not reproducible: {reason}"
+
+
+_TEXT_EXTENSIONS = (".html", ".py", ".js", ".css", ".json", ".md")
+
+
+@rule("unused-file", "Client files that neither the question nor its other files refer to.",
+      files=("question.html", "server.py", "clientFilesQuestion/*"), severity="warning")
+def _unused_file(context: Context):
+    client_files = [path for path in context.files if path.startswith("clientFilesQuestion/")]
+    if not client_files:
+        return
+    sources = [("question.html", context.read("question.html")), ("server.py", context.read("server.py"))]
+    sources += [(path, context.read(path)) for path in client_files if path.endswith(_TEXT_EXTENSIONS)]
+    for path in client_files:
+        name = os.path.basename(path)
+        if not any(name in text for source, text in sources if source != path):
+            yield path, "not referenced by question.html, server.py or other client files"
+
+
+# ---- engine ---------------------------------------------------------------
+
+def _units(root: str):
+    """
+    Yield (kind, key, directory) for the questions and assessments of a course.
+    """
+    for qid, path in _find_info_dirs(os.path.join(root, QUESTIONS_DIR), "info.json"):
+        yield "question", qid, path
+    for ciid, path in _find_info_dirs(os.path.join(root, COURSE_INSTANCES_DIR), "infoCourseInstance.json"):
+        for aid, assessment_path in _find_info_dirs(os.path.join(path, ASSESSMENTS_DIR), "infoAssessment.json"):
+            yield "assessment", f"{ciid}/{aid}", assessment_path
+
+
+def _unit_files(path: str) -> list:
+    files = []
+    for directory, directories, names in os.walk(path):
+        directories[:] = sorted(name for name in directories if not name.startswith("."))
+        prefix = directory[len(path) + 1:].replace(os.sep, "/")
+        files.extend(f"{prefix}/{name}" if prefix else name for name in sorted(names) if not name.startswith("."))
+    return files
+
+
+class _Hashes:
+    """
+    Content hashes of the files of a course, cached by size and modification time.
+    """
+
+    def __init__(self, root: str, cached: dict):
+        self.root = root
+        self.cached = cached
+        self.used = {}
+
+    def __call__(self, rel: str) -> str:
+        if rel not in self.used:
+            self.used[rel] = self._stamp(rel)
+        return self.used[rel][2] if self.used[rel] else None
+
+    def _stamp(self, rel: str) -> list:
+        path = os.path.join(self.root, rel)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        cached = self.cached.get(rel)
+        if cached and cached[:2] == stamp:
+            return cached
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(1 << 20), b""):
+                digest.update(data)
+        return stamp + [digest.hexdigest()]
+
+
+def lint_course(root: str, rules: list = None) -> dict:
+    """
+    Run lint rules (all the registered ones by default) on the course at
+    `root`, reusing the cached findings of the rules whose files did not
+    change; return the findings and how many rule runs were cached.
+    """
+    root = os.path.abspath(root)
+    selected = [RULES[name] for name in rules] if rules else list(RULES.values())
+    cache = paths.load_json_cache(paths.cache_path(CACHE_DIRNAME, root), CACHE_VERSION, files={}, results={})
+    hashes = _Hashes(root, cache["files"])
+    try:
+        course_info = read_json(os.path.join(root, "infoCourse.json")) or {}
+    except (ValueError, UnicodeDecodeError):
+        course_info = {}
+    if not isinstance(course_info, dict):
+        course_info = {}
+    course_hash = hashes("infoCourse.json")
+
+    findings = []
+    results = {}
+    counts = {"units": 0, "evaluated": 0, "cached": 0}
+    for kind, key, path in _units(root):
+        counts["units"] += 1
+        unit_rules = [lint_rule for lint_rule in selected if kind in lint_rule.scopes]
+        if not unit_rules:
+            continue
+        files = _unit_files(path)
+        unit_rel = os.path.relpath(path, root).replace(os.sep, "/")
+        context = Context(kind, key, path, files, course_info)
+        for lint_rule in unit_rules:
+            digest = hashlib.sha1(f"{lint_rule.version}\0{course_hash if lint_rule.course else ''}".encode())
+            for file in files:
+                if lint_rule.reads(file):
+                    digest.update(f"\0{file}\0{hashes(f'{unit_rel}/{file}')}".encode())
+            result_key = f"{lint_rule.name}:{kind}:{key}"
+            cached = cache["results"].get(result_key)
+            if cached and cached[0] == digest.hexdigest():
+                unit_findings = cached[1]
+                counts["cached"] += 1
+            else:
+                try:
+                    unit_findings = [[file, message] for file, message in lint_rule.func(context)]
+                except Exception as e:
+                    loguru.logger.warning(f"Rule {lint_rule.name} failed on {key}: {e}")
+                    unit_findings = [["", f"the rule failed: {type(e).__name__}: {e}"]]
+                counts["evaluated"] += 1
+            results[result_key] = [digest.hexdigest(), unit_findings]
+            for file, message in unit_findings:
+                findings.append({"rule": lint_rule.name, "severity": lint_rule.severity, "path": f"{unit_rel}/{file}".rstrip("/"), "message": message})
+
+    # Findings of rules that were not run are kept for the next run
+    names = {lint_rule.name for lint_rule in selected}
+    results.update({result_key: result for result_key, result in cache["results"].items() if result_key.split(":", 1)[0] not in names})
+    if counts["evaluated"] or results.keys() != cache["results"].keys() or any(cache["files"].get(rel) != stamp for rel, stamp in hashes.used.items()):
+        paths.save_json_cache(paths.cache_path(CACHE_DIRNAME, root), {"version": CACHE_VERSION, "files": {rel: stamp for rel, stamp in hashes.used.items() if stamp}, "results": results})
+
+    findings.sort(key=lambda finding: (finding["path"], finding["rule"], finding["message"]))
+    return {"findings": findings, "rules": [lint_rule.name for lint_rule in selected], **counts}
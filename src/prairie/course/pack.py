@@ -0,0 +1,270 @@
+"""
+Deterministic, compressed archives of a course, to ship it between machines.
+
+:func:`pack_course` only archives what PrairieLearn reads: ``infoCourse.json``,
+the course-wide directories, and the directories of the questions and course
+instances that the course index finds (a stray directory under ``questions/``
+is left out), minus :data:`DEFAULT_EXCLUDES` (``.git``, ``node_modules``,
+caches...) and any other excluded pattern. Entries are sorted and their
+metadata normalized (no timestamps, owners or permissions other than the
+executable bit), so packing the same files twice gives the same bytes.
+
+The first entry of the archive is a manifest with the size and SHA-256 of
+every file. The tar stream flows through the compressor in chunks, to a file
+or to standard output, so a course can be piped to another machine; when
+unpacking, files whose content is already identical are not rewritten.
+"""
+
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+
+import loguru
+
+from .. import paths, profiling
+from ..docker import bundle
+from .index import COURSE_INSTANCES_DIR, QUESTIONS_DIR, _find_info_dirs
+
+MANIFEST_NAME = ".prairie-pack.json"
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 1 << 20
+
+# What PrairieLearn reads at the root of a course, besides questions and course instances
+COURSE_FILES = ("infoCourse.json", "clientFilesCourse", "serverFilesCourse", "elements", "elementExtensions", "README.md")
+# Patterns with a "/" match relative paths, others match any file or directory name
+DEFAULT_EXCLUDES = (".git", ".svn", ".hg", "node_modules", "__pycache__", "*.pyc", ".ipynb_checkpoints", ".DS_Store", "Thumbs.db", "*.swp", "*~", "*.tmp")
+
+
+class PackError(ValueError):
+    """
+    An archive is not a course archive, or is unsafe to unpack.
+    """
+
+
+def _excluded(path: str, excludes) -> bool:
+    name = path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatchcase(path if "/" in pattern else name, pattern) for pattern in excludes)
+
+
+def _walk(root: str, rel: str, excludes, files: list):
+    absolute = os.path.join(root, rel)
+    if _excluded(rel, excludes):
+        return
+    if os.path.islink(absolute) or not os.path.isdir(absolute):
+        if os.path.lexists(absolute):
+            files.append(rel)
+        return
+    for name in sorted(os.listdir(absolute)):
+        _walk(root, f"{rel}/{name}", excludes, files)
+
+
+def course_files(root: str, excludes=()) -> list:
+    """
+    Return the sorted relative paths (with "/" separators) of the files and
+    symbolic links of the course at `root` that belong in its archive.
+    """
+    excludes = tuple(DEFAULT_EXCLUDES) + tuple(excludes)
+    files = []
+    for name in COURSE_FILES:
+        _walk(root, name, excludes, files)
+    for top in (QUESTIONS_DIR, COURSE_INSTANCES_DIR):
+        info_name = "info.json" if top == QUESTIONS_DIR else "infoCourseInstance.json"
+        for rel, _ in _find_info_dirs(os.path.join(root, top), info_name):
+            _walk(root, f"{top}/{rel}", excludes, files)
+    return sorted(files)
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for data in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def build_manifest(root: str, files: list) -> dict:
+    """
+    Return the manifest of the files of a course: size, SHA-256 and
+    executable bit of every regular file, and the target of every symbolic
+    link that stays within the course (other links are left out).
+    """
+    manifest = {"version": MANIFEST_VERSION, "files": {}, "links": {}}
+    for rel in files:
+        absolute = os.path.join(root, rel)
+        if os.path.islink(absolute):
+            target = os.readlink(absolute)
+            resolved = os.path.normpath(os.path.join(os.path.dirname(rel), target))
+            if os.path.isabs(target) or resolved.startswith(".."):
+                loguru.logger.warning(f"Not packing {rel}: it links outside of the course ({target}).")
+                continue
+            manifest["links"][rel] = target
+        elif os.path.isfile(absolute):
+            mode = os.stat(absolute).st_mode
+            manifest["files"][rel] = {
+                "size": os.path.getsize(absolute),
+                "sha256": _hash_file(absolute),
+                "executable": bool(mode & stat.S_IXUSR),
+            }
+    return manifest
+
+
+def _tarinfo(name: str, size: int = 0, mode: int = 0o644, link: str = None) -> tarfile.TarInfo:
+    # Only the content and the executable bit of files are kept, so that archives are reproducible
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mode = mode
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    if link is not None:
+        info.type = tarfile.SYMTYPE
+        info.linkname = link
+    return info
+
+
+def pack_course(root: str, output, excludes=(), compression: str = "gzip", level: int = None) -> dict:
+    """
+    Write the compressed archive of the course at `root` to `output` (a path,
+    replaced atomically, or a binary file object), and return its manifest.
+    """
+    files = course_files(root, excludes)
+    with profiling.span("course.pack", files=len(files), compression=compression):
+        manifest = build_manifest(root, files)
+        if isinstance(output, str):
+            with paths.atomic_write(output, "wb") as f:
+                _write_archive(root, manifest, f, compression, level)
+        else:
+            _write_archive(root, manifest, output, compression, level)
+    loguru.logger.info(f"Packed {len(manifest['files'])} file(s) and {len(manifest['links'])} link(s) of {root}.")
+    return manifest
+
+
+def _write_archive(root: str, manifest: dict, f, compression: str, level: int):
+    with bundle.compressed_writer(f, compression, level) as writer:
+        with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+            data = json.dumps(manifest, indent=1, sort_keys=True).encode()
+            tar.addfile(_tarinfo(MANIFEST_NAME, len(data)), io.BytesIO(data))
+            entries = sorted(list(manifest["files"].items()) + list(manifest["links"].items()))
+            for rel, entry in entries:
+                if isinstance(entry, str):
+                    tar.addfile(_tarinfo(rel, link=entry))
+                    continue
+                with open(os.path.join(root, rel), "rb") as content:
+                    tar.addfile(_tarinfo(rel, entry["size"], 0o755 if entry["executable"] else 0o644), content)
+
+
+def _compressed_reader(f):
+    compression = bundle.compression_of(f.peek(4)[:4] if hasattr(f, "peek") else b"")
+    if compression is None:
+        raise PackError("Not a gzip or zstd compressed course archive.")
+    return bundle.compressed_reader(f, compression)
+
+
+def _safe_path(destination: str, rel: str) -> str:
+    """
+    Return where to unpack `rel`, refusing paths outside of `destination`,
+    including through a symbolic link already in `destination` (symbolic
+    links are unpacked last, but can be there from an earlier unpack).
+    """
+    parts = rel.split("/")
+    if os.path.isabs(rel) or ".." in parts or "" in parts or rel.startswith(MANIFEST_NAME):
+        raise PackError(f"Refusing to unpack '{rel}': it is outside of the course.")
+    parent = destination
+    for part in parts[:-1]:
+        parent = os.path.join(parent, part)
+        try:
+            is_link = stat.S_ISLNK(os.lstat(parent).st_mode)
+        except FileNotFoundError:
+            break
+        if is_link:
+            raise PackError(f"Refusing to unpack '{rel}': it would be written through the symbolic link {parent}.")
+    path = os.path.join(destination, *parts)
+    real_destination = os.path.realpath(destination)
+    if os.path.commonpath([real_destination, os.path.realpath(os.path.dirname(path))]) != real_destination:
+        raise PackError(f"Refusing to unpack '{rel}': it is outside of the course.")
+    return path
+
+
+def _identical(path: str, entry: dict) -> bool:
+    try:
+        if os.path.islink(path) or os.path.getsize(path) != entry["size"]:
+            return False
+    except OSError:
+        return False
+    return _hash_file(path) == entry["sha256"]
+
+
+def unpack_course(archive, destination: str) -> dict:
+    """
+    Unpack a course archive (a path, or a binary file object) into
+    `destination`, skipping the files whose content is already identical;
+    return the numbers of files written and skipped.
+    """
+    counts = {"written": 0, "skipped": 0, "links": 0}
+    f = open(archive, "rb") if isinstance(archive, str) else archive
+    try:
+        with profiling.span("course.unpack"), _compressed_reader(f) as reader:
+            with tarfile.open(fileobj=reader, mode="r|") as tar:
+                manifest = None
+                links = []
+                for member in tar:
+                    if manifest is None:
+                        if member.name != MANIFEST_NAME:
+                            raise PackError("The archive does not start with a manifest: it is not a course archive.")
+                        manifest = json.load(tar.extractfile(member))
+                        if manifest.get("version") != MANIFEST_VERSION:
+                            raise PackError(f"Unsupported course archive version {manifest.get('version')}.")
+                        continue
+                    if member.issym():
+                        # Links are created once every file is written, so that no file is written through one
+                        if manifest["links"].get(member.name) != member.linkname:
+                            raise PackError(f"Unexpected link '{member.name}' in the course archive.")
+                        links.append(member)
+                        continue
+                    path = _safe_path(destination, member.name)
+                    entry = manifest["files"].get(member.name)
+                    if not member.isfile() or entry is None:
+                        raise PackError(f"Unexpected entry '{member.name}' in the course archive.")
+                    if _identical(path, entry):
+                        counts["skipped"] += 1
+                        continue
+                    _unpack_file(tar.extractfile(member), path, member.mode, entry)
+                    counts["written"] += 1
+                for member in links:
+                    _unpack_link(member, _safe_path(destination, member.name))
+                    counts["links"] += 1
+    finally:
+        if f is not archive:
+            f.close()
+    loguru.logger.info(f"Unpacked into {destination}: {counts}")
+    return counts
+
+
+def _unpack_link(member: tarfile.TarInfo, path: str):
+    resolved = os.path.normpath(os.path.join(os.path.dirname(member.name), member.linkname))
+    if os.path.isabs(member.linkname) or resolved == ".." or resolved.startswith("../"):
+        raise PackError(f"Refusing to unpack '{member.name}': it links outside of the course.")
+    if os.path.islink(path) and os.readlink(path) == member.linkname:
+        return
+    if os.path.isdir(path) and not os.path.islink(path):
+        raise PackError(f"Refusing to replace the directory {path} with a link.")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with paths.atomic_path(path) as tmp_path:
+        os.symlink(member.linkname, tmp_path)
+
+
+def _unpack_file(content, path: str, mode: int, entry: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    with paths.atomic_path(path) as tmp_path:
+        with open(tmp_path, "wb") as f:
+            for data in iter(lambda: content.read(CHUNK_SIZE), b""):
+                digest.update(data)
+                f.write(data)
+        if digest.hexdigest() != entry["sha256"]:
+            raise PackError(f"The content of '{path}' does not match the manifest of the archive.")
+        os.chmod(tmp_path, 0o755 if mode & stat.S_IXUSR else 0o644)
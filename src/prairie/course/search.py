@@ -0,0 +1,258 @@
+"""
+Full-text search over the questions of a course.
+
+The text of every question (the title, topic and tags of its ``info.json``,
+the text of its ``question.html`` and its ``server.py``) is tokenized into an
+inverted index, mapping each term to the questions that contain it with a
+weight: the number of occurrences in each field, multiplied by the boost of
+the field (a match in the title counts more than one in ``server.py``).
+Questions are ranked with BM25 over these weights.
+
+The index is kept on disk, in an SQLite database in the user cache directory,
+with the size and modification time of the files of every question:
+:meth:`SearchIndex.update` only stats these files, and re-tokenizes the
+questions that changed (or appeared, or disappeared). Only the postings of
+the terms of a query are read, so a search does not load the whole index:
+what remains is this check of the files (about 0.1s for 5,000 questions),
+and opening the index, which `prairie daemon` keeps open between searches.
+Snippets are extracted at query time, from the files of the few questions
+returned.
+"""
+
+import json
+import math
+import os
+import re
+import sqlite3
+
+import loguru
+
+from .. import paths
+from .helpers import read_json
+from .index import QUESTIONS_DIR, _find_info_dirs
+
+CACHE_DIRNAME = "search"
+INDEX_VERSION = 2
+
+# Fields of a question, with the files they come from and their boosts
+FIELD_BOOSTS = {"title": 5.0, "topic": 3.0, "tags": 3.0, "html": 1.0, "server": 0.5}
+QUESTION_FILES = ("info.json", "question.html", "server.py")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SNIPPET_CONTEXT = 40
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_HTML_TAG = re.compile(r"<[^>]*>")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def tokenize(text: str) -> list:
+    return [token for token in _TOKEN.findall(text.lower()) if len(token) > 1]
+
+
+def _read_text(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except FileNotFoundError:
+        return ""
+
+
+def question_fields(path: str) -> dict:
+    """
+    Return the searchable text of the question in directory `path`, by field.
+    """
+    try:
+        info = read_json(os.path.join(path, "info.json")) or {}
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        info = {}
+    if not isinstance(info, dict):
+        info = {}
+    return {
+        "title": str(info.get("title") or ""),
+        "topic": str(info.get("topic") or ""),
+        "tags": " ".join(map(str, info.get("tags") or [])),
+        "html": _HTML_TAG.sub(" ", _read_text(os.path.join(path, "question.html"))),
+        "server": _read_text(os.path.join(path, "server.py")),
+    }
+
+
+def _file_stamps(path: str) -> list:
+    stamps = []
+    for name in QUESTION_FILES:
+        try:
+            stat = os.stat(os.path.join(path, name))
+            stamps.append([stat.st_size, stat.st_mtime_ns])
+        except FileNotFoundError:
+            stamps.append(None)
+    return stamps
+
+
+def _snippet(text: str, terms: set) -> str:
+    text = _WHITESPACE.sub(" ", text).strip()
+    for match in _TOKEN.finditer(text.lower()):
+        if match.group() in terms:
+            start = max(match.start() - SNIPPET_CONTEXT, 0)
+            end = min(match.end() + SNIPPET_CONTEXT, len(text))
+            return ("…" if start else "") + text[start:end] + ("…" if end < len(text) else "")
+    return None
+
+
+_SCHEMA = (
+    "CREATE TABLE documents (qid TEXT PRIMARY KEY, stamps TEXT NOT NULL, length REAL NOT NULL)",
+    "CREATE TABLE postings (term TEXT NOT NULL, qid TEXT NOT NULL, weight REAL NOT NULL, PRIMARY KEY (term, qid)) WITHOUT ROWID",
+    "CREATE INDEX postings_qid ON postings (qid)",
+)
+
+
+def _open_database(path: str) -> sqlite3.Connection:
+    """
+    Open the database of an index, (re)creating its tables if it has another
+    version; an unusable cache only makes the index temporary, with a warning.
+    """
+    try:
+        # The daemon searches from its handler threads, one at a time
+        db = sqlite3.connect(path, check_same_thread=False)
+        if db.execute("PRAGMA user_version").fetchone()[0] != INDEX_VERSION:
+            for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                db.execute(f"DROP TABLE {name}")
+            for statement in _SCHEMA:
+                db.execute(statement)
+            db.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            db.commit()
+        return db
+    except sqlite3.Error as e:
+        loguru.logger.warning(f"Could not open the search index {path}, indexing in memory: {e}")
+        if path == ":memory:":
+            raise
+        return _open_database(":memory:")
+
+
+class SearchIndex:
+    """
+    The inverted index of the questions of the course at `root`.
+
+    `documents` maps QIDs to the stamps of their files and their length (sum
+    of weights); the postings of a term ({qid: weight}) are read from the
+    database with :meth:`postings`.
+    """
+
+    def __init__(self, root: str, path: str = ":memory:"):
+        self.root = os.path.abspath(root)
+        self.documents = {}
+        self._db = _open_database(path)
+
+    @classmethod
+    def load(cls, root: str) -> "SearchIndex":
+        """
+        Open the index of a course in the cache (empty if there is none).
+        """
+        root = os.path.abspath(root)
+        index = cls(root, paths.cache_path(CACHE_DIRNAME, root, suffix=".sqlite"))
+        index.documents = {
+            qid: {"stamps": json.loads(stamps), "length": length}
+            for qid, stamps, length in index._db.execute("SELECT qid, stamps, length FROM documents")
+        }
+        return index
+
+    def postings(self, term: str) -> dict:
+        return dict(self._db.execute("SELECT qid, weight FROM postings WHERE term = ?", (term,)))
+
+    def _remove(self, qid: str):
+        self._db.execute("DELETE FROM postings WHERE qid = ?", (qid,))
+        self._db.execute("DELETE FROM documents WHERE qid = ?", (qid,))
+        self.documents.pop(qid, None)
+
+    def _add(self, qid: str, path: str, stamps: list):
+        weights = {}
+        for field, text in question_fields(path).items():
+            boost = FIELD_BOOSTS[field]
+            for token in tokenize(text):
+                weights[token] = weights.get(token, 0.0) + boost
+        # The database may be ahead of this index (updated by another process)
+        self._remove(qid)
+        self._db.executemany("INSERT INTO postings (term, qid, weight) VALUES (?, ?, ?)", [(term, qid, weight) for term, weight in weights.items()])
+        self._db.execute("INSERT INTO documents (qid, stamps, length) VALUES (?, ?, ?)", (qid, json.dumps(stamps), sum(weights.values())))
+        self.documents[qid] = {"stamps": stamps, "length": sum(weights.values())}
+
+    def update(self) -> dict:
+        """
+        Bring the index up to date with the course, re-tokenizing only the
+        questions whose files changed, and save it; return the number of
+        questions added, updated, removed and unchanged.
+        """
+        try:
+            # One transaction: other processes see the whole update or none of it
+            with self._db:
+                return self._update()
+        except sqlite3.Error as e:
+            loguru.logger.warning(f"Could not update the search index of {self.root}, indexing in memory: {e}")
+            self._db = _open_database(":memory:")
+            self.documents = {}
+            with self._db:
+                return self._update()
+
+    def _update(self) -> dict:
+        counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        seen = set()
+        for qid, path in _find_info_dirs(os.path.join(self.root, QUESTIONS_DIR), "info.json"):
+            seen.add(qid)
+            stamps = _file_stamps(path)
+            document = self.documents.get(qid)
+            if document is not None and document["stamps"] == stamps:
+                counts["unchanged"] += 1
+                continue
+            self._add(qid, path, stamps)
+            counts["updated" if document is not None else "added"] += 1
+        for qid in set(self.documents) - seen:
+            self._remove(qid)
+            counts["removed"] += 1
+        return counts
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        Return the best `limit` matches of `query` as dictionaries with the
+        QID, the score, the title and a snippet.
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = sum(document["length"] for document in self.documents.values()) / count
+        scores = {}
+        for term in terms:
+            postings = self.postings(term)
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for qid, weight in postings.items():
+                if qid not in self.documents:
+                    # Added by another process since this index was loaded
+                    continue
+                norm = K1 * (1 - B + B * self.documents[qid]["length"] / average_length)
+                scores[qid] = scores.get(qid, 0.0) + idf * weight * (K1 + 1) / (weight + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        results = []
+        for qid, score in ranked:
+            fields = question_fields(os.path.join(self.root, QUESTIONS_DIR, qid))
+            snippet = None
+            for field in ("html", "server", "tags", "topic"):
+                snippet = _snippet(fields[field], terms)
+                if snippet:
+                    break
+            results.append({"qid": qid, "score": round(score, 4), "title": fields["title"], "snippet": snippet})
+        return results
+
+
+def search_course(root: str, query: str, limit: int = 10, index: SearchIndex = None) -> list:
+    """
+    Search the questions of the course at `root`, after bringing its index
+    (`index`, or the one in the cache) up to date.
+    """
+    index = index or SearchIndex.load(root)
+    counts = index.update()
+    if counts["added"] or counts["updated"] or counts["removed"]:
+        loguru.logger.debug(f"Updated the search index of {index.root}: {counts}")
+    return index.search(query, limit=limit)
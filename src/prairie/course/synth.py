@@ -0,0 +1,218 @@
+"""
+Deterministic generator of synthetic PrairieLearn courses, for scale testing.
+
+The generated tree follows the PrairieLearn course layout (``infoCourse.json``,
+``questions/<qid>/{info.json,question.html,server.py}``, course instances with
+assessments split into zones, and ``clientFiles*`` directories). Everything is
+derived from a seed, so the same arguments always produce the same bytes.
+
+Files are written one at a time and question identifiers are computed from
+their index rather than kept in a list, so memory use does not grow with the
+size of the course.
+"""
+
+import os
+import random
+import uuid
+
+import loguru
+
+from .helpers import write_json
+
+TOPICS = ["Algebra", "Calculus", "Probability", "Graphs", "Recursion", "Sorting", "Hashing", "Complexity"]
+TAGS = ["easy", "medium", "hard", "v3", "numeric", "symbolic", "multiple-choice", "code", "draft", "exam"]
+ASSESSMENT_SETS = [
+    {"abbreviation": "HW", "name": "Homework", "heading": "Homeworks", "color": "green1"},
+    {"abbreviation": "Q", "name": "Quiz", "heading": "Quizzes", "color": "red1"},
+    {"abbreviation": "E", "name": "Exam", "heading": "Exams", "color": "brown1"},
+]
+
+_CHUNK_SIZE = 1 << 16
+
+_QUESTION_TEMPLATES = [
+    """<pl-question-panel>
+  <p>Compute $a + b$ for $a = {{params.a}}$ and $b = {{params.b}}$.</p>
+</pl-question-panel>
+
+<pl-number-input answers-name="c" label="$c =$" comparison="sigfig" digits="3"></pl-number-input>
+""",
+    """<pl-question-panel>
+  <p>Which of these numbers is the largest?</p>
+</pl-question-panel>
+
+<pl-multiple-choice answers-name="largest" weight="1">
+  <pl-answer correct="true">{{params.big}}</pl-answer>
+  <pl-answer correct="false">{{params.a}}</pl-answer>
+  <pl-answer correct="false">{{params.b}}</pl-answer>
+</pl-multiple-choice>
+""",
+    """<pl-question-panel>
+  <p>Select every even number.</p>
+  <pl-figure file-name="figure.png" directory="clientFilesQuestion"></pl-figure>
+</pl-question-panel>
+
+<pl-checkbox answers-name="even" partial-credit="true">
+  <pl-answer correct="true">{{params.even}}</pl-answer>
+  <pl-answer>{{params.odd}}</pl-answer>
+</pl-checkbox>
+""",
+    """<pl-question-panel>
+  <p>Write a function <code>add(a, b)</code> returning the sum of its arguments.</p>
+</pl-question-panel>
+
+<pl-file-editor file-name="answer.py" ace-mode="ace/mode/python"></pl-file-editor>
+<pl-submission-panel>
+  <pl-external-grader-results></pl-external-grader-results>
+</pl-submission-panel>
+""",
+    """<pl-question-panel>
+  <p>Give a symbolic expression equal to $x^{{params.a}}$ differentiated once.</p>
+</pl-question-panel>
+
+<pl-symbolic-input answers-name="dx" variables="x" label="$f'(x) =$"></pl-symbolic-input>
+<pl-variable-score answers-name="dx"></pl-variable-score>
+""",
+]
+
+_SERVER_PY = """import random
+
+
+def generate(data):
+    a = random.randint({low}, {high})
+    b = random.randint({low}, {high})
+    data["params"]["a"] = a
+    data["params"]["b"] = b
+    data["params"]["big"] = max(a, b) + 1
+    data["params"]["even"] = 2 * a
+    data["params"]["odd"] = 2 * b + 1
+    data["correct_answers"]["c"] = a + b
+"""
+
+
+def question_id(index: int) -> str:
+    return f"q{index:06d}"
+
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def _write_text(path: str, text: str) -> int:
+    data = text.encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(data)
+    return len(data)
+
+
+def _write_random_bytes(path: str, size: int, rng: random.Random) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            chunk = min(remaining, _CHUNK_SIZE)
+            f.write(rng.randbytes(chunk))
+            remaining -= chunk
+    return size
+
+
+def synthesize_course(
+    output_dir: str,
+    questions: int = 100,
+    instances: int = 1,
+    assessments_per_instance: int = 10,
+    questions_per_zone: int = 5,
+    assets_size: int = 0,
+    seed: int = 0,
+) -> dict:
+    """
+    Write a synthetic course to `output_dir`, and return statistics about it
+    (number of questions, assessments, files and bytes written).
+    """
+    rng = random.Random(seed)
+    stats = {"questions": 0, "assessments": 0, "files": 0, "bytes": 0}
+
+    def count(size: int):
+        stats["files"] += 1
+        stats["bytes"] += size
+
+    loguru.logger.info(f"Synthesizing a course with {questions} question(s) and {instances} instance(s) in {output_dir}.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Course information
+    info_course = {
+        "uuid": _uuid(rng),
+        "name": f"SYN {seed}",
+        "title": f"Synthetic course (seed {seed})",
+        "topics": [{"name": topic, "color": f"blue{idx % 3 + 1}", "description": f"{topic} questions."} for idx, topic in enumerate(TOPICS)],
+        "tags": [{"name": tag, "color": f"gray{idx % 3 + 1}"} for idx, tag in enumerate(TAGS)],
+        "assessmentSets": ASSESSMENT_SETS,
+    }
+    count(write_json(os.path.join(output_dir, "infoCourse.json"), info_course))
+
+    if assets_size:
+        count(_write_random_bytes(os.path.join(output_dir, "clientFilesCourse", "syllabus.pdf"), assets_size, rng))
+
+    # Questions
+    for index in range(questions):
+        qid = question_id(index)
+        question_dir = os.path.join(output_dir, "questions", qid)
+        template = rng.randrange(len(_QUESTION_TEMPLATES))
+        info = {
+            "uuid": _uuid(rng),
+            "title": f"Synthetic question {index} ({TOPICS[index % len(TOPICS)].lower()})",
+            "topic": TOPICS[index % len(TOPICS)],
+            "tags": rng.sample(TAGS, 2),
+            "type": "v3",
+        }
+        if template == 3:
+            info["gradingMethod"] = "External"
+            info["externalGradingOptions"] = {"enabled": True, "image": "prairielearn/grader-python", "entrypoint": "/python_autograder/run.sh"}
+        count(write_json(os.path.join(question_dir, "info.json"), info))
+        count(_write_text(os.path.join(question_dir, "question.html"), _QUESTION_TEMPLATES[template]))
+        low = rng.randint(1, 10)
+        count(_write_text(os.path.join(question_dir, "server.py"), _SERVER_PY.format(low=low, high=low + rng.randint(5, 50))))
+        if assets_size:
+            count(_write_random_bytes(os.path.join(question_dir, "clientFilesQuestion", "figure.png"), assets_size, rng))
+        stats["questions"] += 1
+
+    # Course instances and assessments
+    for instance in range(instances):
+        instance_dir = os.path.join(output_dir, "courseInstances", f"Instance{instance + 1}")
+        count(write_json(os.path.join(instance_dir, "infoCourseInstance.json"), {
+            "uuid": _uuid(rng),
+            "longName": f"Synthetic instance {instance + 1}",
+            "allowAccess": [{"startDate": "2020-01-01T00:00:01", "endDate": "2030-12-31T23:59:59"}],
+        }))
+
+        for number in range(1, assessments_per_instance + 1):
+            assessment_set = ASSESSMENT_SETS[number % len(ASSESSMENT_SETS)]
+            is_exam = assessment_set["name"] == "Exam"
+            assessment_dir = os.path.join(instance_dir, "assessments", f"{assessment_set['name']}{number}")
+            zones = []
+            zone_count = rng.randint(1, 3)
+            # A question appears at most once in an assessment
+            picked = rng.sample(range(questions), min(zone_count * questions_per_zone, questions))
+            for zone in range(zone_count):
+                zone_questions = []
+                for question_number in picked[zone * questions_per_zone:(zone + 1) * questions_per_zone]:
+                    points = rng.choice([1, 2, 3, 5, 10])
+                    if is_exam:
+                        # Exams give decreasing points on successive attempts
+                        zone_questions.append({"id": question_id(question_number), "points": [points, max(points // 2, 1)]})
+                    else:
+                        zone_questions.append({"id": question_id(question_number), "points": points, "maxPoints": points * 3})
+                zones.append({"title": f"Part {zone + 1}", "questions": zone_questions})
+            count(write_json(os.path.join(assessment_dir, "infoAssessment.json"), {
+                "uuid": _uuid(rng),
+                "type": "Exam" if is_exam else "Homework",
+                "title": f"{assessment_set['name']} {number}",
+                "set": assessment_set["name"],
+                "number": str(number),
+                "zones": zones,
+            }))
+            os.makedirs(os.path.join(assessment_dir, "clientFilesAssessment"), exist_ok=True)
+            count(_write_text(os.path.join(assessment_dir, "clientFilesAssessment", "formulas.txt"), f"Formula sheet for {assessment_set['name']} {number}.\n"))
+            stats["assessments"] += 1
+
+    loguru.logger.info(f"Wrote {stats['files']} file(s), {stats['bytes']} byte(s).")
+    return stats
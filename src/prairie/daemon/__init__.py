@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import time
+
+import click
+import click_help_colors
+import loguru
+
+from .. import paths
+from . import server
+
+@click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def daemon():
+    """Resident daemon keeping Docker clients and course indexes warm."""
+    loguru.logger.info("Executing daemon related commands.")
+
+
+@daemon.command("start")
+@click.option('--foreground', is_flag=True, default=False, help='Run the daemon in this terminal instead of detaching it.')
+@click.option('--wait', default=10.0, type=float, help='⏱️  Seconds to wait for the detached daemon to answer.')
+def start_command(foreground, wait):
+    """🚀 Start the daemon (commands fall back to running in-process without it)."""
+    try:
+        info = server.call("ping")
+    except server.DaemonUnavailable:
+        info = None
+    if info is not None and info["version"] == server.code_version():
+        click.echo(f"The daemon is already running (pid {info['pid']}).")
+        return
+    if info is not None:
+        # Starting replaces it (see Daemon.start)
+        click.echo(f"Replacing the daemon running prairie {info['version']} (pid {info['pid']}).")
+
+    if foreground:
+        try:
+            server.Daemon().start().wait()
+        except KeyboardInterrupt:
+            pass
+        return
+
+    log_path = os.path.join(paths.user_cache_dir(server.DAEMON_DIRNAME), server.LOG_FILENAME)
+    with open(log_path, "ab") as log:
+        subprocess.Popen([sys.executable, "-c", "from prairie.daemon import server; server.main()"], stdin=subprocess.DEVNULL, stdout=log, stderr=log,
+                         start_new_session=True, close_fds=True)
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        try:
+            info = server.call("ping")
+        except server.DaemonUnavailable:
+            info = None
+        if info is None or info["version"] != server.code_version():
+            time.sleep(0.05)
+            continue
+        click.echo(f"The daemon is running (pid {info['pid']}), listening on {server.socket_path()}.")
+        return
+    raise click.ClickException(f"The daemon did not start within {wait}s (see {log_path}).")
+
+
+@daemon.command("stop")
+def stop_command():
+    """🛑 Stop the daemon."""
+    try:
+        server.call("shutdown")
+    except server.DaemonUnavailable:
+        click.echo("The daemon is not running.")
+        return
+    click.echo("The daemon stopped.")
+
+
+@daemon.command("status")
+def status_command():
+    """🔍 Show whether the daemon is running, and what it keeps warm."""
+    try:
+        info = server.call("ping")
+    except server.DaemonUnavailable as e:
+        click.echo(f"The daemon is not running ({e}); commands run in-process.")
+        return
+    if info["version"] != server.code_version():
+        click.echo(click.style(f"The daemon runs prairie {info['version']} (pid {info['pid']}), not {server.code_version()}: commands run in-process "
+                               "until it is restarted with `prairie daemon start`.", fg="yellow"))
+        return
+    click.echo(click.style(f"The daemon is running (pid {info['pid']}, prairie {info['version']}).", bold=True, fg="green"))
+    click.echo(f"Uptime: {info['uptime']:.0f}s, {info['requests']} request(s) served.")
+    for root in info["courses"]:
+        click.echo(click.style(f"• {root}", fg="blue"))
@@ -0,0 +1,374 @@
+"""
+Resident `prairie` daemon, keeping Docker clients and course indexes warm.
+
+Every CLI invocation otherwise starts from scratch: it builds a Docker
+client, and walks and parses whole courses to answer a single query. The
+daemon (started with ``prairie daemon start``, and entirely optional) keeps
+these in memory and answers the CLI over a unix socket in the user cache
+directory, with one JSON object per line in each direction.
+
+Commands go through :func:`execute`, which sends the operation to the daemon
+if one is running (and runs the same code: the same version of `prairie`,
+and source files with the same sizes and modification times, see
+:func:`code_version`), and otherwise runs it in-process: a missing, stale or incompatible daemon only makes
+commands slower, never different. Set PRAIRIE_DAEMON=0 to bypass the daemon.
+
+Operations are registered with :func:`operation`, and take the process-wide
+:class:`State` and JSON arguments; their results must be JSON too.
+"""
+
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import loguru
+
+from .. import __version__, paths
+
+DAEMON_DIRNAME = "daemon"
+SOCKET_FILENAME = "prairie.sock"
+LOG_FILENAME = "daemon.log"
+DISABLE_ENVIRONMENT_VARIABLE = "PRAIRIE_DAEMON"
+
+CONNECT_TIMEOUT = 0.5
+REQUEST_TIMEOUT = 300
+
+# Registry of operations: name -> function(state, **args)
+OPERATIONS = {}
+
+
+class DaemonError(RuntimeError):
+    """
+    An operation failed in the daemon.
+    """
+
+
+class DaemonUnavailable(Exception):
+    """
+    No compatible daemon answers on the socket.
+    """
+
+
+def operation(name: str):
+    """
+    Decorator registering an operation that the daemon can run.
+    """
+    def decorator(func):
+        OPERATIONS[name] = func
+        return func
+    return decorator
+
+
+_code_version = None
+
+
+def code_version() -> str:
+    """
+    Return the version of `prairie` with a digest of the paths, sizes and
+    modification times of its source files, computed once per process: it
+    changes with an upgrade or an edit, even when the version does not.
+    """
+    global _code_version
+
+    if _code_version is None:
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        digest = hashlib.sha1()
+        for directory, directories, files in os.walk(package_dir):
+            directories[:] = sorted(name for name in directories if name != "__pycache__")
+            for name in sorted(files):
+                if name.endswith(".py"):
+                    stat = os.stat(os.path.join(directory, name))
+                    digest.update(f"{os.path.relpath(os.path.join(directory, name), package_dir)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        _code_version = f"{__version__}+{digest.hexdigest()[:12]}"
+    return _code_version
+
+
+def socket_path() -> str:
+    return os.path.join(paths.user_cache_dir(DAEMON_DIRNAME), SOCKET_FILENAME)
+
+
+class State:
+    """
+    What the daemon keeps warm between requests: Docker clients (one per
+    Docker environment of the callers), course indexes (rebuilt when the
+    fingerprint of the course changes) and search indexes (updated
+    incrementally before every search).
+    """
+
+    def __init__(self):
+        # The code served is the code at start, whatever is edited later
+        self.version = code_version()
+        self.started = time.time()
+        self.requests = 0
+        self._clients = {}
+        self._indexes = {}
+        self._search_indexes = {}
+        self._lock = threading.Lock()
+        self._search_lock = threading.Lock()
+
+    def docker_client(self, environment: dict):
+        import docker
+
+        key = tuple(sorted((name, value) for name, value in environment.items() if value))
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = docker.from_env(environment=dict(key))
+        return client
+
+    def course_index(self, root: str):
+        from ..course import index
+
+        root = os.path.abspath(root)
+        fingerprint = index.fingerprint(root)
+        with self._lock:
+            cached = self._indexes.get(root)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        course_index = index.index_course(root)
+        with self._lock:
+            self._indexes[root] = (fingerprint, course_index)
+        return course_index
+
+    def search(self, root: str, query: str, limit: int) -> list:
+        from ..course import search
+
+        root = os.path.abspath(root)
+        with self._search_lock:
+            index = self._search_indexes.get(root)
+            if index is None:
+                index = self._search_indexes[root] = search.SearchIndex.load(root)
+            return search.search_course(root, query, limit=limit, index=index)
+
+    @property
+    def indexed_courses(self) -> list:
+        with self._lock:
+            return sorted(set(self._indexes) | set(self._search_indexes))
+
+
+def _docker_environment() -> dict:
+    return {name: os.environ.get(name) for name in ("DOCKER_HOST", "DOCKER_TLS_VERIFY", "DOCKER_CERT_PATH")}
+
+
+@operation("ping")
+def _ping(state: State) -> dict:
+    return {
+        "pid": os.getpid(),
+        "version": state.version,
+        "uptime": time.time() - state.started,
+        "requests": state.requests,
+        "courses": state.indexed_courses,
+    }
+
+
+@operation("docker.status")
+def _docker_status(state: State, environment: dict) -> list:
+    from ..docker import helpers
+
+    return helpers.container_summaries(state.docker_client(environment))
+
+
+@operation("course.summary")
+def _course_summary(state: State, root: str) -> dict:
+    course_index = state.course_index(root)
+    return {
+        "root": course_index.root,
+        "name": course_index.info.get("name"),
+        "title": course_index.info.get("title"),
+        "questions": len(course_index.questions),
+        "course_instances": len(course_index.course_instances),
+        "assessments": len(course_index.assessments),
+        "errors": course_index.errors,
+    }
+
+
+@operation("course.search")
+def _course_search(state: State, root: str, query: str, limit: int = 10) -> list:
+    return state.search(root, query, limit)
+
+
+# ---- client ----------------------------------------------------------------
+
+_local_state = None
+
+
+def _request(path: str, payload: dict) -> dict:
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except (AttributeError, OSError) as e:
+        # E.g., Windows without AF_UNIX support
+        raise DaemonUnavailable(str(e))
+    with sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            raise DaemonUnavailable(str(e))
+        sock.settimeout(REQUEST_TIMEOUT)
+        try:
+            sock.sendall(json.dumps(payload).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+        except OSError as e:
+            # E.g., the daemon is shutting down (operations are queries: they can be run again)
+            raise DaemonUnavailable(str(e))
+    if not line:
+        raise DaemonUnavailable("the daemon closed the connection")
+    return json.loads(line)
+
+
+def call(name: str, **args):
+    """
+    Run an operation in the daemon, and return its result; raise
+    :class:`DaemonUnavailable` if no compatible daemon is running.
+    """
+    response = _request(socket_path(), {"op": name, "args": args, "version": code_version()})
+    if "error" in response:
+        if response.get("incompatible"):
+            raise DaemonUnavailable(response["error"])
+        raise DaemonError(response["error"])
+    return response["result"]
+
+
+def execute(name: str, **args):
+    """
+    Run an operation in the daemon if it is running, and in-process otherwise.
+    """
+    global _local_state
+
+    if name.startswith("docker."):
+        args.setdefault("environment", _docker_environment())
+    if os.environ.get(DISABLE_ENVIRONMENT_VARIABLE) != "0":
+        try:
+            result = call(name, **args)
+            loguru.logger.debug(f"Ran {name} in the daemon.")
+            return result
+        except DaemonUnavailable as e:
+            loguru.logger.debug(f"Running {name} in-process: {e}")
+    if _local_state is None:
+        _local_state = State()
+    return OPERATIONS[name](_local_state, **args)
+
+
+# ---- server ----------------------------------------------------------------
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.server.daemon.dispatch(request)
+            except ValueError as e:
+                response = {"error": f"Invalid request: {e}"}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class Daemon:
+    """
+    The daemon: a threaded unix socket server dispatching to :data:`OPERATIONS`.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or socket_path()
+        self.state = State()
+        self._server = None
+        self._thread = None
+        self._inode = None
+
+    def dispatch(self, request: dict) -> dict:
+        name = request.get("op")
+        # Whatever their version, clients can stop the daemon and ask for its version (to replace it)
+        if name == "shutdown":
+            # Handlers run in their own threads: the server can be shut down from here
+            self.stop()
+            return {"result": None}
+        if name != "ping" and request.get("version") != self.state.version:
+            return {"error": f"the daemon runs prairie {self.state.version}, not {request.get('version')}", "incompatible": True}
+        func = OPERATIONS.get(name)
+        if func is None:
+            return {"error": f"unknown operation '{name}'", "incompatible": True}
+        self.state.requests += 1
+        start = time.perf_counter()
+        try:
+            result = func(self.state, **(request.get("args") or {}))
+        except Exception as e:
+            loguru.logger.exception(f"Operation {name} failed")
+            return {"error": f"{type(e).__name__}: {e}"}
+        loguru.logger.debug(f"Ran {name} in {(time.perf_counter() - start) * 1000:.1f}ms.")
+        return {"result": result}
+
+    def start(self) -> "Daemon":
+        """
+        Listen on the socket (replacing a stale socket, or a daemon running
+        other code), and serve in a thread.
+        """
+        if os.path.exists(self.path):
+            try:
+                response = _request(self.path, {"op": "ping", "version": self.state.version})
+            except (DaemonUnavailable, OSError):
+                os.unlink(self.path)
+            else:
+                version = response.get("result", {}).get("version")
+                if version == self.state.version:
+                    raise DaemonError(f"A daemon is already running on {self.path}.")
+                loguru.logger.info(f"Replacing the daemon running prairie {version or 'of another version'} on {self.path}.")
+                try:
+                    _request(self.path, {"op": "shutdown", "version": self.state.version})
+                except (DaemonUnavailable, OSError):
+                    pass
+                # Daemons from before shutdown worked across versions keep running, without their socket
+                if os.path.lexists(self.path):
+                    os.unlink(self.path)
+        self._server = _Server(self.path, _Handler)
+        self._inode = os.stat(self.path).st_ino
+        self._server.daemon = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="prairie-daemon", daemon=True)
+        self._thread.start()
+        loguru.logger.info(f"prairie daemon {os.getpid()} listening on {self.path}")
+        return self
+
+    def wait(self):
+        while self._thread is not None and self._thread.is_alive():
+            self._thread.join(0.5)
+
+    def stop(self):
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        server.shutdown()
+        server.server_close()
+        # The socket may already belong to a daemon that replaced this one
+        try:
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        loguru.logger.info("prairie daemon stopped")
+
+
+def main():
+    """
+    Entry point of the detached daemon process (see ``prairie daemon start``).
+    """
+    # Importing the CLI imports every module that registers operations
+    from .. import main as _  # noqa: F401
+
+    loguru.logger.remove()
+    loguru.logger.add(sys.stderr, level="INFO")
+    daemon = Daemon().start()
+    try:
+        daemon.wait()
+    except KeyboardInterrupt:
+        daemon.stop()
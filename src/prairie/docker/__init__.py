@@ -1,66 +1,135 @@
+import csv
+import json
 import os
+import sys
+import time
 
 import click
 import click_help_colors
 import click_option_group
 import docker as docker_sdk
 import loguru
+import requests
 
-from . import helpers
+from .. import profiling
+from ..config import profiles as config_profiles
+from ..course import index as course_index
+from ..daemon import server as daemon_server
+from . import archive, bundle as bundle_helpers, helpers, logs, metrics as metrics_helpers, mirror as mirror_helpers, plan as plan_helpers, preflight, stats as stats_helpers
 
 @click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
 def docker():
     """Docker related commands."""
     loguru.logger.info("Executing Docker related commands.")
-    helpers.log_docker_env()
-
-    # Check to see if Docker host is empty
-    if helpers.set_docker_host():
-        loguru.logger.warning("Docker host was not set, tried to correct")
+    with profiling.span("docker.env"):
         helpers.log_docker_env()
 
+        # Check to see if Docker host is empty
+        if helpers.set_docker_host():
+            loguru.logger.warning("Docker host was not set, tried to correct")
+            helpers.log_docker_env()
+
 
 @docker.command()
-@click.option('--course-dir', required=True, multiple=True, type=click.Path(exists=True), help='📁 Directories for courses. Can specify multiple times. (Mandatory)')
+@click.option('--course-dir', multiple=True, type=click.Path(exists=True), help='📁 Directories for courses. Can specify multiple times. (Mandatory, unless set by the profile)')
+@click.option('--profile', 'profile_name', default=None, help='📋 Launch with the settings of this profile of prairie.yaml (flags still take precedence).')
+@click.option('--config', 'config_path', default=None, type=click.Path(exists=True, dir_okay=False), help='📄 Path of prairie.yaml (defaults to the nearest one in this directory or its parents).')
 @click_option_group.optgroup.group('Optional PrairieLearn Configuration', help='')
 @click_option_group.optgroup.option('--job-dir', default=None, help='📁 Directory for jobs. If not provided, it will be determined based on other flags.')
-@click_option_group.optgroup.option('--force-job-dir', is_flag=True, default=False, help='🔄 Force the use of a default job directory if none is provided.')
-@click_option_group.optgroup.option('--external-grader', is_flag=True, help='⚙️  Enable support for external graders and workspaces.')
-@click_option_group.optgroup.option('--version', default="us-prod-live", help='🔄 Specify the version of PrairieLearn to run.')
-@click_option_group.optgroup.option('--port', default=3000, type=int, help='📡  Specify a custom port for PrairieLearn.')
-def launch(job_dir, force_job_dir, course_dir, external_grader, version, port):
+@click_option_group.optgroup.option('--force-job-dir', is_flag=True, default=None, help='🔄 Force the use of a default job directory if none is provided.')
+@click_option_group.optgroup.option('--external-grader/--no-external-grader', default=None, help='⚙️  Enable support for external graders and workspaces.')
+@click_option_group.optgroup.option('--version', default=None, help='🔄 Specify the version of PrairieLearn to run (default: us-prod-live).')
+@click_option_group.optgroup.option('--port', default=None, type=int, help='📡  Specify a custom port for PrairieLearn (default: 3000).')
+@click_option_group.optgroup.option('--archive-logs/--no-archive-logs', default=None, help='🗄️  Archive the logs of the container in the background (see `logs --history`).')
+@click_option_group.optgroup.option('--dry-run', is_flag=True, default=False, help='📝 Only print the container spec and the estimated cost of the launch.')
+@click_option_group.optgroup.option('--json', 'as_json', is_flag=True, default=False, help='With --dry-run, print the plan as JSON (for scripts).')
+@click_option_group.optgroup.option('--skip-preflight', is_flag=True, default=False, help='Do not check the prerequisites of the launch (ports, directories, disk space) first.')
+@click_option_group.optgroup.group('Resource Limits', help='')
+@click_option_group.optgroup.option('--cpus', default=None, type=float, help='🧮 Number of CPUs the container may use (e.g., 1.5).')
+@click_option_group.optgroup.option('--cpuset', default=None, help='📌 Cores to pin the container to (e.g., 0-3), or "auto" for cores not used by other PrairieLearn instances.')
+@click_option_group.optgroup.option('--memory', default=None, help='💾 Memory limit (e.g., 4g).')
+@click_option_group.optgroup.option('--shm-size', default=None, help='Size of /dev/shm (e.g., 512m).')
+def launch(course_dir, profile_name, config_path, dry_run, as_json, skip_preflight, **options):
     """🚀 Launch a PrairieLearn container."""
     loguru.logger.info("Attempting to launch a PrairieLearn container.")
-    
+
+    # Settings come from the flags, then the profile and defaults of prairie.yaml
+    try:
+        with profiling.span("config.resolve", profile=profile_name):
+            resolved = config_profiles.resolve(profile_name, dict(options, course_dirs=course_dir), config_path=config_path)
+    except config_profiles.ConfigError as ce:
+        raise click.ClickException(str(ce))
+    settings = config_profiles.values(resolved)
+    if not settings["course_dirs"]:
+        raise click.UsageError("Missing option '--course-dir' (or 'course_dirs' in the profile).")
+    job_dir, version, port = settings["job_dir"], settings["version"], settings["port"]
+
     # Determine job_dir based on flags
-    if job_dir is None and (external_grader or force_job_dir):
+    if job_dir is None and (settings["external_grader"] or settings["force_job_dir"]):
         loguru.logger.info(f"No job directory provided. But overriding either because external graders are requested or --force-job-dir.")
-        loguru.logger.info(f"Using job dir default local user path: ~/var/pl_jobs, expanded to {job_dir}.")
         job_dir = "~/var/pl_jobs"
+        loguru.logger.info(f"Using job dir default local user path: {job_dir}, expanded to {os.path.expanduser(job_dir)}.")
+
+    if dry_run:
+        try:
+            with profiling.span("docker.client"):
+                client, client_error = preflight.connect()
+            with profiling.span("docker.plan", version=version, port=port):
+                plan = plan_helpers.plan_launch(
+                    client,
+                    job_dir=job_dir,
+                    course_dirs=settings["course_dirs"],
+                    external_grader=settings["external_grader"],
+                    version=version,
+                    port=port,
+                    cpus=settings["cpus"],
+                    cpuset=settings["cpuset"],
+                    memory=settings["memory"],
+                    shm_size=settings["shm_size"],
+                    client_error=client_error
+                )
+        except ValueError as ve:
+            raise click.ClickException(str(ve))
+        click.echo(json.dumps(plan, indent=2) if as_json else plan_helpers.render_plan(plan))
+        return
 
     try:
-        container = helpers.run_prairielearn_container(
-            job_dir=job_dir, 
-            course_dirs=list(course_dir), 
-            external_grader=external_grader, 
-            version=version, 
-            port=port
-        )
+        with profiling.span("docker.launch", version=version, port=port):
+            container = helpers.run_prairielearn_container(
+                job_dir=job_dir, 
+                course_dirs=settings["course_dirs"], 
+                external_grader=settings["external_grader"], 
+                version=version, 
+                port=port,
+                cpus=settings["cpus"],
+                cpuset=settings["cpuset"],
+                memory=settings["memory"],
+                shm_size=settings["shm_size"],
+                check=not skip_preflight
+            )
         click.echo(f"Container {container.id} started successfully.")
         loguru.logger.info(f"Container {container.id} started successfully.")
+        if settings["archive_logs"]:
+            archive.spawn_archiver(container.id)
+            click.echo("Archiving its logs in the background.")
     except ValueError as ve:
         loguru.logger.error(f"ValueError encountered: {ve}")
-        click.echo(f"Error: {ve}")
+        raise click.ClickException(str(ve))
     except FileNotFoundError as fe:
         loguru.logger.error(f"FileNotFoundError encountered: {fe}")
-        click.echo(f"Error: {fe}")
+        raise click.ClickException(str(fe))
 
 @docker.command()
-def update():
+@click.option('--image', 'images', multiple=True, help='📦 Also pull this image (e.g., a grader image), concurrently. Can specify multiple times.')
+def update(images):
     """Update to the latest version of PrairieLearn."""
     loguru.logger.info("Attempting to update to the latest version of PrairieLearn.")
-    client = docker_sdk.from_env()
-    client.images.pull("prairielearn/prairielearn:us-prod-live")
+    with profiling.span("docker.client"):
+        client = docker_sdk.from_env()
+    if images:
+        helpers.pull_images(client, ["prairielearn/prairielearn:us-prod-live", *images])
+    else:
+        helpers.pull_image(client, "prairielearn/prairielearn:us-prod-live")
     click.echo("Updated to the latest version of PrairieLearn.")
     loguru.logger.info("Successfully updated to the latest version of PrairieLearn.")
 
@@ -68,34 +137,36 @@ def update():
 def status():
     """🔍 Check the status of a running PrairieLearn container."""
     loguru.logger.info("Checking the status of PrairieLearn container.")
-    import docker
-    client = docker.from_env()
-    containers = [c for c in client.containers.list(all=True) if "prairielearn/prairielearn" in c.image.tags[0]]
+    with profiling.span("docker.list"):
+        try:
+            containers = daemon_server.execute("docker.status")
+        except (daemon_server.DaemonError, docker_sdk.errors.DockerException) as e:
+            raise click.ClickException(str(e))
     
     if not containers:
         click.echo("No PrairieLearn container is currently running.")
         return
 
     for container in containers:
-        status = container.status
-        image = container.image.tags[0] if container.image.tags else "Unknown"
-        ports = container.ports
-        mounts = container.attrs['Mounts']
+        status = container["status"]
+        image = container["image"]
+        ports = container["ports"]
+        mounts = container["mounts"]
         
-        click.echo(click.style(f"Container ID: {container.id}", bold=True, fg="green"))
+        click.echo(click.style(f"Container ID: {container['id']}", bold=True, fg="green"))
         click.echo(f"Status: {status}")
         click.echo(f"Image: {image}")
         
         if ports:
             for private_port, port_bindings in ports.items():
-                for binding in port_bindings:
+                for binding in port_bindings or []:
                     click.echo(f"Port: {private_port} binded to {binding['HostPort']}")
         
         if mounts:
             click.echo(click.style("Course Directories and Mount Points:", bold=True, fg="yellow"))
             for mount in mounts:
-                if "course" in mount['Destination']:
-                    click.echo(click.style(f"• {mount['Source']} -> {mount['Destination']}", fg="blue"))
+                if "course" in mount['destination']:
+                    click.echo(click.style(f"• {mount['source']} -> {mount['destination']}", fg="blue"))
         
         click.echo("--------------------------------------------------")
 
@@ -104,10 +175,241 @@ def status():
     click.echo("• Your PrairieLearn instance is currently running.")
     if ports:
         for _, port_bindings in ports.items():
-            for binding in port_bindings:
+            for binding in port_bindings or []:
                 click.echo(f"• You can access it at: " + click.style(f"https://localhost:{binding['HostPort']}", bold=True, fg="blue"))
     else:
         click.echo("• No ports found for the running PrairieLearn instance.")
     click.echo("• The courses you've mounted are highlighted above in blue.")
 
 
+def _tail_lines(ctx, param, value):
+    if value == "all":
+        return value
+    try:
+        lines = int(value)
+    except ValueError:
+        lines = -1
+    if lines < 0:
+        raise click.BadParameter(f"expected 'all' or a number of lines, got '{value}'.")
+    return lines
+
+
+@docker.command("logs")
+@click.option('--container', 'container_ref', default=None, help='🐳 ID or name of the container (defaults to the most recently started PrairieLearn container).')
+@click.option('--follow', '-f', is_flag=True, default=False, help='📜 Keep streaming new output.')
+@click.option('--since', default=None, help='⏱️  Only show logs since a relative time (e.g., 10m, 2h), a timestamp or an ISO date.')
+@click.option('--tail', default="all", callback=_tail_lines, help='Number of lines to show from the end of the logs (applied before filtering).')
+@click.option('--grep', '-g', 'pattern', default=None, help='🔍 Only show lines matching this regular expression.')
+@click.option('--ignore-case', '-i', is_flag=True, default=False, help='Match --grep case-insensitively.')
+@click.option('--level', type=click.Choice(logs.LEVELS), default=None, help='Only show lines at this level or more severe.')
+@click.option('--context', '-C', default=0, type=int, help='Lines of context to show around each match.')
+@click.option('--raw', is_flag=True, default=False, help='Print lines as emitted, without formatting JSON records.')
+@click.option('--history', is_flag=True, default=False, help='🗄️  Search the archived logs of past runs instead of a live container.')
+def logs_command(container_ref, follow, since, tail, pattern, ignore_case, level, context, raw, history):
+    """📜 Show the logs of a PrairieLearn container."""
+    try:
+        since = logs.parse_since(since)
+    except ValueError as ve:
+        raise click.BadParameter(str(ve), param_hint="--since")
+
+    def format_line(line):
+        if line is None:
+            return "--"
+        return line.raw.decode("utf-8", errors="replace") if raw else line.format()
+
+    if history:
+        for index, segment, lines in archive.iter_archived_lines(pattern=pattern, ignore_case=ignore_case, since=since):
+            # Context does not carry over between (possibly non-contiguous) segments
+            log_filter = logs.LogFilter(pattern=pattern, min_level=level, context=context, ignore_case=ignore_case)
+            selected = log_filter.feed(lines)
+            if selected:
+                prefix = f"[{index['name'] or index['container'][:12]} {index['run']}] "
+                click.echo("\n".join(format_line(line) if line is None else prefix + format_line(line) for line in selected))
+        return
+
+    client = docker_sdk.from_env()
+    try:
+        container = helpers.find_container(client, container_ref)
+    except (ValueError, docker_sdk.errors.NotFound) as e:
+        raise click.ClickException(str(e))
+    loguru.logger.info(f"Reading logs of container {container.short_id} (follow={follow}, since={since}, tail={tail}).")
+
+    log_filter = logs.LogFilter(pattern=pattern, min_level=level, context=context, ignore_case=ignore_case)
+    try:
+        for batch in logs.iter_log_batches(client, container, follow=follow, since=since, tail=tail):
+            lines = log_filter.feed(batch)
+            if lines:
+                click.echo("\n".join(format_line(line) for line in lines))
+    except KeyboardInterrupt:
+        pass
+
+
+@docker.command("archive")
+@click.option('--container', 'container_ref', default=None, help='🐳 ID or name of the container (defaults to the most recently started PrairieLearn container).')
+@click.option('--archive-dir', default=None, type=click.Path(file_okay=False), help='📁 Archive directory (defaults to the user cache directory).')
+@click.option('--max-age-days', default=archive.MAX_AGE_DAYS, type=float, show_default=True, help='Delete the archived runs older than this first.')
+@click.option('--max-size-mb', default=archive.MAX_BYTES >> 20, type=int, show_default=True, help='Then delete the oldest archived runs until the archive fits in this size.')
+def archive_command(container_ref, archive_dir, max_age_days, max_size_mb):
+    """🗄️  Archive the logs of a container until it stops."""
+    client = docker_sdk.from_env()
+    try:
+        container = helpers.find_container(client, container_ref)
+    except (ValueError, docker_sdk.errors.NotFound) as e:
+        raise click.ClickException(str(e))
+    index = archive.archive_container(client, container, archive_dir=archive_dir, max_age_days=max_age_days, max_bytes=max_size_mb << 20)
+    lines = sum(segment["lines"] for segment in index["segments"].values())
+    click.echo(f"Archived {lines} line(s) of {container.short_id} in {len(index['segments'])} segment(s).")
+
+
+@docker.command("stats")
+@click.option('--format', 'output_format', type=click.Choice(["table", "csv", "jsonl"]), default="table", help='📊 Live table, or one CSV/JSONL record per sample for later analysis.')
+@click.option('--interval', default=2.0, type=float, help='⏱️  Seconds between refreshes of the table and of the container list.')
+@click.option('--window', default=30, type=int, help='Number of samples kept per metric for rolling averages.')
+@click.option('--duration', default=None, type=float, help='Stop after this many seconds (default: run until interrupted).')
+@click.option('--role', 'roles', multiple=True, type=click.Choice(stats_helpers.ROLES), help='Only follow containers with this role. Can specify multiple times.')
+def stats_command(output_format, interval, window, duration, roles):
+    """📊 Show live resource usage of PrairieLearn, grader and workspace containers."""
+    client = docker_sdk.from_env()
+    collector = stats_helpers.StatsCollector(client, roles=roles or stats_helpers.ROLES, window=window)
+
+    writer = None
+    if output_format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["timestamp", "container", "name", "role"] + list(stats_helpers.METRICS))
+
+    deadline = time.monotonic() + duration if duration else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            collector.refresh()
+            for container_stats, metrics in collector.poll(timeout=interval):
+                if output_format == "table":
+                    continue
+                record = {"timestamp": time.time(), "container": container_stats.container_id[:12], "name": container_stats.name, "role": container_stats.role}
+                record.update(metrics)
+                if writer is not None:
+                    writer.writerow([record["timestamp"], record["container"], record["name"], record["role"]] + [f"{metrics[m]:.2f}" for m in stats_helpers.METRICS])
+                else:
+                    click.echo(json.dumps(record))
+            if output_format == "table":
+                click.clear()
+                if collector.containers:
+                    click.echo(stats_helpers.render_table(list(collector.containers.values())))
+                else:
+                    click.echo("No PrairieLearn, grader or workspace container is currently running.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.stop()
+
+
+@docker.command("export-metrics")
+@click.option('--textfile', required=True, type=click.Path(dir_okay=False), help='📄 Metrics file to (atomically) rewrite, e.g. in the node_exporter textfile directory. (Mandatory)')
+@click.option('--interval', default=15.0, type=float, help='⏱️  Seconds between collections.')
+@click.option('--once', is_flag=True, default=False, help='Collect and write the metrics once, then exit.')
+def export_metrics_command(textfile, interval, once):
+    """📈 Export Prometheus metrics of the local PrairieLearn fleet to a text file."""
+    client = docker_sdk.from_env()
+    exporter = metrics_helpers.MetricsExporter(client)
+    loguru.logger.info(f"Exporting metrics to {textfile} every {interval}s.")
+    try:
+        while True:
+            started = time.monotonic()
+            try:
+                metrics_helpers.write_textfile(textfile, exporter.collect())
+            except (docker_sdk.errors.DockerException, requests.exceptions.RequestException) as e:
+                if once:
+                    raise click.ClickException(f"Could not collect the metrics: {e}")
+                # E.g., the daemon restarting: the next collection may succeed
+                loguru.logger.warning(f"Could not collect the metrics, retrying in {interval}s: {e}")
+            if once:
+                break
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+    except KeyboardInterrupt:
+        pass
+
+
+@docker.group("bundle", cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def bundle_group():
+    """📦 Save and load offline image bundles."""
+
+
+@bundle_group.command("save")
+@click.option('--output', '-o', required=True, type=click.Path(dir_okay=False), help='📄 Bundle file to write, e.g. prairielearn.tar.gz. (Mandatory)')
+@click.option('--version', default="us-prod-live", help='🔄 Version of PrairieLearn to include.')
+@click.option('--image', 'images', multiple=True, help='📦 Also include this image. Can specify multiple times.')
+@click.option('--course-dir', 'course_dirs', multiple=True, type=click.Path(exists=True, file_okay=False), help='📁 Also include the grader and workspace images used by this course. Can specify multiple times.')
+@click.option('--compression', type=click.Choice(bundle_helpers.COMPRESSIONS), default="gzip", help='🗜️  Compression of the bundle (zstd requires the zstandard package).')
+@click.option('--level', default=None, type=int, help='Compression level (default: 6 for gzip, 3 for zstd).')
+def bundle_save_command(output, version, images, course_dirs, compression, level):
+    """💾 Save PrairieLearn (and grader) images to a compressed bundle."""
+    image_names = [helpers.prairielearn_image(version), *images]
+    for course_dir in course_dirs:
+        image_names += course_index.referenced_images(course_dir)
+    image_names = list(dict.fromkeys(image_names))
+
+    client = docker_sdk.from_env()
+    missing = []
+    for image_name in image_names:
+        try:
+            client.images.get(image_name)
+        except docker_sdk.errors.ImageNotFound:
+            missing.append(image_name)
+    if missing:
+        click.echo(f"Pulling {len(missing)} missing image(s): {', '.join(missing)}")
+        helpers.pull_images(client, missing)
+
+    try:
+        stats = bundle_helpers.save_bundle(client, output, image_names, compression=compression, level=level)
+    except ValueError as ve:
+        raise click.ClickException(str(ve))
+    ratio = stats["bytes"] / stats["raw_bytes"] if stats["raw_bytes"] else 0
+    click.echo(f"Saved {len(image_names)} image(s) to {output}: {stats['raw_bytes'] / 2 ** 20:.1f} MiB compressed "
+               f"to {stats['bytes'] / 2 ** 20:.1f} MiB ({ratio:.0%}) in {stats['seconds']:.1f}s.")
+    for image_name in image_names:
+        click.echo(f"• {image_name}")
+
+
+@bundle_group.command("load")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def bundle_load_command(path):
+    """📥 Load the images of a bundle into Docker."""
+    client = docker_sdk.from_env()
+    try:
+        loaded = bundle_helpers.load_bundle(client, path)
+    except ValueError as ve:
+        raise click.ClickException(str(ve))
+    click.echo(f"Loaded {len(loaded)} image(s) from {path}:")
+    for tag in loaded:
+        click.echo(f"• {tag}")
+
+
+@docker.group("mirror", cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
+def mirror_group():
+    """🪞 Run a pull-through registry mirror for a lab of machines."""
+
+
+@mirror_group.command("serve")
+@click.option('--port', default=mirror_helpers.DEFAULT_PORT, type=int, help='🔌 Port of the mirror.')
+@click.option('--data-dir', default=None, type=click.Path(file_okay=False), help='📁 Directory of the cached layers (defaults to the user cache directory).')
+@click.option('--upstream', default=mirror_helpers.DEFAULT_UPSTREAM, help='🌐 Registry to mirror.')
+def mirror_serve_command(port, data_dir, upstream):
+    """🚀 Run the registry mirror on this machine."""
+    client = docker_sdk.from_env()
+    container = mirror_helpers.serve(client, port=port, data_dir=data_dir, upstream=upstream)
+    bindings = (container.attrs.get("HostConfig", {}).get("PortBindings") or {}).get("5000/tcp") or []
+    port = int(bindings[0]["HostPort"]) if bindings and bindings[0].get("HostPort") else port
+    address = f"{mirror_helpers.lan_address()}:{port}"
+    click.echo(f"Registry mirror {container.short_id} is running on {address}.")
+    click.echo("On the other machines, add to prairie.yaml (or set PRAIRIE_MIRROR):")
+    click.echo(f"    mirror: {address}")
+    click.echo(f'and add "{address}" to "insecure-registries" in their Docker daemon.json.')
+
+
+@mirror_group.command("stop")
+def mirror_stop_command():
+    """🛑 Stop the registry mirror (its cached layers are kept)."""
+    client = docker_sdk.from_env()
+    if mirror_helpers.stop(client):
+        click.echo("Registry mirror stopped.")
+    else:
+        click.echo("No registry mirror is running.")
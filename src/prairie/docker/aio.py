@@ -0,0 +1,393 @@
+"""
+An asyncio client for the Docker Engine API.
+
+The `docker` SDK is synchronous: listing 100 containers is one list request
+followed by 100 inspect requests, one after the other, and prefetching the
+grader images means one pull after the other. :class:`AsyncDockerClient`
+speaks HTTP/1.1 directly over the daemon's unix socket (or plain TCP), with a
+small pool of keep-alive connections, so that independent requests are in
+flight at the same time.
+
+The helpers in :mod:`prairie.docker.helpers` remain the API: they run the
+coroutines of this module with :func:`run` (the synchronous facade) and fall
+back to the `docker` SDK when the daemon is only reachable over TLS.
+"""
+
+import asyncio
+import json
+import threading
+import urllib.parse
+
+import docker
+import loguru
+
+from .. import profiling
+
+DEFAULT_API_VERSION = "1.41"
+MAX_CONNECTIONS = 16
+REQUEST_TIMEOUT = 60.0
+
+
+class DockerAPIError(Exception):
+    """
+    An error answer of the Docker daemon.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class _NoAnswer(ConnectionError):
+    """
+    The Docker daemon closed the connection without answering.
+    """
+
+
+class _Response:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: dict, body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else None
+
+
+def _error_message(body: bytes) -> str:
+    """
+    Return the message of an error answer: its "message" if it is a JSON
+    object, and its raw text otherwise.
+    """
+    try:
+        message = json.loads(body).get("message")
+    except (ValueError, AttributeError):
+        message = None
+    return message if isinstance(message, str) else body.decode("utf-8", errors="replace").strip()
+
+
+class AsyncDockerClient:
+    """
+    A minimal asyncio Engine API client, for the requests `prairie` issues
+    concurrently.
+
+    `base_url` is a DOCKER_HOST-style URL: "unix:///var/run/docker.sock" or
+    "tcp://host:port".
+    """
+
+    def __init__(self, base_url: str = "unix:///var/run/docker.sock", version: str = DEFAULT_API_VERSION,
+                 max_connections: int = MAX_CONNECTIONS):
+        url = urllib.parse.urlsplit(base_url)
+        if url.scheme in ("unix", "http+unix"):
+            self.socket_path, self.address = url.path, None
+        elif url.scheme in ("tcp", "http"):
+            self.socket_path, self.address = None, (url.hostname or "localhost", url.port or 2375)
+        else:
+            raise ValueError(f"Unsupported Docker host for the asynchronous client: {base_url}")
+        self.base_url = base_url
+        self.version = version
+        self._idle = []
+        self._slots = None
+        self._max_connections = max_connections
+
+    @classmethod
+    def from_client(cls, client: docker.DockerClient) -> "AsyncDockerClient":
+        """
+        Return a client for the daemon of a `docker` SDK client, or None if the
+        daemon cannot be reached without TLS.
+        """
+        api = client.api
+        adapter = getattr(api, "_custom_adapter", None)
+        socket_path = getattr(adapter, "socket_path", None)
+        if api.base_url.startswith("http+docker://") and socket_path:
+            base_url = f"unix://{socket_path}"
+        elif api.base_url.startswith("http://"):
+            base_url = "tcp://" + api.base_url[len("http://"):]
+        else:
+            return None
+        return cls(base_url, version=api._version)
+
+    # ---- connections -----------------------------------------------------
+
+    async def _connect(self):
+        if self.socket_path:
+            return await asyncio.open_unix_connection(self.socket_path)
+        return await asyncio.open_connection(*self.address)
+
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_connections)
+        await self._slots.acquire()
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return (reader, writer), True
+            writer.close()
+        try:
+            return await self._connect(), False
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, connection, reusable: bool):
+        if reusable:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+        self._slots.release()
+
+    async def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+    async def __aenter__(self) -> "AsyncDockerClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    # ---- HTTP ------------------------------------------------------------
+
+    def _request_bytes(self, method: str, path: str, params: dict, body: bytes) -> bytes:
+        params = {key: value for key, value in (params or {}).items() if value is not None}
+        target = f"/v{self.version}{path}"
+        if params:
+            target += "?" + urllib.parse.urlencode(params)
+        head = [f"{method} {target} HTTP/1.1", "Host: docker", "User-Agent: prairie"]
+        if body is not None:
+            head += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        elif method in ("POST", "PUT"):
+            head.append("Content-Length: 0")
+        return ("\r\n".join(head) + "\r\n\r\n").encode() + (body or b"")
+
+    @staticmethod
+    async def _read_head(reader) -> tuple:
+        status_line = await reader.readline()
+        if not status_line:
+            raise _NoAnswer("The Docker daemon closed the connection.")
+        status = int(status_line.split(b" ", 2)[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return status, headers
+
+    @staticmethod
+    async def _iter_body(reader, headers: dict):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                data = await reader.readexactly(size)
+                await reader.readexactly(2)
+                yield data
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            if length:
+                yield await reader.readexactly(length)
+        else:
+            while True:
+                data = await reader.read(1 << 16)
+                if not data:
+                    return
+                yield data
+
+    async def _exchange(self, method: str, path: str, params: dict = None, body=None):
+        """
+        Send a request and yield (status, headers) and then the body chunks.
+        """
+        data = None if body is None else json.dumps(body).encode()
+        request = self._request_bytes(method, path, params, data)
+        connection, reused = await self._acquire()
+        reusable = False
+        try:
+            try:
+                connection[1].write(request)
+                await connection[1].drain()
+                status, headers = await self._read_head(connection[0])
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                # The daemon may have closed the idle connection meanwhile: retry once, unless it
+                # may have run the request already and running it again is not harmless
+                unanswered = isinstance(e, _NoAnswer) or (isinstance(e, asyncio.IncompleteReadError) and not e.partial)
+                if not reused or not (unanswered or method in ("GET", "HEAD")):
+                    raise
+                connection[1].close()
+                connection = await self._connect()
+                connection[1].write(request)
+                await connection[1].drain()
+                status, headers = await self._read_head(connection[0])
+            reader = connection[0]
+            yield status, headers
+            # 204 and 304 answers have no body (and no Content-Length)
+            bodyless = status in (204, 304) or method == "HEAD"
+            if not bodyless:
+                async for chunk in self._iter_body(reader, headers):
+                    yield chunk
+            reusable = headers.get("connection", "").lower() != "close" and (
+                bodyless or "content-length" in headers or headers.get("transfer-encoding", "").lower() == "chunked")
+        finally:
+            self._release(connection, reusable)
+
+    async def request(self, method: str, path: str, params: dict = None, body=None, timeout: float = REQUEST_TIMEOUT) -> _Response:
+        """
+        Send a request and return its (complete) response; raise
+        :class:`DockerAPIError` for error statuses.
+        """
+        async def exchange():
+            chunks = self._exchange(method, path, params, body)
+            status, headers = await chunks.__anext__()
+            payload = b"".join([chunk async for chunk in chunks])
+            return _Response(status, headers, payload)
+
+        response = await asyncio.wait_for(exchange(), timeout)
+        if response.status >= 400:
+            raise DockerAPIError(response.status, _error_message(response.body))
+        return response
+
+    async def stream_json(self, method: str, path: str, params: dict = None):
+        """
+        Yield the JSON objects of a streaming response (pull progress, events);
+        raise :class:`DockerAPIError` for error statuses and lines that are not
+        JSON.
+        """
+        chunks = self._exchange(method, path, params)
+        try:
+            status, _ = await chunks.__anext__()
+            if status >= 400:
+                raise DockerAPIError(status, _error_message(b"".join([chunk async for chunk in chunks])))
+            buffer = b""
+            async for chunk in chunks:
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield self._stream_message(status, line)
+            if buffer.strip():
+                yield self._stream_message(status, buffer)
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    def _stream_message(status: int, line: bytes) -> dict:
+        try:
+            return json.loads(line)
+        except ValueError:
+            raise DockerAPIError(status, f"unexpected answer: {line.decode('utf-8', errors='replace').strip()}")
+
+    # ---- Engine API ------------------------------------------------------
+
+    async def ping(self) -> bool:
+        return (await self.request("GET", "/_ping")).body == b"OK"
+
+    async def containers(self, all: bool = False, filters: dict = None) -> list:
+        params = {"all": int(all), "filters": json.dumps(filters) if filters else None}
+        return (await self.request("GET", "/containers/json", params)).json()
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return (await self.request("GET", f"/containers/{container_id}/json")).json()
+
+    async def inspect_containers(self, container_ids: list) -> list:
+        """
+        Inspect containers concurrently; containers removed meanwhile are None.
+        """
+        async def inspect(container_id):
+            try:
+                return await self.inspect_container(container_id)
+            except DockerAPIError as e:
+                if e.status != 404:
+                    raise
+                return None
+
+        return await asyncio.gather(*(inspect(container_id) for container_id in container_ids))
+
+    async def inspect_image(self, name: str) -> dict:
+        return (await self.request("GET", f"/images/{urllib.parse.quote(name, safe='')}/json")).json()
+
+    async def pull(self, image_name: str) -> dict:
+        """
+        Pull an image (following the progress stream to its end), and return
+        the inspected image.
+        """
+        repository, tag = docker.utils.parse_repository_tag(image_name)
+        with profiling.span("docker.pull", image=image_name):
+            async for message in self.stream_json("POST", "/images/create", {"fromImage": repository, "tag": tag or "latest"}):
+                if "error" in message:
+                    raise DockerAPIError(500, message["error"])
+        return await self.inspect_image(image_name if tag else f"{image_name}:latest")
+
+    async def tag_image(self, image_name: str, target: str) -> dict:
+        """
+        Tag an image with another name, and return the inspected image.
+        """
+        repository, tag = docker.utils.parse_repository_tag(target)
+        await self.request("POST", f"/images/{urllib.parse.quote(image_name, safe='')}/tag", {"repo": repository, "tag": tag or "latest"})
+        return await self.inspect_image(target if tag else f"{target}:latest")
+
+    async def create_container(self, config: dict, name: str = None) -> str:
+        response = await self.request("POST", "/containers/create", {"name": name}, body=config)
+        return response.json()["Id"]
+
+    async def start_container(self, container_id: str):
+        await self.request("POST", f"/containers/{container_id}/start")
+
+    async def stop_container(self, container_id: str, timeout: int = 10):
+        await self.request("POST", f"/containers/{container_id}/stop", {"t": timeout}, timeout=timeout + REQUEST_TIMEOUT)
+
+    async def remove_container(self, container_id: str, force: bool = False):
+        await self.request("DELETE", f"/containers/{container_id}", {"force": int(force)})
+
+    async def stats(self, container_id: str) -> dict:
+        return (await self.request("GET", f"/containers/{container_id}/stats", {"stream": 0, "one-shot": 1})).json()
+
+
+def run(coroutine):
+    """
+    Run a coroutine to completion from synchronous code (the synchronous facade
+    of this module), even if an event loop is already running in this thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def target():
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, name="prairie-aio")
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+def run_with_client(client: docker.DockerClient, operation):
+    """
+    Run `operation(async_client)` with an asynchronous client for the daemon
+    of `client`, and return its result, or None if the daemon cannot be
+    reached asynchronously (the caller then uses the `docker` SDK).
+    """
+    async_client = AsyncDockerClient.from_client(client)
+    if async_client is None:
+        loguru.logger.debug(f"No asynchronous client for {client.api.base_url}, using the docker SDK.")
+        return None
+
+    async def main():
+        async with async_client:
+            return await operation(async_client)
+
+    return run(main())
@@ -0,0 +1,335 @@
+"""
+Persistent archive of the logs of PrairieLearn containers.
+
+Containers are launched with ``remove=True``, so their logs disappear when
+they stop. The archiver follows the logs of a container and appends them to
+gzip-compressed segment files in the user cache directory: each flush appends
+a new gzip member, so segments are append-only and stay readable if the
+archiver is killed. Segments are rotated once they hold `segment_bytes` of
+uncompressed output.
+
+Every run (one archived container) also has a JSON inverted index, mapping
+every word of its lines (maximal runs of letters, digits and ``_.-/``, so
+question IDs, error codes and course paths are words) to the segments that
+contain them. ``prairie docker logs --history --grep QID`` uses these indexes
+to only decompress the segments that can match: any match of such a pattern
+contains one of its words, which is indexed. A segment with too many distinct
+words is not indexed, and is always scanned.
+
+The archive is bounded: before archiving a new run, the runs older than
+`max_age_days` are deleted, then the oldest runs until the segments fit in
+`max_bytes`.
+"""
+
+import gzip
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import loguru
+
+from .. import paths
+from . import logs
+
+ARCHIVE_DIRNAME = "logs"
+INDEX_SUFFIX = ".idx.json"
+INDEX_VERSION = 2
+# Beyond this many distinct words, a segment is scanned rather than indexed
+MAX_SEGMENT_WORDS = 50000
+MAX_AGE_DAYS = 30
+MAX_BYTES = 1 << 30
+
+# Words without a letter (timestamps, numbers...) are not indexed: patterns looked up must have a letter
+_WORD_PATTERN = re.compile(rb"[A-Za-z0-9_./\-]*[A-Za-z][A-Za-z0-9_./\-]*")
+_LITERAL_PATTERN = re.compile(r"[A-Za-z0-9_./\-]+")
+_LETTER_PATTERN = re.compile(r"[A-Za-z]")
+
+
+def default_archive_dir() -> str:
+    return paths.user_cache_dir(ARCHIVE_DIRNAME)
+
+
+def extract_words(line: bytes) -> set:
+    """
+    Return the indexed words of a log line.
+    """
+    return {word.decode("ascii") for word in _WORD_PATTERN.findall(line)}
+
+
+class LogArchiver:
+    """
+    Append the log lines of one container run to compressed segments, and
+    maintain the inverted index of the run.
+    """
+
+    def __init__(self, archive_dir: str, container_id: str, container_name: str = None,
+                 segment_bytes: int = 8 << 20, flush_lines: int = 2000, flush_interval: float = 2.0):
+        self.archive_dir = archive_dir
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{container_id[:12]}"
+        self.segment_bytes = segment_bytes
+        self.flush_lines = flush_lines
+        self.flush_interval = flush_interval
+        self.index = {
+            "version": INDEX_VERSION,
+            "run": self.run_id,
+            "container": container_id,
+            "name": container_name,
+            "segments": {},
+            "words": {},
+        }
+        self._buffer = []
+        self._buffer_words = set()
+        self._segment_words = set()
+        self._last_flush = time.monotonic()
+        self._segment_number = 0
+        os.makedirs(archive_dir, exist_ok=True)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.archive_dir, self.run_id + INDEX_SUFFIX)
+
+    def _segment_name(self) -> str:
+        return f"{self.run_id}-{self._segment_number:04d}.log.gz"
+
+    def add(self, lines: list, received: float = None):
+        """
+        Buffer a batch of raw lines received at time `received`.
+        """
+        received = received or time.time()
+        prefix = f"{received:.3f} ".encode()
+        for line in lines:
+            self._buffer.append(prefix + line + b"\n")
+            self._buffer_words |= extract_words(line)
+        if len(self._buffer) >= self.flush_lines or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered lines to the current segment as a new gzip member,
+        and atomically rewrite the index of the run.
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+
+        name = self._segment_name()
+        segment = self.index["segments"].setdefault(name, {"first": None, "last": None, "lines": 0, "bytes": 0, "indexed": True})
+        data = b"".join(self._buffer)
+        with open(os.path.join(self.archive_dir, name), "ab") as f:
+            f.write(gzip.compress(data, compresslevel=6))
+
+        first = float(self._buffer[0].split(b" ", 1)[0])
+        last = float(self._buffer[-1].split(b" ", 1)[0])
+        segment["first"] = segment["first"] or first
+        segment["last"] = last
+        segment["lines"] += len(self._buffer)
+        segment["bytes"] += len(data)
+        if segment["indexed"]:
+            self._segment_words |= self._buffer_words
+            if len(self._segment_words) > MAX_SEGMENT_WORDS:
+                segment["indexed"] = False
+            else:
+                for word in self._buffer_words:
+                    segments = self.index["words"].setdefault(word, [])
+                    if not segments or segments[-1] != name:
+                        segments.append(name)
+
+        self._buffer = []
+        self._buffer_words = set()
+        self._write_index()
+
+        if segment["bytes"] >= self.segment_bytes:
+            self._segment_number += 1
+            self._segment_words = set()
+
+    def _write_index(self):
+        with paths.atomic_write(self.index_path) as f:
+            json.dump(self.index, f)
+
+    def close(self):
+        self.flush()
+
+
+def _exit_on_sigterm(signum, frame):
+    raise SystemExit(0)
+
+
+def archive_container(client, container, archive_dir: str = None, max_age_days: float = MAX_AGE_DAYS,
+                      max_bytes: int = MAX_BYTES, **kwargs) -> dict:
+    """
+    Follow the logs of `container` until it stops, archiving them; return the
+    index of the run. Older runs are pruned first (see :func:`prune`).
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    prune(archive_dir, max_age_days=max_age_days, max_bytes=max_bytes)
+    archiver = LogArchiver(archive_dir, container.id, container.name, **kwargs)
+    loguru.logger.info(f"Archiving the logs of {container.short_id} to {archiver.archive_dir} (run {archiver.run_id}).")
+
+    # Make sure buffered lines are written if the archiver is terminated
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    if in_main_thread:
+        previous_handler = signal.signal(signal.SIGTERM, _exit_on_sigterm)
+    try:
+        for batch in logs.iter_log_batches(client, container, follow=True):
+            archiver.add(batch)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        archiver.close()
+        if in_main_thread:
+            signal.signal(signal.SIGTERM, previous_handler)
+    return archiver.index
+
+
+def spawn_archiver(container_id: str, archive_dir: str = None) -> subprocess.Popen:
+    """
+    Start `prairie docker archive` for a container as a detached background
+    process, which exits when the container stops.
+    """
+    command = [sys.executable, "-m", "prairie.main", "docker", "archive", "--container", container_id]
+    if archive_dir:
+        command += ["--archive-dir", archive_dir]
+    loguru.logger.info(f"Starting the log archiver: {' '.join(command)}")
+    return subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def _run_files(archive_dir: str, index: dict) -> list:
+    return [os.path.join(archive_dir, name) for name in index["segments"]] + [os.path.join(archive_dir, index["run"] + INDEX_SUFFIX)]
+
+
+def prune(archive_dir: str = None, max_age_days: float = MAX_AGE_DAYS, max_bytes: int = MAX_BYTES) -> list:
+    """
+    Delete the archived runs whose last line is older than `max_age_days`,
+    then the oldest runs until the segments of the others fit in `max_bytes`;
+    return the deleted runs.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    indexes = load_indexes(archive_dir)
+    cutoff = time.time() - max_age_days * 86400 if max_age_days is not None else None
+    sizes = {}
+    for index in indexes:
+        sizes[index["run"]] = sum(os.path.getsize(path) for path in _run_files(archive_dir, index) if os.path.exists(path))
+    total = sum(sizes.values())
+
+    pruned = []
+    for index in indexes:
+        last = max((segment["last"] or 0 for segment in index["segments"].values()), default=0)
+        too_old = cutoff is not None and last < cutoff
+        if not too_old and (max_bytes is None or total <= max_bytes):
+            continue
+        for path in _run_files(archive_dir, index):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        total -= sizes[index["run"]]
+        pruned.append(index["run"])
+    if pruned:
+        loguru.logger.info(f"Pruned {len(pruned)} archived run(s) from {archive_dir}.")
+    return pruned
+
+
+def load_indexes(archive_dir: str = None, since: float = None) -> list:
+    """
+    Load the indexes of the archived runs (whose last line is after `since`),
+    oldest first.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    indexes = []
+    try:
+        names = sorted(name for name in os.listdir(archive_dir) if name.endswith(INDEX_SUFFIX))
+    except FileNotFoundError:
+        return []
+    for name in names:
+        try:
+            with open(os.path.join(archive_dir, name)) as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            loguru.logger.warning(f"Skipping unreadable log index {name}: {e}")
+            continue
+        if index.get("version") != INDEX_VERSION:
+            # Runs archived by an older version are pruned as usual, and always scanned
+            index = dict(index, words={}, segments={name: dict(segment, indexed=False) for name, segment in index["segments"].items()})
+        if since and all((segment["last"] or 0) < since for segment in index["segments"].values()):
+            continue
+        indexes.append(index)
+    return indexes
+
+
+def _indexed_literal(pattern: str, ignore_case: bool = False) -> str:
+    """
+    Return a literal that every match of the pattern contains within one
+    indexed word, or None if there is none (the pattern then uses other
+    regular expression syntax, or has no letter).
+
+    Such patterns are made of word characters and "." (any character), so
+    the longest part between dots with a letter is in every match, within a
+    word: e.g., "q7" for "q7", or "intro-q" for "intro-q.v2".
+    """
+    if not pattern or not _LITERAL_PATTERN.fullmatch(pattern):
+        return None
+    parts = [part for part in pattern.split(".") if _LETTER_PATTERN.search(part)]
+    if not parts:
+        return None
+    literal = max(parts, key=len)
+    return literal.lower() if ignore_case else literal
+
+
+def matching_segments(index: dict, literal: str, ignore_case: bool = False) -> list:
+    """
+    Return the segments of a run that can contain `literal`: those with an
+    indexed word containing it, and those that are not indexed.
+    """
+    selected = set()
+    for word, word_segments in index["words"].items():
+        if literal in (word.lower() if ignore_case else word):
+            selected.update(word_segments)
+    return [name for name, segment in index["segments"].items() if name in selected or not segment["indexed"]]
+
+
+def iter_archived_lines(archive_dir: str = None, pattern: str = None, ignore_case: bool = False, since: float = None):
+    """
+    Yield (run index, segment name, list of raw lines) for every segment that
+    may contain lines matching `pattern`, oldest first.
+
+    When every match of the pattern contains an indexed word (a QID, an error
+    code, a course path...), only the segments with such words are read;
+    otherwise every segment is scanned.
+    """
+    archive_dir = archive_dir or default_archive_dir()
+    indexes = load_indexes(archive_dir, since=since)
+
+    literal = _indexed_literal(pattern, ignore_case)
+    if pattern and literal is None:
+        loguru.logger.info(f"'{pattern}' cannot be looked up in the indexes, scanning every archived segment.")
+
+    for index in indexes:
+        segment_names = list(index["segments"]) if literal is None else matching_segments(index, literal, ignore_case)
+        for name in segment_names:
+            if since and (index["segments"][name]["last"] or 0) < since:
+                continue
+            try:
+                with gzip.open(os.path.join(archive_dir, name), "rb") as f:
+                    data = f.read()
+            except (OSError, EOFError) as e:
+                loguru.logger.warning(f"Skipping unreadable log segment {name}: {e}")
+                continue
+            lines = []
+            # Only \n ends an entry: lines can contain \r (e.g., progress bars)
+            for entry in data.split(b"\n")[:-1]:
+                received, _, line = entry.partition(b" ")
+                if since and float(received) < since:
+                    continue
+                lines.append(line)
+            yield index, name, lines
@@ -0,0 +1,144 @@
+"""
+Offline image bundles, to install PrairieLearn in rooms with poor bandwidth.
+
+A bundle is the output of ``docker save`` for a set of images (PrairieLearn
+and, optionally, the grader and workspace images a course uses), compressed
+with gzip or zstd. All the images are exported in a single request, so that
+the layers they share are stored once, and the tar archive flows from the
+daemon through the compressor to the file (and back, for loads) in chunks of
+:data:`CHUNK_SIZE`: an image is never held in memory.
+
+Since a bundle is a plain compressed ``docker save`` archive, it can also be
+loaded without `prairie`, e.g. ``gunzip -c bundle.tar.gz | docker load``.
+
+zstd is optional: it requires the `zstandard` package.
+"""
+
+import gzip
+import os
+import time
+
+import docker
+import loguru
+
+from .. import paths, profiling
+
+COMPRESSIONS = ("gzip", "zstd")
+CHUNK_SIZE = 1 << 20
+
+# First bytes of the compressed streams
+MAGIC_NUMBERS = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression requires the optional 'zstandard' package (pip install zstandard); use gzip instead.")
+    return zstandard
+
+
+def compressed_writer(f, compression: str, level: int = None):
+    """
+    Return a file object compressing what is written to it into `f` (which
+    stays open), with gzip or zstd.
+    """
+    if compression == "gzip":
+        return gzip.GzipFile(filename="", fileobj=f, mode="wb", compresslevel=6 if level is None else level, mtime=0)
+    if compression == "zstd":
+        # threads=-1: compress with as many threads as there are cores
+        return _zstandard().ZstdCompressor(level=3 if level is None else level, threads=-1).stream_writer(f, closefd=False)
+    raise ValueError(f"Unknown compression '{compression}', expected one of: {', '.join(COMPRESSIONS)}.")
+
+
+def compressed_reader(f, compression: str):
+    """
+    Return a file object decompressing `f`, with gzip or zstd.
+    """
+    if compression == "zstd":
+        return _zstandard().ZstdDecompressor().stream_reader(f)
+    return gzip.GzipFile(fileobj=f, mode="rb")
+
+
+def compression_of(head: bytes) -> str:
+    """
+    Return the compression of a stream starting with `head`, or None.
+    """
+    for magic, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def detect_compression(path: str) -> str:
+    with open(path, "rb") as f:
+        compression = compression_of(f.read(4))
+    if compression is None:
+        raise ValueError(f"{path} is not a gzip or zstd compressed bundle.")
+    return compression
+
+
+def export_images(client: docker.DockerClient, image_names: list):
+    """
+    Stream the ``docker save`` archive of several images, in chunks.
+    """
+    api = client.api
+    response = api._get(api._url("/images/get"), params={"names": list(image_names)}, stream=True, timeout=None)
+    api._raise_for_status(response)
+    try:
+        yield from response.iter_content(CHUNK_SIZE)
+    finally:
+        response.close()
+
+
+def save_bundle(client: docker.DockerClient, path: str, image_names: list, compression: str = "gzip", level: int = None) -> dict:
+    """
+    Save images to a compressed bundle at `path` (replaced atomically), and
+    return statistics about it.
+    """
+    start = time.perf_counter()
+    raw_bytes = 0
+    with profiling.span("bundle.save", images=len(image_names), compression=compression):
+        with paths.atomic_write(path, "wb") as f:
+            with compressed_writer(f, compression, level) as writer:
+                for chunk in export_images(client, image_names):
+                    writer.write(chunk)
+                    raw_bytes += len(chunk)
+
+    stats = {
+        "images": list(image_names),
+        "raw_bytes": raw_bytes,
+        "bytes": os.path.getsize(path),
+        "compression": compression,
+        "seconds": time.perf_counter() - start,
+    }
+    loguru.logger.info(f"Saved {len(image_names)} image(s) to {path}: {raw_bytes} bytes compressed to {stats['bytes']} in {stats['seconds']:.1f}s.")
+    return stats
+
+
+def _decompressed_chunks(path: str, compression: str):
+    with open(path, "rb") as f:
+        with compressed_reader(f, compression) as reader:
+            while True:
+                chunk = reader.read(CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+
+def load_bundle(client: docker.DockerClient, path: str) -> list:
+    """
+    Load the images of a bundle into the daemon, streaming the decompressed
+    archive as the request body; return the loaded image tags.
+    """
+    compression = detect_compression(path)
+    loaded = []
+    with profiling.span("bundle.load", compression=compression):
+        for message in client.api.load_image(_decompressed_chunks(path, compression)):
+            if "error" in message:
+                raise docker.errors.APIError(message["error"])
+            text = (message.get("stream") or "").strip()
+            if text.startswith("Loaded image"):
+                loaded.append(text.split(":", 1)[1].strip())
+                loguru.logger.info(text)
+    return loaded
@@ -0,0 +1,810 @@
+"""
+An in-process stand-in for the Docker Engine API.
+
+:class:`FakeDockerDaemon` serves the subset of the Engine API that `prairie`
+uses (ping/version, image pull, inspect, save and load, container create,
+start, stop, inspect, list and remove, and the event stream) over a local TCP
+port or a unix socket. Point ``DOCKER_HOST`` at
+:attr:`FakeDockerDaemon.base_url` and the regular `docker` SDK, hence the
+whole CLI, talks to it instead of a real daemon.
+
+Every endpoint can be given a scripted latency, so that tests and benchmarks
+can reproduce a slow pull or a slow container start, and tell the CLI's own
+overhead apart from the time spent waiting on the daemon.
+"""
+
+import datetime
+import hashlib
+import http.server
+import io
+import itertools
+import json
+import os
+import re
+import socketserver
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import docker
+import loguru
+
+API_VERSION = "1.43"
+
+_VERSION_PREFIX = re.compile(r"^/v\d+\.\d+")
+
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _split_tag(name: str) -> tuple:
+    """
+    Split "repo:tag" (the repo may contain a registry port) into (repo, tag).
+    """
+    repo, sep, tag = name.rpartition(":")
+    if not sep or "/" in tag:
+        return name, "latest"
+    return repo, tag
+
+
+# The default backlog (5) resets connections when clients connect concurrently
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _ChunkedReader:
+    """
+    A file-like reader of a chunked request body.
+    """
+
+    def __init__(self, rfile):
+        self.rfile = rfile
+        self.remaining = 0
+        self.done = False
+
+    def read(self, size: int = -1) -> bytes:
+        data = []
+        while not self.done and (size < 0 or size > 0):
+            if not self.remaining:
+                self.remaining = int(self.rfile.readline().split(b";")[0], 16)
+                if not self.remaining:
+                    self.rfile.readline()
+                    self.done = True
+                    break
+            part = self.rfile.read(self.remaining if size < 0 else min(size, self.remaining))
+            self.remaining -= len(part)
+            if not self.remaining:
+                self.rfile.readline()
+            data.append(part)
+            if size > 0:
+                size -= len(part)
+        return b"".join(data)
+
+
+class _ChunkWriter:
+    """
+    A file-like writer sending what is written as chunks of a streamed response.
+    """
+
+    def __init__(self, request, buffer_size: int = 1 << 16):
+        self.request = request
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        self.request.write_chunk(bytes(self.buffer))
+        self.buffer.clear()
+
+
+class _PatternReader:
+    """
+    A file-like reader of `size` bytes repeating `pattern` (the fake content
+    of exported image layers).
+    """
+
+    def __init__(self, pattern: bytes, size: int):
+        self.block = (pattern * (1 + (1 << 16) // len(pattern)))[:1 << 16]
+        self.remaining = size
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        blocks = self.block * (size // len(self.block)) + self.block[:size % len(self.block)]
+        self.remaining -= size
+        return blocks
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeDocker/" + API_VERSION
+
+    # Set on the subclass created by FakeDockerDaemon.start()
+    daemon = None
+
+    def log_message(self, format, *args):
+        loguru.logger.trace("fake docker: " + format % args)
+
+    def address_string(self):
+        return str(self.client_address or "unix")
+
+    def _dispatch(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        path = _VERSION_PREFIX.sub("", parsed.path)
+        query = {key: values[-1] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+        self.query_lists = urllib.parse.parse_qs(parsed.query)
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            # Streamed uploads (e.g., image loads) are read by the handler
+            body = _ChunkedReader(self.rfile)
+        else:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+
+        for method, pattern, endpoint, handler in self.daemon.routes:
+            if method != self.command:
+                continue
+            match = pattern.match(path)
+            if match is None:
+                continue
+            self.daemon._record(self.command, endpoint)
+            self.daemon._sleep(endpoint)
+            try:
+                handler(self, query, body, **match.groupdict())
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            return
+        self.send_json({"message": f"page not found: {self.command} {path}"}, status=404)
+
+    do_GET = do_POST = do_DELETE = do_HEAD = do_PUT = _dispatch
+
+    def send_json(self, payload, status: int = 200):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status: int = 204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_bytes(self, data: bytes, content_type: str = "text/plain", status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self, content_type: str = "application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes):
+        if data:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+class FakeDockerDaemon:
+    """
+    A scriptable, thread-safe fake of the Docker Engine API.
+
+    `latencies` maps endpoint names (e.g., "images/create", "containers/start";
+    see :attr:`routes`) to the number of seconds to sleep before answering.
+    """
+
+    def __init__(self, socket_path: str = None, latencies: dict = None):
+        self.socket_path = socket_path
+        self.latencies = dict(latencies or {})
+        self.images = {}
+        self.containers = {}
+        self.events = []
+        self.requests = []
+        self.scripted_seconds = 0.0
+        self.stats_interval = 1.0
+        self.root_dir = tempfile.gettempdir()
+        # The cores of the daemon's machine, which may not be this machine's (e.g., Docker Desktop's VM)
+        self.ncpu = os.cpu_count()
+        # Exported images contain one layer of (at most) this many bytes
+        self.export_layer_bytes = 1 << 20
+        # Registries (e.g., "localhost:5000") from which pulls fail
+        self.unreachable_registries = set()
+        self._lock = threading.Condition()
+        self._ids = itertools.count(1)
+        self._server = None
+        self._thread = None
+        self.routes = self._build_routes()
+
+    # ---- lifecycle -------------------------------------------------------
+
+    @property
+    def base_url(self) -> str:
+        if self.socket_path:
+            return f"unix://{self.socket_path}"
+        host, port = self._server.server_address[:2]
+        return f"tcp://{host}:{port}"
+
+    def environ(self) -> dict:
+        """
+        Return the environment variables pointing the `docker` SDK at this daemon.
+        """
+        return {"DOCKER_HOST": self.base_url, "DOCKER_TLS_VERIFY": "", "DOCKER_CERT_PATH": ""}
+
+    def client(self) -> docker.DockerClient:
+        return docker.DockerClient(base_url=self.base_url, version=API_VERSION)
+
+    def start(self) -> "FakeDockerDaemon":
+        # Without TCP_NODELAY, headers and body written separately hit the
+        # Nagle/delayed-ACK interaction and every request takes ~40ms
+        handler = type("Handler", (_Handler,), {"daemon": self, "disable_nagle_algorithm": not self.socket_path})
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._server = _ThreadingUnixHTTPServer(self.socket_path, handler)
+        else:
+            self._server = _ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-docker", daemon=True)
+        self._thread.start()
+        loguru.logger.debug(f"Fake Docker daemon listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        with self._lock:
+            self._lock.notify_all()
+        server.shutdown()
+        server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def __enter__(self) -> "FakeDockerDaemon":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        return self._server is not None
+
+    # ---- scripted state --------------------------------------------------
+
+    def add_image(self, name: str, size: int = 1_500_000_000) -> dict:
+        """
+        Make an image available locally, as if it had been pulled.
+        """
+        repo, tag = _split_tag(name)
+        reference = f"{repo}:{tag}"
+        with self._lock:
+            image = self._find_image(reference)
+            if image is None:
+                digest = hashlib.sha256(reference.encode()).hexdigest()
+                image = {
+                    "Id": f"sha256:{digest}",
+                    "RepoTags": [reference],
+                    "RepoDigests": [f"{repo}@sha256:{digest}"],
+                    "Created": _now_iso(),
+                    "Size": size,
+                    "Config": {"Env": [], "ExposedPorts": {}},
+                }
+                self.images[image["Id"]] = image
+            return image
+
+    def add_container(
+        self,
+        image: str = "prairielearn/prairielearn:us-prod-live",
+        name: str = None,
+        status: str = "running",
+        ports: dict = None,
+        volumes: dict = None,
+        environment: dict = None,
+        labels: dict = None,
+        tty: bool = True,
+    ) -> dict:
+        """
+        Create a container directly in the daemon state, bypassing the API.
+        """
+        binds = [f"{src}:{spec['bind']}:{spec.get('mode', 'rw')}" for src, spec in (volumes or {}).items()]
+        port_bindings = {
+            f"{private}/tcp" if "/" not in str(private) else str(private): [{"HostIp": "0.0.0.0", "HostPort": str(public)}]
+            for private, public in (ports or {}).items()
+        }
+        config = {
+            "Image": image,
+            "Env": [f"{key}={value}" for key, value in (environment or {}).items()],
+            "Labels": labels or {},
+            "Tty": tty,
+            "HostConfig": {"Binds": binds, "PortBindings": port_bindings},
+        }
+        container = self._create_container(config, name)
+        if status == "running":
+            self._start_container(container)
+        else:
+            container["State"]["Status"] = status
+        return container
+
+    def add_log(self, container_id: str, line, stream: int = 1, timestamp: float = None):
+        """
+        Append a line (str or bytes, without newline) to the output of a
+        container; `stream` is 1 for stdout and 2 for stderr.
+        """
+        data = line.encode() if isinstance(line, str) else line
+        with self._lock:
+            self.containers[container_id]["Logs"].append((timestamp or time.time(), stream, data + b"\n"))
+            self._lock.notify_all()
+
+    def set_load(self, container_id: str, cpu: float = 0.0, memory: int = 0, blk_read: float = 0.0,
+                 blk_write: float = 0.0, net_rx: float = 0.0, net_tx: float = 0.0):
+        """
+        Script the resource usage reported by the stats endpoint for a container:
+        `cpu` in cores, `memory` in bytes, and I/O rates in bytes per second.
+        """
+        with self._lock:
+            self.containers[container_id]["Load"] = {
+                "cpu": cpu, "memory": memory, "blk_read": blk_read,
+                "blk_write": blk_write, "net_rx": net_rx, "net_tx": net_tx,
+            }
+
+    def set_latency(self, endpoint: str, seconds: float):
+        self.latencies[endpoint] = seconds
+
+    def emit_event(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+            self._lock.notify_all()
+
+    # ---- internals -------------------------------------------------------
+
+    def _record(self, method: str, endpoint: str):
+        with self._lock:
+            self.requests.append((method, endpoint))
+
+    def _sleep(self, endpoint: str):
+        delay = self.latencies.get(endpoint, 0)
+        if delay:
+            with self._lock:
+                self.scripted_seconds += delay
+            time.sleep(delay)
+
+    def _find_image(self, reference: str):
+        if reference in self.images:
+            return self.images[reference]
+        if f"sha256:{reference}" in self.images:
+            return self.images[f"sha256:{reference}"]
+        repo, tag = _split_tag(reference)
+        wanted = f"{repo}:{tag}"
+        for image in self.images.values():
+            if wanted in image["RepoTags"]:
+                return image
+        return None
+
+    def _find_container(self, ref: str):
+        if ref in self.containers:
+            return self.containers[ref]
+        for container in self.containers.values():
+            if container["Id"].startswith(ref) or container["Name"].lstrip("/") == ref:
+                return container
+        return None
+
+    def _event(self, kind: str, action: str, actor_id: str, attributes: dict):
+        now = time.time()
+        self.emit_event({
+            "Type": kind,
+            "Action": action,
+            "Actor": {"ID": actor_id, "Attributes": attributes},
+            "status": action,
+            "id": actor_id,
+            "from": attributes.get("image"),
+            "time": int(now),
+            "timeNano": int(now * 1e9),
+        })
+
+    def _create_container(self, config: dict, name: str = None) -> dict:
+        with self._lock:
+            image = self._find_image(config["Image"])
+            container_id = hashlib.sha256(f"container-{next(self._ids)}".encode()).hexdigest()
+            name = name or f"fake_{container_id[:8]}"
+        if image is None:
+            raise KeyError(config["Image"])
+
+        host_config = config.get("HostConfig") or {}
+        mounts = []
+        for bind in host_config.get("Binds") or []:
+            parts = bind.split(":")
+            source, destination = parts[0], parts[1]
+            mode = parts[2] if len(parts) > 2 else "rw"
+            mounts.append({"Type": "bind", "Source": source, "Destination": destination, "Mode": mode, "RW": "ro" not in mode})
+
+        container = {
+            "Id": container_id,
+            "Name": f"/{name}",
+            "Created": _now_iso(),
+            "Image": image["Id"],
+            "Config": {
+                "Image": config["Image"],
+                "Env": config.get("Env") or [],
+                "Cmd": config.get("Cmd"),
+                "Labels": config.get("Labels") or {},
+                "Tty": bool(config.get("Tty")),
+                "ExposedPorts": config.get("ExposedPorts") or {},
+            },
+            "HostConfig": host_config,
+            "State": {"Status": "created", "Running": False, "ExitCode": 0, "StartedAt": "0001-01-01T00:00:00Z"},
+            "RestartCount": 0,
+            "NetworkSettings": {"Ports": {}},
+            "Mounts": mounts,
+            "Logs": [],
+            "Load": {"cpu": 0.0, "memory": 0, "blk_read": 0.0, "blk_write": 0.0, "net_rx": 0.0, "net_tx": 0.0},
+        }
+        with self._lock:
+            self.containers[container_id] = container
+        self._event("container", "create", container_id, {"image": config["Image"], "name": name})
+        return container
+
+    def _start_container(self, container: dict):
+        with self._lock:
+            container["State"].update({"Status": "running", "Running": True, "StartedAt": _now_iso()})
+            container["NetworkSettings"]["Ports"] = dict(container["HostConfig"].get("PortBindings") or {})
+        self._event("container", "start", container["Id"], {"image": container["Config"]["Image"], "name": container["Name"][1:]})
+
+    def _stop_container(self, container: dict):
+        with self._lock:
+            container["State"].update({"Status": "exited", "Running": False, "FinishedAt": _now_iso()})
+            self._lock.notify_all()
+            container["NetworkSettings"]["Ports"] = {}
+            auto_remove = container["HostConfig"].get("AutoRemove")
+        attributes = {"image": container["Config"]["Image"], "name": container["Name"][1:]}
+        self._event("container", "die", container["Id"], {**attributes, "exitCode": "0"})
+        self._event("container", "stop", container["Id"], attributes)
+        if auto_remove:
+            self._remove_container(container)
+
+    def _remove_container(self, container: dict):
+        with self._lock:
+            self.containers.pop(container["Id"], None)
+        self._event("container", "destroy", container["Id"], {"image": container["Config"]["Image"], "name": container["Name"][1:]})
+
+    def _summary(self, container: dict) -> dict:
+        ports = []
+        for private, bindings in (container["NetworkSettings"]["Ports"] or {}).items():
+            number, _, proto = private.partition("/")
+            for binding in bindings or []:
+                ports.append({"PrivatePort": int(number), "PublicPort": int(binding["HostPort"]), "Type": proto or "tcp", "IP": binding.get("HostIp", "")})
+        return {
+            "Id": container["Id"],
+            "Names": [container["Name"]],
+            "Image": container["Config"]["Image"],
+            "ImageID": container["Image"],
+            "Created": int(time.time()),
+            "State": container["State"]["Status"],
+            "Status": container["State"]["Status"],
+            "Ports": ports,
+            "Labels": container["Config"]["Labels"],
+            "Mounts": container["Mounts"],
+        }
+
+    # ---- routes ----------------------------------------------------------
+
+    def _build_routes(self) -> list:
+        table = [
+            ("GET", r"/_ping", "ping", FakeDockerDaemon._h_ping),
+            ("HEAD", r"/_ping", "ping", FakeDockerDaemon._h_ping),
+            ("GET", r"/version", "version", FakeDockerDaemon._h_version),
+            ("GET", r"/info", "info", FakeDockerDaemon._h_info),
+            ("POST", r"/images/create", "images/create", FakeDockerDaemon._h_image_create),
+            ("GET", r"/images/json", "images/list", FakeDockerDaemon._h_image_list),
+            ("GET", r"/images/get", "images/get", FakeDockerDaemon._h_image_export),
+            ("POST", r"/images/load", "images/load", FakeDockerDaemon._h_image_load),
+            ("GET", r"/images/(?P<name>.+)/json", "images/json", FakeDockerDaemon._h_image_inspect),
+            ("POST", r"/images/(?P<name>.+)/tag", "images/tag", FakeDockerDaemon._h_image_tag),
+            ("POST", r"/containers/create", "containers/create", FakeDockerDaemon._h_container_create),
+            ("GET", r"/containers/json", "containers/list", FakeDockerDaemon._h_container_list),
+            ("GET", r"/containers/(?P<ref>[^/]+)/json", "containers/json", FakeDockerDaemon._h_container_inspect),
+            ("POST", r"/containers/(?P<ref>[^/]+)/start", "containers/start", FakeDockerDaemon._h_container_start),
+            ("POST", r"/containers/(?P<ref>[^/]+)/stop", "containers/stop", FakeDockerDaemon._h_container_stop),
+            ("POST", r"/containers/(?P<ref>[^/]+)/kill", "containers/kill", FakeDockerDaemon._h_container_stop),
+            ("DELETE", r"/containers/(?P<ref>[^/]+)", "containers/delete", FakeDockerDaemon._h_container_delete),
+            ("GET", r"/containers/(?P<ref>[^/]+)/logs", "containers/logs", FakeDockerDaemon._h_container_logs),
+            ("GET", r"/containers/(?P<ref>[^/]+)/stats", "containers/stats", FakeDockerDaemon._h_container_stats),
+            ("GET", r"/events", "events", FakeDockerDaemon._h_events),
+        ]
+        return [
+            (method, re.compile(f"^{pattern}$"), endpoint, (lambda func: lambda request, query, body, **kw: func(self, request, query, body, **kw))(func))
+            for method, pattern, endpoint, func in table
+        ]
+
+    def _h_ping(self, request, query, body):
+        request.send_bytes(b"OK")
+
+    def _h_version(self, request, query, body):
+        request.send_json({
+            "Version": "24.0.0-fake",
+            "ApiVersion": API_VERSION,
+            "MinAPIVersion": "1.12",
+            "Os": "linux",
+            "Arch": "amd64",
+        })
+
+    def _h_info(self, request, query, body):
+        with self._lock:
+            running = sum(1 for c in self.containers.values() if c["State"]["Running"])
+            request.send_json({
+                "Containers": len(self.containers),
+                "ContainersRunning": running,
+                "Images": len(self.images),
+                "NCPU": self.ncpu,
+                "DockerRootDir": self.root_dir,
+                "ServerVersion": "24.0.0-fake",
+            })
+
+    def _h_image_create(self, request, query, body):
+        repo = query.get("fromImage", "")
+        tag = query.get("tag") or "latest"
+        reference = f"{repo}:{tag}"
+        if repo.split("/")[0] in self.unreachable_registries:
+            request.send_json({"message": f"Get \"https://{repo.split('/')[0]}/v2/\": dial tcp: connection refused"}, status=500)
+            return
+        image = self.add_image(reference)
+        self._event("image", "pull", reference, {"name": reference})
+        request.start_stream()
+        request.write_chunk(json.dumps({"status": f"Pulling from {repo}", "id": tag}).encode() + b"\r\n")
+        request.write_chunk(json.dumps({"status": f"Digest: {image['RepoDigests'][0].split('@')[1]}"}).encode() + b"\r\n")
+        request.write_chunk(json.dumps({"status": f"Status: Image is up to date for {reference}"}).encode() + b"\r\n")
+        request.end_stream()
+
+    def _h_image_tag(self, request, query, body, name):
+        reference = f"{query.get('repo', '')}:{query.get('tag') or 'latest'}"
+        with self._lock:
+            image = self._find_image(urllib.parse.unquote(name))
+            if image is None:
+                request.send_json({"message": f"No such image: {name}"}, status=404)
+                return
+            for other in self.images.values():
+                if reference in other["RepoTags"]:
+                    other["RepoTags"].remove(reference)
+            image["RepoTags"].append(reference)
+        self._event("image", "tag", image["Id"], {"name": reference})
+        request.send_bytes(b"", status=201)
+
+    def _h_image_list(self, request, query, body):
+        with self._lock:
+            request.send_json([
+                {"Id": image["Id"], "RepoTags": image["RepoTags"], "RepoDigests": image["RepoDigests"], "Size": image["Size"], "Created": 0}
+                for image in self.images.values()
+            ])
+
+    def _h_image_export(self, request, query, body):
+        names = list(dict.fromkeys(request.query_lists.get("names", [])))
+        with self._lock:
+            images = [(name, self._find_image(name)) for name in names]
+        missing = [name for name, image in images if image is None]
+        if missing:
+            request.send_json({"message": f"No such image: {missing[0]}"}, status=404)
+            return
+
+        # The layout of `docker save`: layer blobs, then manifest.json
+        request.start_stream("application/x-tar")
+        writer = _ChunkWriter(request)
+        manifest = []
+        with tarfile.open(fileobj=writer, mode="w|") as tar:
+            for name, image in images:
+                digest = image["Id"].split(":", 1)[1]
+                layer = tarfile.TarInfo(f"blobs/sha256/{digest}")
+                layer.size = min(image["Size"], self.export_layer_bytes)
+                tar.addfile(layer, _PatternReader(digest.encode(), layer.size))
+                repo, tag = _split_tag(name)
+                manifest.append({"RepoTags": [f"{repo}:{tag}"], "Layers": [layer.name], "FakeSize": image["Size"]})
+            data = json.dumps(manifest).encode()
+            info = tarfile.TarInfo("manifest.json")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        writer.flush()
+        request.end_stream()
+
+    def _h_image_load(self, request, query, body):
+        stream = body if hasattr(body, "read") else io.BytesIO(body)
+        manifest = []
+        try:
+            with tarfile.open(fileobj=stream, mode="r|") as tar:
+                for member in tar:
+                    content = tar.extractfile(member)
+                    if member.name == "manifest.json":
+                        manifest = json.load(content)
+                    elif content is not None:
+                        while content.read(1 << 16):
+                            pass
+        except tarfile.TarError as e:
+            request.send_json({"message": f"invalid tar archive: {e}"}, status=500)
+            return
+        request.start_stream()
+        for entry in manifest:
+            for tag in entry.get("RepoTags") or []:
+                self.add_image(tag, size=entry.get("FakeSize", 1_500_000_000))
+                request.write_chunk(json.dumps({"stream": f"Loaded image: {tag}\n"}).encode() + b"\r\n")
+        request.end_stream()
+
+    def _h_image_inspect(self, request, query, body, name):
+        with self._lock:
+            image = self._find_image(urllib.parse.unquote(name))
+        if image is None:
+            request.send_json({"message": f"No such image: {name}"}, status=404)
+        else:
+            request.send_json(image)
+
+    def _h_container_create(self, request, query, body):
+        config = json.loads(body or b"{}")
+        try:
+            container = self._create_container(config, query.get("name"))
+        except KeyError:
+            request.send_json({"message": f"No such image: {config.get('Image')}"}, status=404)
+            return
+        request.send_json({"Id": container["Id"], "Warnings": []}, status=201)
+
+    def _h_container_list(self, request, query, body):
+        show_all = query.get("all") in ("1", "true", "True")
+        with self._lock:
+            containers = [c for c in self.containers.values() if show_all or c["State"]["Running"]]
+            request.send_json([self._summary(c) for c in containers])
+
+    def _h_container_inspect(self, request, query, body, ref):
+        with self._lock:
+            container = self._find_container(ref)
+            payload = None if container is None else {k: v for k, v in container.items() if k not in ("Logs", "Load")}
+        if payload is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+        else:
+            request.send_json(payload)
+
+    def _h_container_start(self, request, query, body, ref):
+        container = self._find_container(ref)
+        if container is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+            return
+        if container["State"]["Running"]:
+            request.send_empty(304)
+            return
+        self._start_container(container)
+        request.send_empty()
+
+    def _h_container_stop(self, request, query, body, ref):
+        container = self._find_container(ref)
+        if container is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+            return
+        self._stop_container(container)
+        request.send_empty()
+
+    def _h_container_delete(self, request, query, body, ref):
+        container = self._find_container(ref)
+        if container is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+            return
+        self._remove_container(container)
+        request.send_empty()
+
+    def _h_events(self, request, query, body):
+        since = float(query["since"]) if query.get("since") else None
+        until = float(query["until"]) if query.get("until") else None
+        request.start_stream()
+        position = 0
+        while True:
+            with self._lock:
+                pending = self.events[position:]
+                position = len(self.events)
+            for event in pending:
+                if since is not None and event["time"] < since:
+                    continue
+                if until is not None and event["time"] > until:
+                    continue
+                request.write_chunk(json.dumps(event).encode() + b"\n")
+            if until is not None and time.time() >= until:
+                break
+            with self._lock:
+                if not self.running:
+                    break
+                if position == len(self.events):
+                    self._lock.wait(timeout=0.1)
+        request.end_stream()
+
+    def _h_container_logs(self, request, query, body, ref):
+        container = self._find_container(ref)
+        if container is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+            return
+        streams = {stream for stream, flag in ((1, query.get("stdout")), (2, query.get("stderr"))) if flag in ("1", "true", "True")}
+        since = float(query.get("since") or 0)
+        tail = query.get("tail", "all")
+        follow = query.get("follow") in ("1", "true", "True")
+        timestamps = query.get("timestamps") in ("1", "true", "True")
+        tty = container["Config"]["Tty"]
+
+        def frame(timestamp, stream, data):
+            if timestamps:
+                data = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat().encode() + b" " + data
+            if tty:
+                return data
+            # Multiplexed stream: 8-byte header (stream type, 3 zero bytes, big-endian length)
+            return bytes([stream, 0, 0, 0]) + len(data).to_bytes(4, "big") + data
+
+        with self._lock:
+            lines = [entry for entry in container["Logs"] if entry[1] in streams and entry[0] >= since]
+            position = len(container["Logs"])
+        if tail not in ("all", "", None) and int(tail) >= 0:
+            lines = lines[len(lines) - int(tail):] if int(tail) else []
+
+        request.start_stream("application/vnd.docker.raw-stream" if tty else "application/vnd.docker.multiplexed-stream")
+        request.write_chunk(b"".join(frame(*entry) for entry in lines))
+        while follow:
+            with self._lock:
+                done = not self.running or not container["State"]["Running"]
+                if position == len(container["Logs"]) and not done:
+                    self._lock.wait(timeout=0.1)
+                pending = container["Logs"][position:]
+                position = len(container["Logs"])
+            request.write_chunk(b"".join(frame(*entry) for entry in pending if entry[1] in streams))
+            if done:
+                break
+        request.end_stream()
+
+    def _stats_sample(self, container: dict, started: float, now: float) -> dict:
+        load = container["Load"]
+        elapsed = now - started
+        cpus = os.cpu_count() or 1
+        return {
+            "read": datetime.datetime.fromtimestamp(now, datetime.timezone.utc).isoformat().replace("+00:00", "Z"),
+            "cpu_stats": {
+                "cpu_usage": {"total_usage": int(load["cpu"] * elapsed * 1e9)},
+                "system_cpu_usage": int(cpus * (started + elapsed) * 1e9),
+                "online_cpus": cpus,
+            },
+            "memory_stats": {"usage": load["memory"], "limit": 8 * 2 ** 30, "stats": {"inactive_file": 0}},
+            "blkio_stats": {"io_service_bytes_recursive": [
+                {"major": 8, "minor": 0, "op": "read", "value": int(load["blk_read"] * elapsed)},
+                {"major": 8, "minor": 0, "op": "write", "value": int(load["blk_write"] * elapsed)},
+            ]},
+            "networks": {"eth0": {"rx_bytes": int(load["net_rx"] * elapsed), "tx_bytes": int(load["net_tx"] * elapsed)}},
+        }
+
+    def _h_container_stats(self, request, query, body, ref):
+        container = self._find_container(ref)
+        if container is None:
+            request.send_json({"message": f"No such container: {ref}"}, status=404)
+            return
+        stream = query.get("stream", "1") in ("1", "true", "True")
+        started = time.time()
+        if not stream:
+            request.send_json(self._stats_sample(container, started, started + self.stats_interval))
+            return
+
+        request.start_stream()
+        while True:
+            request.write_chunk(json.dumps(self._stats_sample(container, started, time.time())).encode() + b"\n")
+            with self._lock:
+                self._lock.wait(timeout=self.stats_interval)
+                if not self.running or not container["State"]["Running"]:
+                    break
+        request.end_stream()
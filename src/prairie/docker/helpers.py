@@ -1,8 +1,16 @@
+import asyncio
+import datetime
 import os
+import re
+import time
 
 import docker
 import loguru
 
+from .. import profiling
+from ..config import profiles as config_profiles
+from . import aio, history, placement, preflight
+
 def set_docker_host():
     """
     Set the DOCKER_HOST environment variable based on the operating system if it's not already set.
@@ -15,29 +23,247 @@ def set_docker_host():
         
     return False
 
+PRAIRIELEARN_REPOSITORY = "prairielearn/prairielearn"
+
+def _is_prairielearn_image(image: str) -> bool:
+    # The summary of a container whose image was retagged (or removed) only
+    # has the image ID: keep it, the inspected configuration tells
+    return PRAIRIELEARN_REPOSITORY in image or image.startswith("sha256:")
+
+def list_prairielearn_containers(client: docker.DockerClient, all: bool = True) -> list:
+    """
+    List the PrairieLearn containers (running ones only unless `all`), most
+    recently started first.
+
+    The candidate containers are inspected concurrently.
+    """
+    async def inspect(async_client):
+        summaries = await async_client.containers(all=all)
+        return await async_client.inspect_containers([
+            summary["Id"] for summary in summaries if _is_prairielearn_image(summary.get("Image", ""))
+        ])
+
+    inspected = aio.run_with_client(client, inspect)
+    if inspected is None:
+        containers = client.containers.list(all=all)
+    else:
+        containers = [client.containers.prepare_model(attrs) for attrs in inspected if attrs is not None]
+    containers = [
+        container for container in containers
+        if PRAIRIELEARN_REPOSITORY in container.attrs["Config"].get("Image", "")
+        or any(PRAIRIELEARN_REPOSITORY in tag for tag in container.image.tags)
+    ]
+    containers.sort(key=lambda container: container.attrs["State"].get("StartedAt", ""), reverse=True)
+    return containers
+
+def find_container(client: docker.DockerClient, container_ref: str = None) -> docker.models.containers.Container:
+    """
+    Return the container with the given ID or name or, by default, the most
+    recently started running PrairieLearn container.
+    """
+    if container_ref:
+        return client.containers.get(container_ref)
+    containers = list_prairielearn_containers(client, all=False)
+    if not containers:
+        raise ValueError("No PrairieLearn container is currently running.")
+    return containers[0]
+
+def container_summaries(client: docker.DockerClient) -> list:
+    """
+    Return what `prairie docker status` shows of each PrairieLearn container,
+    as JSON-serializable dictionaries.
+    """
+    summaries = []
+    for container in list_prairielearn_containers(client, all=True):
+        image = container.attrs["Config"].get("Image") or container.attrs.get("Image")
+        summaries.append({
+            "id": container.id,
+            "name": container.name,
+            "status": container.status,
+            "image": image or "Unknown",
+            "ports": container.ports or {},
+            "mounts": [
+                {"source": mount["Source"], "destination": mount["Destination"]}
+                for mount in container.attrs.get("Mounts") or []
+            ],
+        })
+    return summaries
+
+_DOCKER_TIME = re.compile(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:?\d\d)?")
+
+def parse_docker_time(value: str) -> float:
+    """
+    Parse a timestamp as reported by Docker (RFC 3339 with nanoseconds) into a
+    UNIX timestamp; return None for missing or zero timestamps.
+    """
+    if not value or value.startswith("0001-"):
+        return None
+    match = _DOCKER_TIME.fullmatch(value)
+    if match is None:
+        raise ValueError(f"Invalid Docker timestamp '{value}'.")
+    head, fraction, offset = match.groups()
+    # datetime cannot parse nanoseconds: the fraction is added separately
+    moment = datetime.datetime.fromisoformat(head + (offset if offset and offset != "Z" else "+00:00"))
+    return moment.timestamp() + (float(f"0.{fraction}") if fraction else 0.0)
+
+def docker_env() -> dict:
+    """
+    Return the Docker-related environment variables that affect the client.
+    """
+    return {
+        "DOCKER_HOST": os.environ.get('DOCKER_HOST'),
+        "DOCKER_TLS_VERIFY": os.environ.get('DOCKER_TLS_VERIFY'),
+        "DOCKER_CERT_PATH": os.environ.get('DOCKER_CERT_PATH'),
+        "DOCKER_API_VERSION": os.environ.get('DOCKER_API_VERSION'),
+        "DOCKER_TIMEOUT": os.environ.get('DOCKER_TIMEOUT', 60),
+        "DOCKER_USERNAME": os.environ.get('DOCKER_USERNAME'),
+        # Be cautious with logging sensitive information: DOCKER_PASSWORD is left out
+    }
+
 def log_docker_env():
-    docker_host = os.environ.get('DOCKER_HOST')
-    docker_tls_verify = os.environ.get('DOCKER_TLS_VERIFY')
-    docker_cert_path = os.environ.get('DOCKER_CERT_PATH')
-    docker_api_version = os.environ.get('DOCKER_API_VERSION')
-    docker_timeout = os.environ.get('DOCKER_TIMEOUT', 60)
-    docker_username = os.environ.get('DOCKER_USERNAME')
-    # Be cautious with logging sensitive information
-    # docker_password = os.environ.get('DOCKER_PASSWORD')
-
-    loguru.logger.info(f"DOCKER_HOST: {docker_host}")
-    loguru.logger.info(f"DOCKER_TLS_VERIFY: {docker_tls_verify}")
-    loguru.logger.info(f"DOCKER_CERT_PATH: {docker_cert_path}")
-    loguru.logger.info(f"DOCKER_API_VERSION: {docker_api_version}")
-    loguru.logger.info(f"DOCKER_TIMEOUT: {docker_timeout}")
-    loguru.logger.info(f"DOCKER_USERNAME: {docker_username}")
-    # loguru.logger.info(f"DOCKER_PASSWORD: {docker_password}")  # Avoid logging this
-
-    # If you want to see logs in the console too
-    loguru.logger.info("This will be displayed in the console and saved to the logfile.")
+    """
+    Log the Docker environment as a single record, with the variables also bound
+    as structured data (visible with `--log-format json`).
+    """
+    env = docker_env()
+    loguru.logger.bind(docker_env=env).opt(lazy=True).info(
+        "Docker environment: {}",
+        lambda: ", ".join(f"{key}={value}" for key, value in env.items())
+    )
 
 
-def run_docker_container(
+def mirrored_reference(image_name: str, mirror: str) -> tuple:
+    """
+    Return the (repository, tag) of a Docker Hub image on a registry mirror,
+    or None if the image comes from another registry (which the mirror does
+    not proxy) or is pinned by digest.
+    """
+    repository, tag = docker.utils.parse_repository_tag(image_name)
+    if tag and tag.startswith("sha256:"):
+        return None
+    parts = repository.split("/")
+    if len(parts) > 1 and parts[0] in ("docker.io", "index.docker.io"):
+        parts = parts[1:]
+    elif len(parts) > 1 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+        return None
+    if len(parts) == 1:
+        # Official images live in the "library" namespace
+        parts = ["library"] + parts
+    return f"{mirror}/{'/'.join(parts)}", tag or "latest"
+
+def _pull_from_mirror(client: docker.DockerClient, image_name: str, mirror: str):
+    """
+    Pull an image through a registry mirror, and tag it with its original
+    name; return the image, or None if the mirror does not serve it.
+    """
+    reference = mirrored_reference(image_name, mirror)
+    if reference is None:
+        return None
+    repository, tag = docker.utils.parse_repository_tag(image_name)
+    try:
+        image = client.images.pull(reference[0], tag=reference[1])
+        image.tag(repository, tag or "latest")
+    except docker.errors.APIError as e:
+        loguru.logger.warning(f"Could not pull {image_name} from the mirror {mirror}, pulling it directly: {e.explanation or e}")
+        return None
+    return client.images.get(image_name)
+
+def _registry_mirror() -> str:
+    """
+    Return the registry mirror to pull images through, or None: an invalid
+    ``prairie.yaml`` only disables the mirror, with a warning.
+    """
+    try:
+        mirror, _ = config_profiles.registry_mirror()
+    except config_profiles.ConfigError as e:
+        loguru.logger.warning(f"Pulling images without a registry mirror: {e}")
+        return None
+    return mirror
+
+def pull_image(client: docker.DockerClient, image_name: str) -> docker.models.images.Image:
+    """
+    Pull an image (through the registry mirror, if one is configured), and
+    record the duration of the pull in the history.
+    """
+    mirror = _registry_mirror()
+    start = time.perf_counter()
+    with profiling.span("docker.pull", image=image_name, mirror=mirror):
+        image = _pull_from_mirror(client, image_name, mirror) if mirror else None
+        if image is None:
+            mirror = None
+            image = client.images.pull(image_name)
+    seconds = time.perf_counter() - start
+    history.record("pull", image=image_name, seconds=seconds, size=image.attrs.get("Size"), mirror=mirror)
+    loguru.logger.debug(f"Pulled image: {image_name} in {seconds:.2f}s" + (f" from {mirror}" if mirror else ""))
+    return image
+
+def pull_images(client: docker.DockerClient, image_names: list) -> list:
+    """
+    Pull several images concurrently (e.g., to prefetch grader images), and
+    record the duration of each pull in the history.
+    """
+    mirror = _registry_mirror()
+
+    async def pull_from_mirror(async_client, image_name):
+        reference = mirrored_reference(image_name, mirror)
+        if reference is None:
+            return None
+        try:
+            await async_client.pull(f"{reference[0]}:{reference[1]}")
+            return await async_client.tag_image(f"{reference[0]}:{reference[1]}", image_name)
+        except aio.DockerAPIError as e:
+            loguru.logger.warning(f"Could not pull {image_name} from the mirror {mirror}, pulling it directly: {e}")
+            return None
+
+    async def pull(async_client, image_name):
+        start = time.perf_counter()
+        source = mirror
+        attrs = await pull_from_mirror(async_client, image_name) if mirror else None
+        if attrs is None:
+            source = None
+            attrs = await async_client.pull(image_name)
+        seconds = time.perf_counter() - start
+        history.record("pull", image=image_name, seconds=seconds, size=attrs.get("Size"), mirror=source)
+        loguru.logger.debug(f"Pulled image: {image_name} in {seconds:.2f}s" + (f" from {source}" if source else ""))
+        return client.images.prepare_model(attrs)
+
+    async def pull_all(async_client):
+        return await asyncio.gather(*(pull(async_client, image_name) for image_name in image_names))
+
+    images = aio.run_with_client(client, pull_all)
+    if images is None:
+        images = [pull_image(client, image_name) for image_name in image_names]
+    return images
+
+def _parse_size(value: str, option: str) -> int:
+    try:
+        return docker.utils.parse_bytes(value)
+    except docker.errors.DockerException:
+        raise ValueError(f"Invalid {option} '{value}' (expected e.g. 512m or 4g).")
+
+def resource_limits(client: docker.DockerClient, cpus: float = None, cpuset: str = None, memory: str = None, shm_size: str = None) -> dict:
+    """
+    Return the resource constraints of a container, as arguments of
+    `containers.create`.
+    """
+    resources = {}
+    if cpus is not None:
+        if cpus <= 0:
+            raise ValueError(f"Invalid --cpus {cpus}: must be positive.")
+        resources["nano_cpus"] = int(cpus * 1e9)
+    if cpuset == "auto":
+        resources["cpuset_cpus"] = placement.assign_cpuset(client, cpus or 1)
+        loguru.logger.info(f"Pinning the container to cores {resources['cpuset_cpus']}.")
+    elif cpuset:
+        resources["cpuset_cpus"] = placement.format_cpuset(placement.parse_cpuset(cpuset))
+    if memory:
+        resources["mem_limit"] = _parse_size(memory, "--memory")
+    if shm_size:
+        resources["shm_size"] = _parse_size(shm_size, "--shm-size")
+    return resources
+
+def container_create_kwargs(
+    client: docker.DockerClient,
     image_name: str,
     command: str = None,
     ports: dict = None,
@@ -46,59 +272,96 @@ def run_docker_container(
     remove: bool = True,
     tty: bool = True,
     stdin_open: bool = True,
-    detach: bool = True
-) -> docker.models.containers.Container:
+    detach: bool = True,
+    cpus: float = None,
+    cpuset: str = None,
+    memory: str = None,
+    shm_size: str = None
+) -> dict:
     """
-    Run a Docker container using the specified parameters.
+    Return the arguments of `containers.create` for a container (what
+    `run_docker_container` sends to the daemon, and `launch --dry-run` shows).
     """
-    loguru.logger.info(f"Attempting to run Docker container with image: {image_name}")
-    
-    # Create a Docker client
-    client = docker.from_env()
-
-    # Pull the image
-    client.images.pull(image_name)
-    loguru.logger.debug(f"Pulled image: {image_name}")
-
-    # Run the container
-    container = client.containers.run(
+    return dict(
         image=image_name,
         command=command,
         ports=ports,
         volumes=volumes,
         environment=environment,
-        remove=remove,
+        auto_remove=remove,
         tty=tty,
         stdin_open=stdin_open,
-        detach=detach
+        detach=detach,
+        **resource_limits(client, cpus=cpus, cpuset=cpuset, memory=memory, shm_size=shm_size)
     )
 
-    loguru.logger.info(f"Container with ID {container.id} started successfully.")
-    return container
-
-def run_prairielearn_container(
-    job_dir: str = None, 
-    course_dirs: tuple = None, 
-    external_grader: bool = False, 
-    version: str = "us-prod-live", 
-    port: int = 3000
+def run_docker_container(
+    image_name: str,
+    command: str = None,
+    ports: dict = None,
+    volumes: dict = None,
+    environment: dict = None,
+    remove: bool = True,
+    tty: bool = True,
+    stdin_open: bool = True,
+    detach: bool = True,
+    cpus: float = None,
+    cpuset: str = None,
+    memory: str = None,
+    shm_size: str = None,
+    client: docker.DockerClient = None
 ) -> docker.models.containers.Container:
     """
-    Run a PrairieLearn container with specific configurations.
+    Run a Docker container using the specified parameters.
+
+    `cpus` limits the CPU time of the container (e.g., 1.5 cores), `cpuset`
+    pins it to cores ("0-3,6", or "auto" for cores no other PrairieLearn
+    container is pinned to), and `memory` and `shm_size` are sizes such as
+    "4g" or "512m".
     """
-    loguru.logger.info("Attempting to run a PrairieLearn container with specific configurations.")
+    loguru.logger.info(f"Attempting to run Docker container with image: {image_name}")
     
-    # Resolve user's home directory
-    home_dir = os.path.expanduser("~")
+    # Create a Docker client
+    if client is None:
+        with profiling.span("docker.client"):
+            client = docker.from_env()
 
-    # Check if course_dirs is provided
-    if not course_dirs:
-        loguru.logger.error("The course directories are not provided.")
-        raise ValueError("At least one course directory is required.")
+    # Check the resource constraints before a potentially long pull
+    create_kwargs = container_create_kwargs(
+        client, image_name, command=command, ports=ports, volumes=volumes, environment=environment,
+        remove=remove, tty=tty, stdin_open=stdin_open, detach=detach,
+        cpus=cpus, cpuset=cpuset, memory=memory, shm_size=shm_size
+    )
 
-    # Log the number of courses added
-    loguru.logger.info(f"{len(course_dirs)} course(s) added: {', '.join(course_dirs)}")
+    # Pull the image
+    pull_image(client, image_name)
+
+    # Create and start the container (what `containers.run` does, but timed
+    # separately; `remove` becomes the daemon-side `auto_remove`)
+    start = time.perf_counter()
+    with profiling.span("docker.create", image=image_name):
+        container = client.containers.create(**create_kwargs)
+    with profiling.span("docker.start", container=container.short_id):
+        container.start()
+    history.record("start", image=image_name, container=container.id, seconds=time.perf_counter() - start)
+
+    loguru.logger.info(f"Container with ID {container.id} started successfully.")
+    return container
 
+def prairielearn_image(version: str = "us-prod-live") -> str:
+    return f"prairielearn/prairielearn:{version}"
+
+def prairielearn_container_spec(
+    job_dir: str = None,
+    course_dirs: list = None,
+    external_grader: bool = False,
+    version: str = "us-prod-live",
+    port: int = 3000
+) -> dict:
+    """
+    Return the image, ports, volumes and environment of a PrairieLearn
+    container (without touching the filesystem or the daemon).
+    """
     # Check if more than 9 courses are added
     if len(course_dirs) > 9:
         ignored_courses = course_dirs[9:]
@@ -106,7 +369,6 @@ def run_prairielearn_container(
         course_dirs = course_dirs[:9]
 
     # Set up parameters for the PrairieLearn container
-    image_name = f"prairielearn/prairielearn:{version}"
     ports = {str(port): port}
     volumes = {}
     environment = {}
@@ -119,16 +381,8 @@ def run_prairielearn_container(
         volumes[job_dir] = {'bind': '/jobs', 'mode': 'rw'}
         environment['HOST_JOBS_DIR'] = job_dir
 
-        # Check existence of job directory and create if necessary
-        if not os.path.exists(job_dir):
-            loguru.logger.info(f"{job_dir} is requested as job dir but does not exist, attempting to create it.")
-            os.makedirs(job_dir)
-
     # Set up course directories
     for idx, course_dir in enumerate(course_dirs, start=1):
-        if not os.path.exists(course_dir):
-            loguru.logger.error(f"The course directory '{course_dir}' does not exist.")
-            raise FileNotFoundError(f"The course directory '{course_dir}' does not exist.")
         mount_point = f"/course{'' if idx == 1 else idx}"
         volumes[course_dir] = {'bind': mount_point, 'mode': 'rw'}
 
@@ -137,13 +391,76 @@ def run_prairielearn_container(
         volumes["/var/run/docker.sock"] = {'bind': '/var/run/docker.sock', 'mode': 'rw'}
         environment["HOST_JOBS_DIR"] = job_dir
 
+    return {"image_name": prairielearn_image(version), "ports": ports, "volumes": volumes, "environment": environment}
+
+def run_prairielearn_container(
+    job_dir: str = None, 
+    course_dirs: tuple = None, 
+    external_grader: bool = False, 
+    version: str = "us-prod-live", 
+    port: int = 3000,
+    cpus: float = None,
+    cpuset: str = None,
+    memory: str = None,
+    shm_size: str = None,
+    check: bool = True
+) -> docker.models.containers.Container:
+    """
+    Run a PrairieLearn container with specific configurations (see
+    `run_docker_container` for the resource constraints).
+
+    Unless `check` is false, the pre-flight checks run first and raise
+    `preflight.PreflightError` (a ValueError) if the launch cannot succeed.
+    """
+    loguru.logger.info("Attempting to run a PrairieLearn container with specific configurations.")
+    
+    # Resolve user's home directory
+    home_dir = os.path.expanduser("~")
+    if job_dir:
+        # The checks, the creation and the mount of the job directory all use the expanded path
+        job_dir = os.path.expanduser(job_dir)
+
+    # Check if course_dirs is provided
+    if not course_dirs:
+        loguru.logger.error("The course directories are not provided.")
+        raise ValueError("At least one course directory is required.")
+
+    # Log the number of courses added
+    loguru.logger.info(f"{len(course_dirs)} course(s) added: {', '.join(course_dirs)}")
+
+    # Check every prerequisite before pulling anything (or creating the job directory)
+    image_name = prairielearn_image(version)
+    if check:
+        with profiling.span("docker.client"):
+            client, client_error = preflight.connect()
+        preflight.run_checks(client, image_name, course_dirs=list(course_dirs)[:9], port=port, job_dir=job_dir, client_error=client_error)
+    else:
+        with profiling.span("docker.client"):
+            client = docker.from_env()
+
+    spec = prairielearn_container_spec(job_dir=job_dir, course_dirs=list(course_dirs), external_grader=external_grader, version=version, port=port)
+
+    # Check existence of job directory and create if necessary
+    if job_dir and not os.path.exists(job_dir):
+        loguru.logger.info(f"{job_dir} is requested as job dir but does not exist, attempting to create it.")
+        os.makedirs(job_dir)
+
+    # Check the course directories
+    for course_dir in course_dirs[:9]:
+        if not os.path.exists(course_dir):
+            loguru.logger.error(f"The course directory '{course_dir}' does not exist.")
+            raise FileNotFoundError(f"The course directory '{course_dir}' does not exist.")
+
     # Run the container
-    container = run_docker_container(
-        image_name=image_name,
-        ports=ports,
-        volumes=volumes,
-        environment=environment
-    )
+    with profiling.span("prairielearn.run", image=image_name):
+        container = run_docker_container(
+            client=client,
+            cpus=cpus,
+            cpuset=cpuset,
+            memory=memory,
+            shm_size=shm_size,
+            **spec
+        )
 
     loguru.logger.info(f"PrairieLearn container with ID {container.id} started successfully.")
     return container
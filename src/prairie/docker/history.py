@@ -0,0 +1,86 @@
+"""
+Local history of Docker operations performed by `prairie`.
+
+Events such as image pulls and container readiness are appended, one JSON
+object per line, to a file in the user cache directory. The metrics exporter
+reports them, and they are the basis of launch cost estimates.
+"""
+
+import json
+import os
+import time
+
+import loguru
+
+from .. import paths
+
+HISTORY_FILENAME = "docker-history.jsonl"
+
+# Beyond this size, the oldest half of the history is dropped
+MAX_HISTORY_BYTES = 4 << 20
+
+
+def history_path() -> str:
+    return os.path.join(paths.user_cache_dir(), HISTORY_FILENAME)
+
+
+def record(event: str, **fields) -> dict:
+    """
+    Append an event to the history, and return it.
+    """
+    entry = {"event": event, "time": time.time()}
+    entry.update(fields)
+    path = history_path()
+    try:
+        with open(path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        if os.path.getsize(path) > MAX_HISTORY_BYTES:
+            _truncate(path)
+    except OSError as e:
+        loguru.logger.warning(f"Could not record {event} in {path}: {e}")
+    return entry
+
+
+def _truncate(path: str):
+    with open(path) as f:
+        lines = f.readlines()
+    with paths.atomic_write(path) as f:
+        f.writelines(lines[len(lines) // 2:])
+
+
+def read(event: str = None, since: float = None) -> list:
+    """
+    Return the recorded events (of the given kind, after `since`), oldest first.
+    """
+    return read_from(0, event=event, since=since)[0]
+
+
+def read_from(offset: int, event: str = None, since: float = None) -> tuple:
+    """
+    Return the events recorded after byte `offset` of the history (see
+    :func:`read`), from its start if it was truncated since, and the offset
+    to read from next time.
+    """
+    entries = []
+    try:
+        with open(history_path(), "rb") as f:
+            if f.seek(0, os.SEEK_END) < offset:
+                offset = 0
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Still being written
+                    break
+                offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if event is not None and entry.get("event") != event:
+                    continue
+                if since is not None and entry.get("time", 0) <= since:
+                    continue
+                entries.append(entry)
+    except FileNotFoundError:
+        offset = 0
+    return entries, offset
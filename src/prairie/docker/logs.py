@@ -0,0 +1,233 @@
+"""
+Streaming reader and filters for the logs of PrairieLearn containers.
+
+The logs are requested from the daemon with ``since`` and ``tail`` applied
+server-side, and read in large chunks straight from the HTTP response (the
+`docker` SDK reads the output of TTY containers one byte at a time, which
+cannot keep up with the burst of output of a course sync).
+
+Lines are kept as raw bytes: ``--grep`` and ``--level`` are evaluated with
+byte regular expressions, so that PrairieLearn's JSON log lines are only
+decoded when they are actually printed.
+"""
+
+import collections
+import datetime
+import json
+import re
+import struct
+import time
+
+LEVELS = ("error", "warn", "info", "http", "verbose", "debug", "silly")
+LEVEL_ALIASES = {"warning": "warn", "critical": "error", "fatal": "error"}
+
+_CHUNK_SIZE = 1 << 16
+_MULTIPLEX_HEADER = struct.Struct(">BxxxL")
+_RELATIVE_SINCE = re.compile(r"^(\d+(?:\.\d+)?)([smhd])$")
+_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_TEXT_LEVEL = re.compile(rb"\b(error|warn|warning|info|http|verbose|debug|silly)\b:", re.IGNORECASE)
+
+
+def normalize_level(level: str) -> str:
+    level = (level or "").lower()
+    return LEVEL_ALIASES.get(level, level)
+
+
+def parse_since(value) -> float:
+    """
+    Parse a `--since` value into a UNIX timestamp: either a relative duration
+    ("30s", "10m", "2h", "1d"), a UNIX timestamp, or an ISO 8601 date.
+    """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = value.strip()
+    match = _RELATIVE_SINCE.match(value)
+    if match:
+        return time.time() - float(match.group(1)) * _SECONDS[match.group(2)]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"Invalid --since value: '{value}' (expected e.g. 10m, 2h, a timestamp or an ISO date).")
+    if moment.tzinfo is None:
+        moment = moment.astimezone()
+    return moment.timestamp()
+
+
+class LogLine:
+    """
+    A raw log line, decoded as JSON only on demand.
+    """
+
+    __slots__ = ("raw", "_record")
+
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self._record = False
+
+    @property
+    def record(self) -> dict:
+        """
+        The decoded JSON record, or None if the line is not a JSON object.
+        """
+        if self._record is False:
+            self._record = None
+            if self.raw[:1] == b"{":
+                try:
+                    self._record = json.loads(self.raw)
+                except ValueError:
+                    pass
+                if not isinstance(self._record, dict):
+                    self._record = None
+        return self._record
+
+    @property
+    def level(self) -> str:
+        record = self.record
+        if record is not None:
+            return normalize_level(record.get("level"))
+        match = _TEXT_LEVEL.search(self.raw)
+        return normalize_level(match.group(1).decode()) if match else None
+
+    def format(self) -> str:
+        record = self.record
+        if record is None:
+            return self.raw.decode("utf-8", errors="replace")
+        fields = {key: value for key, value in record.items() if key not in ("level", "message", "timestamp")}
+        text = f"{record.get('timestamp', '')} {normalize_level(record.get('level')):<7} {record.get('message', '')}".strip()
+        if fields:
+            text += " " + " ".join(f"{key}={json.dumps(value)}" for key, value in fields.items())
+        return text
+
+
+def _split_lines(chunks, carry: bytes = b""):
+    """
+    Turn an iterator of byte chunks into an iterator of lists of complete lines.
+    """
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (carry + chunk).split(b"\n")
+        carry = lines.pop()
+        if lines:
+            yield [line.rstrip(b"\r") for line in lines]
+    if carry:
+        yield [carry.rstrip(b"\r")]
+
+
+def _demultiplex(raw):
+    """
+    Iterate over the payloads of a multiplexed (non-TTY) log stream.
+    """
+    while True:
+        header = raw.read(_MULTIPLEX_HEADER.size)
+        if len(header) < _MULTIPLEX_HEADER.size:
+            return
+        _, length = _MULTIPLEX_HEADER.unpack(header)
+        payload = raw.read(length)
+        if not payload:
+            return
+        yield payload
+
+
+def iter_log_batches(client, container, follow: bool = False, since: float = None, tail="all", stdout: bool = True, stderr: bool = True):
+    """
+    Stream the logs of `container` as batches (lists) of raw lines, one batch
+    per chunk received from the daemon.
+    """
+    params = {
+        "stdout": int(stdout),
+        "stderr": int(stderr),
+        "follow": int(follow),
+        "timestamps": 0,
+        "tail": "all" if tail in (None, "all") else int(tail),
+    }
+    if since:
+        params["since"] = since
+
+    # Use the low-level client to read large chunks, and disable the read
+    # timeout so that --follow can wait for output indefinitely
+    api = client.api
+    response = api._get(api._url("/containers/{0}/logs", container.id), params=params, stream=True, timeout=None)
+    api._raise_for_status(response)
+
+    try:
+        if container.attrs["Config"].get("Tty"):
+            chunks = response.iter_content(_CHUNK_SIZE)
+        else:
+            chunks = _demultiplex(response.raw)
+        yield from _split_lines(chunks)
+    finally:
+        response.close()
+
+
+def level_pattern(min_level: str) -> re.Pattern:
+    """
+    Return a byte regular expression matching lines (JSON or text) whose level
+    is `min_level` or more severe, so that levels are checked without decoding.
+    """
+    min_level = normalize_level(min_level)
+    if min_level not in LEVELS:
+        raise ValueError(f"Unknown level '{min_level}', expected one of: {', '.join(LEVELS)}.")
+    accepted = list(LEVELS[:LEVELS.index(min_level) + 1])
+    accepted += [alias for alias, level in LEVEL_ALIASES.items() if level in accepted]
+    names = b"|".join(name.encode() for name in accepted)
+    return re.compile(rb'"level"\s*:\s*"(?:' + names + rb')"|\b(?:' + names + rb')\b:', re.IGNORECASE)
+
+
+class LogFilter:
+    """
+    Select log lines matching a pattern and a minimum level, with `context`
+    lines of context before and after each match kept in a ring buffer.
+
+    :meth:`feed` returns the lines to print; None stands for a separator
+    between non-contiguous groups of lines.
+    """
+
+    def __init__(self, pattern: str = None, min_level: str = None, context: int = 0, ignore_case: bool = False):
+        flags = re.IGNORECASE if ignore_case else 0
+        self.pattern = re.compile(pattern.encode(), flags) if pattern else None
+        self.level = level_pattern(min_level) if min_level else None
+        self.context = context
+        self.before = collections.deque(maxlen=context)
+        self.after = 0
+        self.printed_any = False
+        self.dropped = False
+        self.matches = 0
+
+    def matches_line(self, raw: bytes) -> bool:
+        if self.pattern is not None and self.pattern.search(raw) is None:
+            return False
+        if self.level is not None and self.level.search(raw) is None:
+            return False
+        return True
+
+    def feed(self, lines: list) -> list:
+        if self.pattern is None and self.level is None:
+            return [LogLine(raw) for raw in lines]
+
+        out = []
+        for raw in lines:
+            if self.matches_line(raw):
+                self.matches += 1
+                if self.context and self.printed_any and self.dropped:
+                    out.append(None)
+                out.extend(LogLine(line) for line in self.before)
+                self.before.clear()
+                out.append(LogLine(raw))
+                self.printed_any = True
+                self.dropped = False
+                self.after = self.context
+            elif self.after:
+                out.append(LogLine(raw))
+                self.after -= 1
+            else:
+                # The ring buffer only keeps the last `context` skipped lines
+                if len(self.before) == self.context:
+                    self.dropped = True
+                if self.context:
+                    self.before.append(raw)
+        return out
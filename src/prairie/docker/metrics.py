@@ -0,0 +1,228 @@
+"""
+Prometheus metrics of the local PrairieLearn fleet, for the textfile collector
+of node_exporter.
+
+Each collection is kept cheap so that it can run every few seconds: one
+(sparse) container list, one inspect and one one-shot stats request per
+PrairieLearn-related container, and the container events since the previous
+collection, from which grading jobs and their latencies are derived. The
+readiness of PrairieLearn containers is probed over HTTP only until they first
+answer, and only the end of the history is read for new pulls. The text file
+is written to a temporary file and renamed, so the collector never reads a
+partial file.
+"""
+
+import time
+import urllib.error
+import urllib.request
+
+import docker
+import loguru
+
+from .. import paths
+from . import helpers, history
+from .stats import image_role
+
+GRADING_BUCKETS = (1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+READY_PROBE_TIMEOUT = 0.5
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class Histogram:
+    """
+    A cumulative Prometheus histogram.
+    """
+
+    def __init__(self, buckets: tuple = GRADING_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[idx] += 1
+        self.total += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: dict = None) -> list:
+        labels = labels or {}
+        lines = [f"{name}_bucket{_labels({**labels, 'le': bound})} {count}" for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {self.total}")
+        lines.append(f"{name}_sum{_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {self.total}")
+        return lines
+
+
+def _probe(port: str) -> bool:
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=READY_PROBE_TIMEOUT):
+            return True
+    except urllib.error.HTTPError:
+        # Any HTTP answer means the server is up
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+class MetricsExporter:
+    """
+    Collect fleet metrics; state (grading histograms, pull counters, readiness)
+    accumulates across collections, as Prometheus counters expect.
+    """
+
+    def __init__(self, client, probe=_probe):
+        self.client = client
+        self.probe = probe
+        self.started = time.time()
+        self.last_event_nano = int(self.started * 1e9)
+        self.last_history = self.started
+        self.history_offset = 0
+        self.last_collect = None
+        self.grader_starts = {}
+        self.grading_jobs = {}
+        self.grading_durations = Histogram()
+        self.pulls = {}
+        self.ready = {}
+        self.not_ready = {}
+
+    def _collect_events(self, now: float):
+        # Events of the current (partial) second are picked up by the next
+        # collection: `until` in the future would block until then
+        events = self.client.events(since=int(self.last_event_nano // 1e9), until=int(now), decode=True, filters={"type": "container"})
+        for event in events:
+            time_nano = event.get("timeNano", int(event.get("time", 0) * 1e9))
+            if time_nano <= self.last_event_nano:
+                continue
+            self.last_event_nano = time_nano
+            attributes = (event.get("Actor") or {}).get("Attributes") or {}
+            if "grader" not in attributes.get("image", ""):
+                continue
+            container_id = (event.get("Actor") or {}).get("ID") or event.get("id")
+            action = event.get("Action") or event.get("status")
+            if action == "start":
+                self.grader_starts[container_id] = time_nano / 1e9
+            elif action == "die":
+                status = "success" if str(attributes.get("exitCode", "0")) == "0" else "failure"
+                self.grading_jobs[status] = self.grading_jobs.get(status, 0) + 1
+                started = self.grader_starts.pop(container_id, None)
+                if started is not None:
+                    self.grading_durations.observe(time_nano / 1e9 - started)
+
+    def _collect_pulls(self):
+        entries, self.history_offset = history.read_from(self.history_offset, event="pull", since=self.last_history)
+        for entry in entries:
+            self.last_history = max(self.last_history, entry["time"])
+            stats = self.pulls.setdefault(entry["image"], {"count": 0, "seconds": 0.0, "last": 0.0})
+            stats["count"] += 1
+            stats["seconds"] += entry["seconds"]
+            stats["last"] = entry["seconds"]
+
+    def _check_ready(self, container, labels: dict):
+        if container.id in self.ready or container.status != "running":
+            return
+        now = time.time()
+        for bindings in (container.ports or {}).values():
+            for binding in bindings or []:
+                if self.probe(binding["HostPort"]):
+                    self._record_ready(container, labels, now)
+                    return
+        self.not_ready[container.id] = now
+
+    def _record_ready(self, container, labels: dict, now: float):
+        # The container got ready between its last failed probe (or its start) and
+        # this probe, which is up to one interval later: take the middle
+        started_at = helpers.parse_docker_time(container.attrs["State"].get("StartedAt")) or now
+        not_ready = self.not_ready.pop(container.id, None)
+        if not_ready is None and (self.last_collect is None or started_at < self.last_collect):
+            # Already answering when first seen (e.g., started before the exporter): unknown
+            self.ready[container.id] = (labels, None)
+            return
+        seconds = max(((not_ready or started_at) + now) / 2 - started_at, 0.0)
+        self.ready[container.id] = (labels, seconds)
+        history.record("ready", container=container.id, image=container.attrs["Config"].get("Image"), seconds=seconds)
+
+    def collect(self) -> str:
+        """
+        Collect the metrics, and return them in the Prometheus text format.
+        """
+        now = time.time()
+        up, restarts, cpu, memory = [], [], [], []
+        current_ids = set()
+
+        for summary in self.client.api.containers(all=True):
+            role = image_role(summary.get("Image", ""))
+            if role is None:
+                continue
+            try:
+                container = self.client.containers.get(summary["Id"])
+                running = container.status == "running"
+                sample = container.stats(stream=False, one_shot=True) if running else None
+            except docker.errors.APIError as e:
+                # Graders are short-lived and auto-removed: one can be gone since it was listed
+                loguru.logger.debug(f"Skipping container {summary['Id'][:12]}: {e}")
+                continue
+            current_ids.add(container.id)
+            labels = {"container": container.short_id, "name": container.name, "role": role, "image": container.attrs["Config"].get("Image", "")}
+            up.append(f"prairie_container_up{_labels(labels)} {int(running)}")
+            restarts.append(f"prairie_container_restarts_total{_labels(labels)} {container.attrs.get('RestartCount', 0)}")
+            if running:
+                cpu_total = ((sample.get("cpu_stats") or {}).get("cpu_usage") or {}).get("total_usage", 0)
+                cpu.append(f"prairie_container_cpu_seconds_total{_labels(labels)} {cpu_total / 1e9}")
+                memory.append(f"prairie_container_memory_bytes{_labels(labels)} {(sample.get('memory_stats') or {}).get('usage', 0)}")
+                if role == "prairielearn":
+                    self._check_ready(container, labels)
+
+        self._collect_events(now)
+        self._collect_pulls()
+        for states in (self.ready, self.not_ready):
+            for container_id in list(states):
+                if container_id not in current_ids:
+                    del states[container_id]
+        self.last_collect = now
+
+        lines = []
+
+        def family(name: str, kind: str, help_text: str, samples: list):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+
+        family("prairie_container_up", "gauge", "Whether the container is running.", up)
+        family("prairie_container_restarts_total", "counter", "Number of restarts of the container.", restarts)
+        family("prairie_container_cpu_seconds_total", "counter", "CPU time used by the container.", cpu)
+        family("prairie_container_memory_bytes", "gauge", "Memory used by the container.", memory)
+        family("prairie_container_time_to_ready_seconds", "gauge", "Time between the start of a PrairieLearn container and its first HTTP answer.",
+               [f"prairie_container_time_to_ready_seconds{_labels(labels)} {seconds}" for labels, seconds in self.ready.values() if seconds is not None])
+        family("prairie_grading_jobs_total", "counter", "Grading jobs (grader containers) finished since the exporter started.",
+               [f"prairie_grading_jobs_total{_labels({'status': status})} {count}" for status, count in sorted(self.grading_jobs.items())])
+        family("prairie_grading_job_duration_seconds", "histogram", "Duration of grading jobs.", self.grading_durations.samples("prairie_grading_job_duration_seconds"))
+        family("prairie_image_pulls_total", "counter", "Image pulls performed by prairie since the exporter started.",
+               [f"prairie_image_pulls_total{_labels({'image': image})} {stats['count']}" for image, stats in sorted(self.pulls.items())])
+        family("prairie_image_pull_seconds_total", "counter", "Time spent pulling images.",
+               [f"prairie_image_pull_seconds_total{_labels({'image': image})} {stats['seconds']}" for image, stats in sorted(self.pulls.items())])
+        family("prairie_image_pull_last_seconds", "gauge", "Duration of the last pull of the image.",
+               [f"prairie_image_pull_last_seconds{_labels({'image': image})} {stats['last']}" for image, stats in sorted(self.pulls.items())])
+        family("prairie_exporter_collect_timestamp_seconds", "gauge", "When these metrics were collected.",
+               [f"prairie_exporter_collect_timestamp_seconds {now}"])
+        return "\n".join(lines) + "\n"
+
+
+def write_textfile(path: str, text: str):
+    """
+    Atomically replace `path` with `text` (the temporary file does not end in
+    .prom, so the textfile collector ignores it).
+    """
+    with paths.atomic_write(path) as f:
+        f.write(text)
+    loguru.logger.debug(f"Wrote {len(text)} bytes of metrics to {path}")
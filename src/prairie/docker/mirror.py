@@ -0,0 +1,99 @@
+"""
+Pull-through registry mirror, for lab fleets.
+
+When a room of machines updates PrairieLearn at once, every machine pulls the
+same multi-gigabyte layers from Docker Hub over the same uplink (and quickly
+hits its rate limits). ``prairie docker mirror serve`` runs the official
+``registry`` image on one machine, configured as a pull-through cache of
+Docker Hub: the first pull of a layer goes to Docker Hub, and every later one
+is served from the LAN.
+
+The other machines are pointed at the mirror with ``mirror: HOST:PORT`` in
+their ``prairie.yaml`` (or the PRAIRIE_MIRROR environment variable): their
+pulls of Docker Hub images then go to the mirror, and the pulled images are
+tagged with their usual names; if the mirror is unreachable, they fall back
+to pulling directly. Since the mirror serves plain HTTP, their Docker daemons
+must list it in ``insecure-registries``.
+"""
+
+import os
+import socket
+
+import docker
+import loguru
+
+from .. import paths
+
+MIRROR_IMAGE = "registry:2"
+MIRROR_CONTAINER_NAME = "prairie-mirror"
+DEFAULT_PORT = 5000
+DEFAULT_UPSTREAM = "https://registry-1.docker.io"
+
+
+def default_data_dir() -> str:
+    return paths.user_cache_dir("mirror")
+
+
+def lan_address() -> str:
+    """
+    Return the address of this machine on the local network (the address of
+    the interface of the default route), or its host name.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            # Connecting a UDP socket sends nothing, but selects the interface
+            sock.connect(("192.0.2.1", 9))
+            return sock.getsockname()[0]
+        except OSError:
+            return socket.gethostname()
+
+
+def find_mirror(client: docker.DockerClient):
+    try:
+        return client.containers.get(MIRROR_CONTAINER_NAME)
+    except docker.errors.NotFound:
+        return None
+
+
+def serve(client: docker.DockerClient, port: int = DEFAULT_PORT, data_dir: str = None, upstream: str = DEFAULT_UPSTREAM):
+    """
+    Run the registry mirror (or start the existing one), and return its
+    container; the mirror restarts with the Docker daemon until stopped.
+    """
+    container = find_mirror(client)
+    if container is not None:
+        if container.status != "running":
+            loguru.logger.info(f"Starting the existing registry mirror {container.short_id}.")
+            container.start()
+            container.reload()
+        return container
+
+    data_dir = os.path.abspath(os.path.expanduser(data_dir or default_data_dir()))
+    os.makedirs(data_dir, exist_ok=True)
+    try:
+        client.images.get(MIRROR_IMAGE)
+    except docker.errors.ImageNotFound:
+        client.images.pull(MIRROR_IMAGE)
+    loguru.logger.info(f"Running the registry mirror of {upstream} on port {port}, storing layers in {data_dir}.")
+    return client.containers.run(
+        MIRROR_IMAGE,
+        name=MIRROR_CONTAINER_NAME,
+        detach=True,
+        ports={"5000/tcp": port},
+        volumes={data_dir: {"bind": "/var/lib/registry", "mode": "rw"}},
+        environment={"REGISTRY_PROXY_REMOTEURL": upstream},
+        restart_policy={"Name": "unless-stopped"},
+    )
+
+
+def stop(client: docker.DockerClient) -> bool:
+    """
+    Stop and remove the registry mirror (its cached layers are kept); return
+    whether it was running.
+    """
+    container = find_mirror(client)
+    if container is None:
+        return False
+    container.stop()
+    container.remove()
+    return True
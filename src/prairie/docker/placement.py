@@ -0,0 +1,97 @@
+"""
+CPU placement of PrairieLearn containers.
+
+Several PrairieLearn instances on one host (e.g., one per course, or a staging
+and a production checkout) all compete for the same cores when they are not
+pinned, and so do the graders they start. With ``--cpuset auto``, each new
+instance is pinned to cores that no other running PrairieLearn container is
+pinned to, so instances do not contend with each other.
+"""
+
+import math
+import os
+
+import docker
+
+from . import helpers
+
+
+def parse_cpuset(spec: str) -> list:
+    """
+    Parse a cpuset in the Docker/Linux list format (e.g., "0-3,6") into a
+    sorted list of core numbers.
+    """
+    cpus = set()
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"Invalid cpuset '{spec}' (expected e.g. 0-3,6).")
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid cpuset '{spec}' (expected e.g. 0-3,6).")
+        cpus.update(range(first, last + 1))
+    return sorted(cpus)
+
+
+def format_cpuset(cpus) -> str:
+    """
+    Format core numbers as a compact cpuset, e.g. [0, 1, 2, 3, 6] as "0-3,6".
+    """
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def available_cpus(client: docker.DockerClient = None) -> list:
+    """
+    Return the cores containers may be pinned to: those of the machine of the
+    daemon of `client` (which, with Docker Desktop or a remote DOCKER_HOST, is
+    not this one), or without a client the cores this process may run on.
+    """
+    if client is not None:
+        return list(range(client.info().get("NCPU") or 1))
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_cpusets(instances: int, cpus_per_instance: int, available: list = None) -> list:
+    """
+    Split the available cores into `instances` disjoint cpusets of
+    `cpus_per_instance` cores each.
+    """
+    available = sorted(available if available is not None else available_cpus())
+    needed = instances * cpus_per_instance
+    if needed > len(available):
+        raise ValueError(f"{instances} instance(s) of {cpus_per_instance} core(s) need {needed} cores, but only {len(available)} are available.")
+    return [format_cpuset(available[idx * cpus_per_instance:(idx + 1) * cpus_per_instance]) for idx in range(instances)]
+
+
+def pinned_cpus(client: docker.DockerClient) -> set:
+    """
+    Return the cores that running PrairieLearn containers are pinned to.
+    """
+    cpus = set()
+    for container in helpers.list_prairielearn_containers(client, all=False):
+        cpus.update(parse_cpuset(container.attrs["HostConfig"].get("CpusetCpus")))
+    return cpus
+
+
+def assign_cpuset(client: docker.DockerClient, cpus: float, available: list = None) -> str:
+    """
+    Return a cpuset of ceil(`cpus`) cores that no running PrairieLearn
+    container is pinned to.
+    """
+    free = sorted(set(available if available is not None else available_cpus(client)) - pinned_cpus(client))
+    count = max(math.ceil(cpus), 1)
+    if count > len(free):
+        raise ValueError(f"Cannot pin a new instance to {count} free core(s): only {len(free)} core(s) are not used by other PrairieLearn containers.")
+    return plan_cpusets(1, count, free)[0]
@@ -0,0 +1,153 @@
+"""
+Execution plans of `prairie docker launch --dry-run`.
+
+A plan is the exact container specification that the launch would send to
+the daemon, with an estimate of its cost, built only from data that is
+already at hand: the local images, the existing containers, and the history
+of previous pulls, starts and readiness probes (see :mod:`history`). Nothing
+is pulled, created or written, so that scripts can afford to ask for a plan
+before deciding whether (or when) to launch.
+"""
+
+import json
+import os
+import statistics
+
+import docker
+
+from . import helpers, history, preflight
+
+# Number of recent history events the estimates are based on
+RECENT_EVENTS = 5
+
+
+def _recent_seconds(event: str, image_name: str) -> list:
+    entries = [entry for entry in history.read(event=event) if entry.get("image") == image_name and entry.get("seconds") is not None]
+    return [entry["seconds"] for entry in entries[-RECENT_EVENTS:]]
+
+
+def find_reusable_container(client: docker.DockerClient, spec: dict):
+    """
+    Return an existing PrairieLearn container with the same image, port and
+    course mounts as `spec`, or None.
+    """
+    wanted_mounts = {(source, volume["bind"]) for source, volume in spec["volumes"].items() if volume["bind"].startswith("/course")}
+    wanted_port = next(iter(spec["ports"].values()))
+    for container in helpers.list_prairielearn_containers(client, all=True):
+        if container.attrs["Config"].get("Image") != spec["image"]:
+            continue
+        mounts = {(mount["Source"], mount["Destination"]) for mount in container.attrs.get("Mounts") or [] if mount["Destination"].startswith("/course")}
+        bindings = container.attrs["HostConfig"].get("PortBindings") or {}
+        ports = {int(binding["HostPort"]) for port_bindings in bindings.values() for binding in port_bindings or [] if binding.get("HostPort")}
+        if mounts == wanted_mounts and wanted_port in ports:
+            return container
+    return None
+
+
+def estimate_cost(client: docker.DockerClient, spec: dict) -> dict:
+    """
+    Estimate the cost of launching a container from `spec`.
+
+    The pull estimate is the fastest recent pull of the image if it is
+    present (the pull then only checks for updates), and the slowest one
+    otherwise. Launches do not wait for the container to be ready: the ready
+    estimate only comes from the probes of ``prairie docker export-metrics``.
+    """
+    image_name = spec["image"]
+    try:
+        image_size, present = client.images.get(image_name).attrs.get("Size"), True
+    except docker.errors.ImageNotFound:
+        pulls = [entry for entry in history.read(event="pull") if entry.get("image") == image_name and entry.get("size")]
+        image_size, present = (pulls[-1]["size"] if pulls else None), False
+
+    pull_seconds = _recent_seconds("pull", image_name)
+    start_seconds = _recent_seconds("start", image_name)
+    ready_seconds = _recent_seconds("ready", image_name)
+    expected = {
+        "pull": (min(pull_seconds) if present else max(pull_seconds)) if pull_seconds else None,
+        "start": statistics.median(start_seconds) if start_seconds else None,
+        "ready": statistics.median(ready_seconds) if ready_seconds else None,
+    }
+    known = [seconds for seconds in expected.values() if seconds is not None]
+
+    reusable = find_reusable_container(client, spec)
+    return {
+        "pull": {
+            "needed": not present,
+            "bytes": 0 if present else image_size,
+            "image_size": image_size,
+        },
+        "reusable_container": None if reusable is None else {"id": reusable.id, "name": reusable.name, "status": reusable.status},
+        "expected_seconds": dict(expected, total=sum(known) if len(known) == len(expected) else None),
+        "history": {"pulls": len(pull_seconds), "starts": len(start_seconds), "ready": len(ready_seconds)},
+        "cheap": present,
+    }
+
+
+def plan_launch(client: docker.DockerClient, job_dir: str = None, course_dirs: list = None, external_grader: bool = False,
+                version: str = "us-prod-live", port: int = 3000, cpus: float = None, cpuset: str = None,
+                memory: str = None, shm_size: str = None, client_error: Exception = None) -> dict:
+    """
+    Return the plan of `run_prairielearn_container` with the same arguments:
+    the container specification, its estimated cost and the pre-flight checks.
+
+    Without a client (see `preflight.connect`), only the pre-flight checks are
+    planned, and the specification and cost are None.
+    """
+    job_dir = os.path.expanduser(job_dir) if job_dir else job_dir
+    spec = helpers.prairielearn_container_spec(job_dir=job_dir, course_dirs=list(course_dirs), external_grader=external_grader, version=version, port=port)
+    image_name = spec.pop("image_name")
+
+    try:
+        checks = preflight.run_checks(client, image_name, course_dirs=list(course_dirs)[:9], port=port, job_dir=job_dir, client_error=client_error)
+    except preflight.PreflightError as e:
+        checks = e.results
+
+    create_kwargs = None
+    if client is not None:
+        create_kwargs = helpers.container_create_kwargs(client, image_name, cpus=cpus, cpuset=cpuset, memory=memory, shm_size=shm_size, **spec)
+    return {
+        "spec": create_kwargs,
+        "cost": None if client is None else estimate_cost(client, create_kwargs),
+        "preflight": [{"check": result.name, "status": result.status, "detail": result.detail} for result in checks],
+        "ok": all(result.status != preflight.FAIL for result in checks),
+    }
+
+
+def _format_bytes(size) -> str:
+    return "unknown size" if size is None else f"{size / 2 ** 30:.2f} GiB"
+
+
+def _format_seconds(seconds) -> str:
+    return "unknown" if seconds is None else f"~{seconds:.1f}s"
+
+
+def render_plan(plan: dict) -> str:
+    """
+    Render a plan for humans.
+    """
+    cost = plan["cost"]
+    if cost is None:
+        lines = ["Container spec and estimated cost: unknown (the Docker daemon is unavailable)", "Pre-flight checks:"]
+        lines += [f"  {preflight.SYMBOLS[check['status']]} {check['check']}: {check['detail']}" for check in plan["preflight"]]
+        return "\n".join(lines)
+    expected = cost["expected_seconds"]
+    lines = ["Container spec (containers.create):"]
+    lines += ["  " + line for line in json.dumps(plan["spec"], indent=2, sort_keys=True).splitlines()]
+    lines.append("Estimated cost:")
+    if cost["pull"]["needed"]:
+        lines.append(f"  pull: needed, {_format_bytes(cost['pull']['bytes'])}, {_format_seconds(expected['pull'])}")
+    else:
+        lines.append(f"  pull: image present ({_format_bytes(cost['pull']['image_size'])}), update check {_format_seconds(expected['pull'])}")
+    reusable = cost["reusable_container"]
+    lines.append(f"  reusable container: {reusable['name']} ({reusable['id'][:12]}, {reusable['status']})" if reusable else "  reusable container: none")
+    lines.append(f"  create and start: {_format_seconds(expected['start'])}")
+    if cost["history"]["ready"]:
+        lines.append(f"  time to ready: {_format_seconds(expected['ready'])}")
+    else:
+        lines.append("  time to ready: unknown (only measured while `prairie docker export-metrics` runs)")
+    lines.append(f"  total: {_format_seconds(expected['total'])} (history: {cost['history']['pulls']} pull(s), "
+                 f"{cost['history']['starts']} start(s), {cost['history']['ready']} readiness probe(s))")
+    lines.append("Pre-flight checks:")
+    lines += [f"  {preflight.SYMBOLS[check['status']]} {check['check']}: {check['detail']}" for check in plan["preflight"]]
+    return "\n".join(lines)
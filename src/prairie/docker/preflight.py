@@ -0,0 +1,229 @@
+"""
+Pre-flight checks of `prairie docker launch`.
+
+Before anything is pulled, every prerequisite of a launch is checked at once,
+each check in its own thread: the course directories exist, the port is free,
+the daemon answers, the image is present (or will be pulled), the job
+directory is writable, and there is enough free disk space for the image.
+
+All failures are reported together, so that a doomed launch fails within a
+fraction of a second rather than after a multi-gigabyte pull, and the user
+can fix every problem in one go.
+"""
+
+import concurrent.futures
+import errno
+import os
+import shutil
+import socket
+import urllib.parse
+
+import docker
+import loguru
+import requests
+
+from .. import profiling
+from . import history
+
+OK, WARN, FAIL, SKIP = "ok", "warn", "fail", "skip"
+SYMBOLS = {OK: "✔", WARN: "⚠", FAIL: "✖", SKIP: "·"}
+
+_LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1", "")
+
+
+class CheckResult:
+    """
+    The outcome of one pre-flight check.
+    """
+
+    __slots__ = ("name", "status", "detail")
+
+    def __init__(self, name: str, status: str, detail: str):
+        self.name = name
+        self.status = status
+        self.detail = detail
+
+    def __repr__(self) -> str:
+        return f"CheckResult({self.name!r}, {self.status!r}, {self.detail!r})"
+
+
+class PreflightError(ValueError):
+    """
+    At least one pre-flight check failed.
+    """
+
+    def __init__(self, results: list):
+        self.results = results
+        super().__init__("Pre-flight checks failed:\n" + render_report(results, failures_only=True))
+
+
+def daemon_is_local(client: docker.DockerClient) -> bool:
+    """
+    Whether the daemon runs on this machine (so that ports and disk space can
+    be checked locally).
+    """
+    url = urllib.parse.urlsplit(client.api.base_url)
+    return url.scheme == "http+docker" or url.hostname in _LOCAL_HOSTS
+
+
+def connect() -> tuple:
+    """
+    Return a client of the Docker daemon of the environment and None, or None
+    and the error if no client can be created (e.g., DOCKER_HOST points at a
+    dead socket), for :func:`check_daemon` to report.
+    """
+    try:
+        return docker.from_env(), None
+    except docker.errors.DockerException as e:
+        return None, e
+
+
+def _daemon_unreachable(e: Exception) -> bool:
+    return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def check_course_dirs(course_dirs: list) -> CheckResult:
+    missing = [course_dir for course_dir in course_dirs if not os.path.isdir(course_dir)]
+    if missing:
+        return CheckResult("course directories", FAIL, f"not found: {', '.join(missing)}")
+    return CheckResult("course directories", OK, f"{len(course_dirs)} found")
+
+
+def check_port(port: int, local: bool = True) -> CheckResult:
+    name = f"port {port}"
+    if not local:
+        return CheckResult(name, SKIP, "the Docker daemon is remote")
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("0.0.0.0", port))
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE:
+                return CheckResult(name, FAIL, "already in use (is another PrairieLearn instance running? use --port)")
+            # E.g., a privileged port, which the daemon can still bind
+            return CheckResult(name, WARN, f"could not be checked: {e.strerror}")
+    return CheckResult(name, OK, "free")
+
+
+def check_daemon(client: docker.DockerClient, error: Exception = None) -> CheckResult:
+    if client is None:
+        return CheckResult("docker daemon", FAIL, f"cannot connect ({error}; is Docker running?)")
+    try:
+        client.ping()
+    except docker.errors.APIError as e:
+        return CheckResult("docker daemon", FAIL, f"error: {e.explanation or e}")
+    except Exception as e:
+        if _daemon_unreachable(e):
+            return CheckResult("docker daemon", FAIL, f"unreachable at {client.api.base_url} (is Docker running?)")
+        raise
+    return CheckResult("docker daemon", OK, "reachable")
+
+
+def _image_size(client: docker.DockerClient, image_name: str) -> tuple:
+    """
+    Return (whether the image is present, its size or the size recorded at its
+    last pull, or None).
+    """
+    try:
+        return True, client.images.get(image_name).attrs.get("Size")
+    except docker.errors.ImageNotFound:
+        pulls = [entry for entry in history.read(event="pull") if entry.get("image") == image_name and entry.get("size")]
+        return False, pulls[-1]["size"] if pulls else None
+
+
+def check_image(client: docker.DockerClient, image_name: str) -> CheckResult:
+    name = f"image {image_name}"
+    if client is None:
+        return CheckResult(name, SKIP, "the Docker daemon is unavailable")
+    try:
+        present, _ = _image_size(client, image_name)
+    except Exception as e:
+        if _daemon_unreachable(e) or isinstance(e, docker.errors.APIError):
+            return CheckResult(name, SKIP, "the Docker daemon is unavailable")
+        raise
+    # The image is pulled anyway, to get the latest version of the tag
+    return CheckResult(name, OK, "present (will be updated)" if present else "not present (will be pulled)")
+
+
+def check_job_dir(job_dir: str) -> CheckResult:
+    name = "job directory"
+    if not job_dir:
+        return CheckResult(name, SKIP, "not used")
+    path = os.path.expanduser(job_dir)
+    if os.path.exists(path):
+        if not os.path.isdir(path):
+            return CheckResult(name, FAIL, f"{job_dir} is not a directory")
+        if not os.access(path, os.W_OK | os.X_OK):
+            return CheckResult(name, FAIL, f"{job_dir} is not writable")
+        return CheckResult(name, OK, f"{job_dir} is writable")
+    # The directory is created by the launch: its nearest existing parent must be writable
+    parent = os.path.dirname(os.path.abspath(path))
+    while not os.path.exists(parent):
+        parent = os.path.dirname(parent)
+    if not os.access(parent, os.W_OK | os.X_OK):
+        return CheckResult(name, FAIL, f"{job_dir} cannot be created ({parent} is not writable)")
+    return CheckResult(name, OK, f"{job_dir} will be created")
+
+
+def check_disk_space(client: docker.DockerClient, image_name: str, local: bool = True) -> CheckResult:
+    name = "disk space"
+    if not local:
+        return CheckResult(name, SKIP, "the Docker daemon is remote")
+    if client is None:
+        return CheckResult(name, SKIP, "the Docker daemon is unavailable")
+    try:
+        root_dir = client.info().get("DockerRootDir")
+        present, size = _image_size(client, image_name)
+    except Exception as e:
+        if _daemon_unreachable(e) or isinstance(e, docker.errors.APIError):
+            return CheckResult(name, SKIP, "the Docker daemon is unavailable")
+        raise
+    if not root_dir or not os.path.isdir(root_dir):
+        # E.g., Docker Desktop, whose storage lives in a virtual machine
+        return CheckResult(name, SKIP, "the storage of the Docker daemon is not on this filesystem")
+    free = shutil.disk_usage(root_dir).free
+    if present:
+        return CheckResult(name, OK, f"{free / 2 ** 30:.1f} GiB free")
+    if size is None:
+        return CheckResult(name, WARN, f"{free / 2 ** 30:.1f} GiB free, size of the image unknown")
+    if free < size:
+        return CheckResult(name, FAIL, f"{free / 2 ** 30:.1f} GiB free in {root_dir}, the image needs about {size / 2 ** 30:.1f} GiB")
+    return CheckResult(name, OK, f"{free / 2 ** 30:.1f} GiB free, the image needs about {size / 2 ** 30:.1f} GiB")
+
+
+def run_checks(client: docker.DockerClient, image_name: str, course_dirs: list, port: int, job_dir: str = None,
+               client_error: Exception = None) -> list:
+    """
+    Run every pre-flight check concurrently, and return their results; raise
+    :class:`PreflightError` if any check failed. `client` is None if it could
+    not be created (see :func:`connect`), with the reason in `client_error`.
+    """
+    local = client is None or daemon_is_local(client)
+    checks = [
+        (check_course_dirs, (course_dirs,)),
+        (check_port, (port, local)),
+        (check_daemon, (client, client_error)),
+        (check_image, (client, image_name)),
+        (check_job_dir, (job_dir,)),
+        (check_disk_space, (client, image_name, local)),
+    ]
+    with profiling.span("docker.preflight", checks=len(checks)):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(checks), thread_name_prefix="preflight") as executor:
+            futures = [executor.submit(check, *args) for check, args in checks]
+            results = [future.result() for future in futures]
+
+    for result in results:
+        loguru.logger.debug(f"Pre-flight check {result.name}: {result.status} ({result.detail})")
+    if any(result.status == FAIL for result in results):
+        raise PreflightError(results)
+    for result in results:
+        if result.status == WARN:
+            loguru.logger.warning(f"Pre-flight check {result.name}: {result.detail}")
+    return results
+
+
+def render_report(results: list, failures_only: bool = False) -> str:
+    return "\n".join(
+        f"  {SYMBOLS[result.status]} {result.name}: {result.detail}"
+        for result in results
+        if not failures_only or result.status == FAIL
+    )
@@ -0,0 +1,241 @@
+"""
+Live resource telemetry for PrairieLearn, grader and workspace containers.
+
+:class:`StatsCollector` subscribes to the streaming stats endpoint of every
+matching container, each from its own thread, and funnels the decoded samples
+into a single queue. New containers (e.g., graders started during a batch
+regrade) are picked up whenever the container list is refreshed.
+
+For every container, :class:`ContainerStats` turns the cumulative counters of
+consecutive samples into CPU %, memory use and block/network I/O rates, and
+keeps the last values of each metric in a fixed-size :class:`RollingWindow`
+backed by an :mod:`array`, so that memory stays constant however long the
+collector runs.
+"""
+
+import array
+import queue
+import threading
+import time
+
+import loguru
+
+from . import helpers
+
+ROLES = ("prairielearn", "grader", "workspace")
+METRICS = ("cpu_percent", "mem_bytes", "mem_percent", "blk_read_bps", "blk_write_bps", "net_rx_bps", "net_tx_bps")
+
+
+def image_role(image: str) -> str:
+    """
+    Return "prairielearn", "grader" or "workspace" for the images of the
+    containers that PrairieLearn runs, and None for unrelated images.
+    """
+    if helpers.PRAIRIELEARN_REPOSITORY in image:
+        return "prairielearn"
+    if "grader" in image:
+        return "grader"
+    if "workspace" in image:
+        return "workspace"
+    return None
+
+
+def container_role(container) -> str:
+    return image_role(container.attrs["Config"].get("Image", ""))
+
+
+class RollingWindow:
+    """
+    The last `size` values of a metric, in a preallocated array of doubles.
+    """
+
+    __slots__ = ("values", "size", "count", "position")
+
+    def __init__(self, size: int):
+        self.values = array.array("d", bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.position = 0
+
+    def append(self, value: float):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    @property
+    def last(self) -> float:
+        return self.values[self.position - 1] if self.count else 0.0
+
+    def mean(self) -> float:
+        if not self.count:
+            return 0.0
+        if self.count < self.size:
+            return sum(self.values[:self.count]) / self.count
+        return sum(self.values) / self.size
+
+    def max(self) -> float:
+        if not self.count:
+            return 0.0
+        return max(self.values[:self.count]) if self.count < self.size else max(self.values)
+
+
+def _counters(stat: dict) -> dict:
+    """
+    Extract the cumulative counters of a raw stats sample.
+    """
+    cpu = stat.get("cpu_stats") or {}
+    memory = stat.get("memory_stats") or {}
+    blkio = (stat.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    networks = (stat.get("networks") or {}).values()
+    memory_stats = memory.get("stats") or {}
+    cache = memory_stats.get("inactive_file", memory_stats.get("cache", 0))
+    return {
+        "time": helpers.parse_docker_time(stat.get("read")) or time.time(),
+        "cpu_total": (cpu.get("cpu_usage") or {}).get("total_usage", 0),
+        "cpu_system": cpu.get("system_cpu_usage", 0),
+        "online_cpus": cpu.get("online_cpus") or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1,
+        "mem_bytes": max(memory.get("usage", 0) - cache, 0),
+        "mem_limit": memory.get("limit", 0),
+        "blk_read": sum(entry.get("value", 0) for entry in blkio if entry.get("op", "").lower() == "read"),
+        "blk_write": sum(entry.get("value", 0) for entry in blkio if entry.get("op", "").lower() == "write"),
+        "net_rx": sum(network.get("rx_bytes", 0) for network in networks),
+        "net_tx": sum(network.get("tx_bytes", 0) for network in networks),
+    }
+
+
+class ContainerStats:
+    """
+    Rolling statistics of one container, updated from raw stats samples.
+    """
+
+    def __init__(self, container_id: str, name: str, role: str, window: int = 30):
+        self.container_id = container_id
+        self.name = name
+        self.role = role
+        self.windows = {metric: RollingWindow(window) for metric in METRICS}
+        self.previous = None
+        self.samples = 0
+
+    def update(self, stat: dict) -> dict:
+        """
+        Account for a new raw sample, and return the derived metrics (or None
+        for the very first sample, which has nothing to compare to).
+        """
+        current = _counters(stat)
+        previous, self.previous = self.previous, current
+        if previous is None:
+            return None
+
+        elapsed = max(current["time"] - previous["time"], 1e-9)
+        cpu_delta = current["cpu_total"] - previous["cpu_total"]
+        system_delta = current["cpu_system"] - previous["cpu_system"]
+        metrics = {
+            "cpu_percent": (cpu_delta / system_delta) * current["online_cpus"] * 100.0 if system_delta > 0 and cpu_delta > 0 else 0.0,
+            "mem_bytes": float(current["mem_bytes"]),
+            "mem_percent": 100.0 * current["mem_bytes"] / current["mem_limit"] if current["mem_limit"] else 0.0,
+            "blk_read_bps": max(current["blk_read"] - previous["blk_read"], 0) / elapsed,
+            "blk_write_bps": max(current["blk_write"] - previous["blk_write"], 0) / elapsed,
+            "net_rx_bps": max(current["net_rx"] - previous["net_rx"], 0) / elapsed,
+            "net_tx_bps": max(current["net_tx"] - previous["net_tx"], 0) / elapsed,
+        }
+        for metric, value in metrics.items():
+            self.windows[metric].append(value)
+        self.samples += 1
+        return metrics
+
+
+class StatsCollector:
+    """
+    Follow the stats streams of all PrairieLearn-related containers concurrently.
+    """
+
+    def __init__(self, client, roles: tuple = ROLES, window: int = 30):
+        self.client = client
+        self.roles = roles
+        self.window = window
+        self.containers = {}
+        self.samples = queue.Queue()
+        self._threads = {}
+        self._stop = threading.Event()
+
+    def refresh(self) -> int:
+        """
+        Start following the containers that appeared since the last refresh,
+        and return the number of new containers.
+        """
+        started = 0
+        for container in self.client.containers.list():
+            role = container_role(container)
+            if role not in self.roles or container.id in self._threads:
+                continue
+            self.containers[container.id] = ContainerStats(container.id, container.name, role, self.window)
+            thread = threading.Thread(target=self._follow, args=(container,), name=f"stats-{container.short_id}", daemon=True)
+            self._threads[container.id] = thread
+            thread.start()
+            started += 1
+        return started
+
+    def _follow(self, container):
+        try:
+            for stat in container.stats(stream=True, decode=True):
+                if self._stop.is_set():
+                    break
+                self.samples.put((container.id, stat))
+        except Exception as e:
+            # The container may have stopped (and been removed) meanwhile
+            loguru.logger.debug(f"Stopped following stats of {container.short_id}: {e}")
+        finally:
+            self.samples.put((container.id, None))
+
+    def poll(self, timeout: float = 1.0) -> list:
+        """
+        Wait up to `timeout` seconds for samples, process all the pending ones,
+        and return the derived metrics as (ContainerStats, metrics) pairs.
+        """
+        results = []
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                container_id, stat = self.samples.get(timeout=max(remaining, 0)) if remaining > 0 else self.samples.get_nowait()
+            except queue.Empty:
+                break
+            stats = self.containers.get(container_id)
+            if stat is None:
+                self.containers.pop(container_id, None)
+                self._threads.pop(container_id, None)
+                continue
+            if stats is None:
+                continue
+            metrics = stats.update(stat)
+            if metrics is not None:
+                results.append((stats, metrics))
+        return results
+
+    def stop(self):
+        self._stop.set()
+
+
+def format_rate(value: float) -> str:
+    for unit in ("B/s", "KB/s", "MB/s", "GB/s"):
+        if value < 1000 or unit == "GB/s":
+            return f"{value:.0f} {unit}" if unit == "B/s" else f"{value:.1f} {unit}"
+        value /= 1000
+
+
+def render_table(containers: list) -> str:
+    """
+    Render the current statistics of containers, busiest CPU first.
+    """
+    header = f"{'CONTAINER':<14}{'NAME':<24}{'ROLE':<14}{'CPU %':>8}{'AVG %':>8}{'MEM':>11}{'MEM %':>7}{'BLK R/W':>22}{'NET RX/TX':>22}"
+    lines = [header]
+    for stats in sorted(containers, key=lambda stats: stats.windows["cpu_percent"].last, reverse=True):
+        w = stats.windows
+        lines.append(
+            f"{stats.container_id[:12]:<14}{stats.name[:23]:<24}{stats.role:<14}"
+            f"{w['cpu_percent'].last:>8.1f}{w['cpu_percent'].mean():>8.1f}"
+            f"{w['mem_bytes'].last / 2 ** 20:>8.0f} MB{w['mem_percent'].last:>7.1f}"
+            f"{format_rate(w['blk_read_bps'].last) + ' / ' + format_rate(w['blk_write_bps'].last):>22}"
+            f"{format_rate(w['net_rx_bps'].last) + ' / ' + format_rate(w['net_tx_bps'].last):>22}"
+        )
+    return "\n".join(lines)
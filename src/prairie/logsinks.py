@@ -0,0 +1,90 @@
+"""
+Configuration of the `loguru` sinks used by the `prairie` CLI.
+
+By default a single human-readable sink writes to stderr. Optionally:
+
+- the stderr sink can emit one JSON object per line (``--log-format json``),
+  so that log shippers can parse it without regular expressions;
+- a JSON-lines file sink can be added, with rotation, retention and
+  compression handled by `loguru`;
+- every sink can be enqueued, so that records are formatted and written by a
+  background worker and logging never blocks Docker operations.
+"""
+
+import sys
+
+import loguru
+
+try:
+    # Its parsers validate the options without creating a sink. They are not a public
+    # API: without them, the options are only validated when the file sink is added
+    from loguru._file_sink import FileSink as _FileSink
+except ImportError:
+    _FileSink = None
+
+LOG_FORMATS = ("text", "json")
+
+
+class LogOptionError(ValueError):
+    """
+    An option of the file sink (`option`: "rotation", "retention" or
+    "compression") cannot be parsed by `loguru`.
+    """
+
+    def __init__(self, option: str, message: str):
+        self.option = option
+        super().__init__(message)
+
+
+def configure(
+    level: int,
+    log_format: str = "text",
+    log_file: str = None,
+    rotation: str = None,
+    retention: str = None,
+    compression: str = None,
+    enqueue: bool = False,
+) -> list:
+    """
+    Replace all sinks of the global logger, and return the ids of the new sinks.
+
+    The options of the file sink are validated first: if one is invalid,
+    :class:`LogOptionError` is raised and the current sinks are kept.
+    """
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown log format '{log_format}', expected one of: {', '.join(LOG_FORMATS)}.")
+    if log_file:
+        for option, value in (("rotation", rotation), ("retention", retention), ("compression", compression)):
+            parse = getattr(_FileSink, f"_make_{option}_function", None)
+            if value is None or parse is None:
+                continue
+            try:
+                parse(value)
+            except (TypeError, ValueError) as e:
+                raise LogOptionError(option, str(e)) from e
+
+    loguru.logger.remove()
+    sink_ids = [
+        loguru.logger.add(
+            sys.stderr,
+            level=level,
+            serialize=(log_format == "json"),
+            enqueue=enqueue,
+        )
+    ]
+
+    if log_file:
+        # The file sink is always JSON lines, whatever the console format is
+        sink_ids.append(
+            loguru.logger.add(
+                log_file,
+                level=level,
+                serialize=True,
+                rotation=rotation,
+                retention=retention,
+                compression=compression,
+                enqueue=enqueue,
+            )
+        )
+
+    return sink_ids
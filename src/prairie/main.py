@@ -1,23 +1,37 @@
 import os
 import platform
-import sys
 
 import click
 import click_help_colors
 import loguru
 
-from . import __version__, docker
+from . import __version__, bench, config, course, daemon, docker, logsinks, profiling
+
+LOG_OPTIONS_META_KEY = "prairie.log_options"
 
 # Define a callback to handle the verbosity level
 def set_log_level(ctx, param, value):
     levels = [loguru.logger.level("WARNING"), loguru.logger.level("INFO"), loguru.logger.level("DEBUG")]
-    loguru.logger.remove()
-    loguru.logger.add(sys.stderr, level=levels[value].no)
-    level = levels[value]
-    level_value = level.no
-    level_name = level.name
-    loguru.logger.info(f"Set log level to {level_name}")
-    return level_value
+    level = levels[min(value, len(levels) - 1)]
+    ctx.meta["prairie.log_level"] = level
+    return level.no
+
+# Define a callback to collect the sink options used by `configure_logging`
+def set_log_option(ctx, param, value):
+    ctx.meta.setdefault(LOG_OPTIONS_META_KEY, {})[param.name] = value
+    return value
+
+def configure_logging(ctx):
+    """
+    Configure the log sinks once, from the verbosity and sink options
+    collected by the callbacks above.
+    """
+    level = ctx.meta["prairie.log_level"]
+    try:
+        logsinks.configure(level.no, **ctx.meta.get(LOG_OPTIONS_META_KEY, {}))
+    except logsinks.LogOptionError as e:
+        raise click.BadParameter(str(e), ctx=ctx, param_hint=f"'--log-{e.option}'")
+    loguru.logger.info(f"Set log level to {level.name}")
 
 # New function to detect if the user is on Windows with WSL 2
 def is_wsl2():
@@ -34,14 +48,51 @@ def is_apple_silicon():
 @click.group(cls=click_help_colors.HelpColorsGroup, help_headers_color='green', help_options_color='bright_yellow')
 @click.version_option(version=__version__, prog_name='prairie')
 @click.option('-v', '--verbose', count=True, callback=set_log_level, expose_value=False, is_eager=True, help="Increase verbosity level (e.g., -v or -vv).")
-def cli():
+@click.option('--log-format', type=click.Choice(logsinks.LOG_FORMATS), default="text", callback=set_log_option, expose_value=False, is_eager=True, help="Format of the console log: plain text, or one JSON object per line.")
+@click.option('--log-file', default=None, type=click.Path(dir_okay=False), callback=set_log_option, expose_value=False, is_eager=True, help="Also write logs as JSON lines to this file.")
+@click.option('--log-rotation', 'rotation', default=None, callback=set_log_option, expose_value=False, is_eager=True, help="Rotate the log file, e.g., '10 MB' or '1 day'.")
+@click.option('--log-retention', 'retention', default=None, callback=set_log_option, expose_value=False, is_eager=True, help="Remove rotated log files, e.g., '10 files' or '1 week'.")
+@click.option('--log-compression', 'compression', default=None, type=click.Choice(["gz", "bz2", "xz", "zip", "tar.gz"]), callback=set_log_option, expose_value=False, is_eager=True, help="Compress rotated log files with this format.")
+@click.option('--log-enqueue', 'enqueue', is_flag=True, default=False, callback=set_log_option, expose_value=False, is_eager=True, help="Write logs from a background worker so logging never blocks.")
+@click.option('--profile', is_flag=True, default=False, help="⏱️  Print a tree of timed phases when the command finishes.")
+@click.option('--profile-trace', default=None, type=click.Path(dir_okay=False, writable=True), help="⏱️  Also write the timed phases as Chrome trace-event JSON to this file.")
+@click.pass_context
+def cli(ctx, profile, profile_trace):
     """Prairie: A command line interface for PrairieLearn.
 
     This tool provides utilities to streamline your PrairieLearn experience.
     """
+    configure_logging(ctx)
     loguru.logger.info("Prairie CLI started.")
 
+    if profile or profile_trace:
+        start_profiling(ctx, print_tree=profile, trace_path=profile_trace)
+
+def start_profiling(ctx, print_tree=True, trace_path=None):
+    """
+    Enable span recording for the rest of the invocation, and report the spans
+    when the click context closes.
+    """
+    profiling.enable()
+    root = profiling.span("prairie", command=ctx.invoked_subcommand)
+    root.__enter__()
+
+    def report():
+        root.__exit__(None, None, None)
+        if print_tree:
+            click.echo(click.style("\nProfile:", bold=True, fg="cyan"), err=True)
+            click.echo(profiling.render_tree(), err=True)
+        if trace_path:
+            profiling.write_chrome_trace(trace_path)
+            loguru.logger.info(f"Wrote Chrome trace to {trace_path}")
+
+    ctx.call_on_close(report)
+
 cli.add_command(docker.docker)
+cli.add_command(course.course)
+cli.add_command(bench.bench)
+cli.add_command(config.config)
+cli.add_command(daemon.daemon)
 
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,99 @@
+"""
+Locations of the files `prairie` keeps on the user's machine, and how they
+are written: atomically, and for JSON caches with a version.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import sys
+
+import loguru
+
+
+def user_cache_dir(*parts: str, create: bool = True) -> str:
+    """
+    Return the per-user cache directory of `prairie` (or a subdirectory of it),
+    creating it unless `create` is false.
+
+    The location can be overridden with the PRAIRIE_CACHE_DIR environment
+    variable; otherwise the platform convention is followed.
+    """
+    base = os.environ.get("PRAIRIE_CACHE_DIR")
+    if not base:
+        if sys.platform == "darwin":
+            base = os.path.expanduser("~/Library/Caches/prairie")
+        elif sys.platform == "win32":
+            base = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "prairie", "Cache")
+        else:
+            base = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "prairie")
+
+    path = os.path.join(base, *parts)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+@contextlib.contextmanager
+def atomic_path(path: str):
+    """
+    Yield a temporary path next to `path`, and atomically replace `path` with
+    what the block created there if it succeeds (the temporary file is
+    removed otherwise), so that readers never see a partial file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = "w", **kwargs):
+    """
+    Open a file to atomically replace `path` with (see :func:`atomic_path`).
+    """
+    with atomic_path(path) as tmp_path:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+
+
+def cache_path(dirname: str, key: str, suffix: str = ".json") -> str:
+    """
+    Return the path of the cache of `key` (e.g., the directory of a course)
+    in a subdirectory of the user cache directory.
+    """
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(user_cache_dir(dirname), f"{digest}{suffix}")
+
+
+def load_json_cache(path: str, version, **empty) -> dict:
+    """
+    Return the JSON cache at `path` if it has this `version`, and otherwise a
+    new cache with the `version` and the `empty` fields.
+    """
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if isinstance(cache, dict) and cache.get("version") == version:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return dict(empty, version=version)
+
+
+def save_json_cache(path: str, cache: dict) -> bool:
+    """
+    Atomically write a JSON cache; a cache that cannot be written is only
+    logged, and False returned.
+    """
+    try:
+        with atomic_write(path) as f:
+            json.dump(cache, f)
+    except OSError as e:
+        loguru.logger.warning(f"Could not write the cache {path}: {e}")
+        return False
+    return True
@@ -0,0 +1,204 @@
+"""
+Lightweight phase timing for the `prairie` CLI.
+
+Code is instrumented with :func:`span` (or the :func:`traced` decorator). Spans
+are only recorded once profiling has been enabled, for instance through the
+global ``--profile`` flag; otherwise :func:`span` hands back a shared no-op
+context manager, so instrumented code pays little more than a function call.
+
+Recorded spans form a tree that can be printed with :func:`render_tree` or
+exported with :func:`write_chrome_trace` to the Chrome trace-event format,
+which can be opened in ``chrome://tracing`` or https://ui.perfetto.dev.
+"""
+
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+_enabled = False
+_roots = []
+_roots_lock = threading.Lock()
+_current = contextvars.ContextVar("prairie_profiling_span", default=None)
+_null_span = contextlib.nullcontext()
+
+
+class Span:
+    """
+    A named, timed phase of work, with optional attributes and child spans.
+    """
+
+    __slots__ = ("name", "attrs", "start", "end", "children", "thread_id")
+
+    def __init__(self, name: str, attrs: dict = None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.thread_id = threading.get_ident()
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration of the span in seconds (up to now, if it is still open).
+        """
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+
+class _SpanContext:
+    __slots__ = ("_name", "_attrs", "_span", "_token")
+
+    def __init__(self, name: str, attrs: dict):
+        self._name = name
+        self._attrs = attrs
+        self._span = None
+        self._token = None
+
+    def __enter__(self) -> Span:
+        parent = _current.get()
+        self._span = Span(self._name, self._attrs)
+        if parent is None:
+            with _roots_lock:
+                _roots.append(self._span)
+        else:
+            parent.children.append(self._span)
+        self._token = _current.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._span.end = time.perf_counter()
+        if exc_type is not None:
+            self._span.attrs["error"] = exc_type.__name__
+        _current.reset(self._token)
+        return False
+
+
+def span(name: str, **attrs):
+    """
+    Return a context manager timing the enclosed block as a span called `name`.
+
+    When profiling is disabled, the same no-op context manager is returned on
+    every call and nothing is recorded.
+    """
+    if not _enabled:
+        return _null_span
+    return _SpanContext(name, attrs)
+
+
+def traced(name: str = None):
+    """
+    Decorator timing every call of the decorated function as a span.
+    """
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _SpanContext(span_name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable():
+    """
+    Start recording spans.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """
+    Stop recording spans (already recorded spans are kept).
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    """
+    Forget every recorded span.
+    """
+    with _roots_lock:
+        _roots.clear()
+
+
+def roots() -> list:
+    """
+    Return the top-level spans recorded so far.
+    """
+    with _roots_lock:
+        return list(_roots)
+
+
+def _format_attrs(attrs: dict) -> str:
+    if not attrs:
+        return ""
+    return " [" + ", ".join(f"{key}={value}" for key, value in attrs.items()) + "]"
+
+
+def render_tree(spans: list = None) -> str:
+    """
+    Render recorded spans as an indented tree with durations in milliseconds.
+    """
+    spans = roots() if spans is None else spans
+    lines = []
+
+    def visit(node: Span, prefix: str, is_last: bool, depth: int):
+        connector = "" if depth == 0 else ("└─ " if is_last else "├─ ")
+        lines.append(f"{node.duration * 1000:10.2f} ms  {prefix}{connector}{node.name}{_format_attrs(node.attrs)}")
+        child_prefix = prefix if depth == 0 else prefix + ("   " if is_last else "│  ")
+        for idx, child in enumerate(node.children):
+            visit(child, child_prefix, idx == len(node.children) - 1, depth + 1)
+
+    for node in spans:
+        visit(node, "", True, 0)
+    return "\n".join(lines)
+
+
+def to_chrome_trace(spans: list = None) -> dict:
+    """
+    Convert recorded spans to a Chrome trace-event document (complete events).
+    """
+    spans = roots() if spans is None else spans
+    pid = os.getpid()
+    events = []
+
+    def visit(node: Span):
+        events.append({
+            "name": node.name,
+            "ph": "X",
+            "ts": node.start * 1e6,
+            "dur": node.duration * 1e6,
+            "pid": pid,
+            "tid": node.thread_id,
+            "args": {key: str(value) for key, value in node.attrs.items()},
+        })
+        for child in node.children:
+            visit(child)
+
+    for node in spans:
+        visit(node)
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path: str, spans: list = None):
+    """
+    Write recorded spans to `path` as Chrome trace-event JSON.
+    """
+    with open(path, "w") as f:
+        json.dump(to_chrome_trace(spans), f)
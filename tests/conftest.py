@@ -0,0 +1,24 @@
+import pytest
+
+from prairie.docker.fake import FakeDockerDaemon
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path_factory, monkeypatch):
+    """
+    Keep the files `prairie` caches out of the user's cache directory.
+    """
+    path = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("PRAIRIE_CACHE_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def fake_docker(monkeypatch):
+    """
+    A running fake Docker daemon, with DOCKER_HOST pointing at it.
+    """
+    with FakeDockerDaemon() as daemon:
+        for key, value in daemon.environ().items():
+            monkeypatch.setenv(key, value)
+        yield daemon
@@ -0,0 +1,25 @@
+import pytest
+
+from prairie import bench
+
+
+def test_registry_runs_status(tmp_path):
+    results = bench.run_benchmarks(["status-1"], repeat=2)
+    assert results["status-1"]["runs"] == 2
+
+    with pytest.raises(ValueError):
+        bench.run_benchmarks(["no-such-benchmark"])
+
+
+def test_history_and_compare(tmp_path):
+    path = str(tmp_path / "history.json")
+    base = bench.append_history(path, {"a": {"median": 1.0}, "b": {"median": 1.0}}, label="base")
+    current = bench.append_history(path, {"a": {"median": 1.5}, "b": {"median": 0.9}})
+    assert [run["label"] for run in bench.load_history(path)] == ["base", None]
+
+    rows = {name: regressed for name, _, _, _, regressed in bench.compare_runs(base, current, threshold=0.10)}
+    assert rows == {"a": True, "b": False}
+
+    result, _ = bench.run_cli(["bench", "compare", "--history", path])
+    assert result.exit_code == 1
+    assert "1 benchmark(s) regressed" in result.output
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from prairie import bench
+from prairie.config import profiles
+
+CONFIG = """\
+defaults:
+  version: us-prod-live
+  memory: 2g
+profiles:
+  dev:
+    course_dirs: [./course]
+    port: 3001
+    memory: 4g
+  grading:
+    course_dirs: ./course
+    external_grader: true
+"""
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    (tmp_path / "course").mkdir()
+    (tmp_path / "prairie.yaml").write_text(CONFIG)
+    (tmp_path / "sub").mkdir()
+    monkeypatch.chdir(tmp_path / "sub")
+    return tmp_path
+
+
+def test_resolve_precedence(project):
+    resolved = profiles.resolve("dev", {"port": 3005, "cpus": None})
+    assert resolved["course_dirs"] == ([str(project / "course")], "prairie.yaml:6 (profiles.dev.course_dirs)")
+    assert resolved["port"] == (3005, profiles.COMMAND_LINE_SOURCE)
+    assert resolved["memory"] == ("4g", "prairie.yaml:8 (profiles.dev.memory)")
+    assert resolved["version"] == ("us-prod-live", "prairie.yaml:2 (defaults.version)")
+    assert resolved["cpus"] == (None, profiles.DEFAULT_SOURCE)
+
+    with pytest.raises(profiles.ConfigError, match="available profiles: dev, grading"):
+        profiles.resolve("prod")
+
+
+def test_resolution_is_cached_by_mtime(project, monkeypatch):
+    profiles.resolve("dev")
+    parse_config = profiles.parse_config
+
+    def fail(path):
+        raise AssertionError("prairie.yaml was parsed again")
+
+    monkeypatch.setattr(profiles, "parse_config", fail)
+    assert profiles.resolve("grading")["external_grader"][0] is True
+
+    (project / "prairie.yaml").write_text(CONFIG.replace("port: 3001", "port: 3002"))
+    stat = os.stat(project / "prairie.yaml")
+    os.utime(project / "prairie.yaml", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    monkeypatch.setattr(profiles, "parse_config", parse_config)
+    assert profiles.resolve("dev")["port"][0] == 3002
+
+
+def test_invalid_config(project):
+    (project / "prairie.yaml").write_text("profiles:\n  dev:\n    port: http\n")
+    with pytest.raises(profiles.ConfigError, match=r"prairie.yaml:3 \(profiles.dev.port\): expected a port number"):
+        profiles.resolve("dev")
+
+
+def test_launch_with_profile(project, fake_docker):
+    result, _ = bench.run_cli(["docker", "launch", "--profile", "dev", "--port", "3009"])
+    assert result.exit_code == 0, result.output
+    (container,) = fake_docker.containers.values()
+    assert container["HostConfig"]["Memory"] == 4 * 2 ** 30
+    assert "3009/tcp" in container["HostConfig"]["PortBindings"]
+
+    result, _ = bench.run_cli(["config", "explain", "--profile", "dev"])
+    assert result.exit_code == 0, result.output
+    assert "prairie.yaml:7 (profiles.dev.port)" in result.output
+
+
+def test_registry_mirror(project, monkeypatch):
+    monkeypatch.delenv("PRAIRIE_MIRROR", raising=False)
+    assert profiles.registry_mirror() == (None, None)
+    (project / "prairie.yaml").write_text(CONFIG + "mirror: lab-server.local:5000\n")
+    mirror, source = profiles.registry_mirror()
+    assert mirror == "lab-server.local:5000" and source.startswith("prairie.yaml:")
+    monkeypatch.setenv("PRAIRIE_MIRROR", "10.0.0.2:5000")
+    assert profiles.registry_mirror()[0] == "10.0.0.2:5000"
+
+    (project / "prairie.yaml").write_text(CONFIG + "mirror: https://lab-server/\n")
+    with pytest.raises(profiles.ConfigError, match="expected a registry"):
+        profiles.resolve("dev")
@@ -0,0 +1,386 @@
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from prairie.course import index, synth
+
+
+def _tree_digest(root):
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in sorted(os.walk(root)):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            digest.update(os.path.relpath(path, root).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def test_synth_is_deterministic(tmp_path):
+    stats = synth.synthesize_course(str(tmp_path / "a"), questions=20, instances=2, assessments_per_instance=3, assets_size=1000, seed=7)
+    synth.synthesize_course(str(tmp_path / "b"), questions=20, instances=2, assessments_per_instance=3, assets_size=1000, seed=7)
+    synth.synthesize_course(str(tmp_path / "c"), questions=20, instances=2, assessments_per_instance=3, assets_size=1000, seed=8)
+
+    assert stats["questions"] == 20 and stats["assessments"] == 6
+    assert _tree_digest(tmp_path / "a") == _tree_digest(tmp_path / "b")
+    assert _tree_digest(tmp_path / "a") != _tree_digest(tmp_path / "c")
+    assert os.path.getsize(tmp_path / "a" / "questions" / "q000003" / "clientFilesQuestion" / "figure.png") == 1000
+    # A question appears at most once in each assessment
+    for path in (tmp_path / "a").glob("courseInstances/*/assessments/*/infoAssessment.json"):
+        qids = [question["id"] for zone in json.loads(path.read_text())["zones"] for question in zone["questions"]]
+        assert qids and len(qids) == len(set(qids))
+
+
+def test_index_synthetic_course(tmp_path):
+    synth.synthesize_course(str(tmp_path), questions=30, instances=1, assessments_per_instance=4, seed=1)
+    course = index.index_course(str(tmp_path))
+
+    assert len(course.questions) == 30
+    assert course.questions["q000000"]["topic"] == synth.TOPICS[0]
+    assert len(course.assessments) == 4
+    for assessment in course.assessments.values():
+        for zone in assessment["zones"]:
+            assert all(question["id"] in course.questions for question in zone["questions"])
+    assert course.errors == []
+
+    # Valid JSON that is not an object is reported, like unparsable files
+    (tmp_path / "questions" / "q000004" / "info.json").write_text("[1, 2]")
+    course = index.index_course(str(tmp_path))
+    assert len(course.questions) == 29 and "q000004" not in course.questions
+    assert course.errors == [(os.path.join("questions", "q000004", "info.json"), "expected a JSON object, not list")]
+    assert index.referenced_images(str(tmp_path)) == ["prairielearn/grader-python"]
+
+
+def test_search_updates_incrementally(tmp_path):
+    import json
+    import shutil
+
+    from prairie import bench
+    from prairie.course import search
+
+    synth.synthesize_course(str(tmp_path), questions=40, instances=1, assessments_per_instance=2, seed=2)
+    assert search.SearchIndex.load(str(tmp_path)).update()["added"] == 40
+
+    info_path = tmp_path / "questions" / "q000007" / "info.json"
+    info = json.loads(info_path.read_text())
+    info_path.write_text(json.dumps(dict(info, title="Zebra crossings", tags=["zebra"])))
+    (tmp_path / "questions" / "q000003" / "question.html").write_text("<p>How fast does a zebra run?</p>")
+    shutil.rmtree(tmp_path / "questions" / "q000011")
+
+    index = search.SearchIndex.load(str(tmp_path))
+    results = search.search_course(str(tmp_path), "zebras zebra", index=index)
+    assert [result["qid"] for result in results] == ["q000007", "q000003"]
+    assert results[1]["snippet"] == "How fast does a zebra run?"
+    assert "q000011" not in index.documents and len(index.documents) == 39
+    assert index.update() == {"added": 0, "updated": 0, "removed": 0, "unchanged": 39}
+
+    # The updated index was saved
+    reloaded = search.SearchIndex.load(str(tmp_path))
+    assert reloaded.update()["unchanged"] == 39
+    assert reloaded.postings("zebra") == index.postings("zebra") and len(index.postings("zebra")) == 2
+
+    result, _ = bench.run_cli(["course", "search", "zebra", "--course-dir", str(tmp_path), "--json"])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output)[0]["title"] == "Zebra crossings"
+
+
+def test_element_scanner(tmp_path):
+    from prairie.course import elements
+
+    text = ('<p>a < b</p><pl-checkbox answers-name="x" partial-credit-method="PC"><!-- <pl-threejs> -->'
+            '<pl-answer correct="true">1</pl-answer></pl-checkbox><PL-Figure file-name=\'a>b.png\' inline/>')
+    expected = [("pl-checkbox", ["answers-name", "partial-credit-method"]), ("pl-answer", ["correct"]), ("pl-figure", ["file-name", "inline"])]
+    for size in (1, 3, 7, len(text)):
+        assert list(elements.scan_tags(text[i:i + size] for i in range(0, len(text), size))) == expected
+
+    # A tag cut by the chunk boundary, after a chunk full of ordinary tags
+    filler = "<p>x</p>" * (elements.CHUNK_SIZE // 8 - 2)
+    cut = filler + '<p>ok</p><pl-number-input answers-name="x" comparison="sigfig" digits="3"></pl-number-input>'
+    size = elements.CHUNK_SIZE
+    assert list(elements.scan_tags(cut[i:i + size] for i in range(0, len(cut), size))) == [
+        ("pl-number-input", ["answers-name", "comparison", "digits"])]
+
+    synth.synthesize_course(str(tmp_path), questions=80, instances=1, assessments_per_instance=1, seed=4)
+    (tmp_path / "questions" / "q000002" / "question.html").write_text(text)
+    usage = elements.element_usage(str(tmp_path), jobs=2)
+    assert usage["scanned"] == 80
+    assert usage["elements"]["pl-question-panel"]["questions"] == 79
+    assert usage["elements"]["pl-checkbox"]["attributes"]["partial-credit-method"] == {"occurrences": 1, "questions": 1}
+    assert usage["deprecated"]["pl-checkbox.partial-credit-method"]["questions"] == ["q000002"]
+    assert "pl-threejs" not in usage["elements"]
+
+    (tmp_path / "questions" / "q000002" / "question.html").write_text(text.replace("partial-credit-method", "partial-credit"))
+    usage = elements.element_usage(str(tmp_path), jobs=1)
+    assert usage["scanned"] == 1
+    assert "pl-checkbox.partial-credit-method" not in usage["deprecated"]
+
+
+def test_asset_duplicates(tmp_path, monkeypatch):
+    from prairie.course import assets
+
+    synth.synthesize_course(str(tmp_path), questions=6, instances=1, assessments_per_instance=1, assets_size=100_000, seed=5)
+    questions = tmp_path / "questions"
+    pdf = os.urandom(200_000)
+    for qid in ("q000000", "q000001", "q000004"):
+        (questions / qid / "clientFilesQuestion" / "notes.pdf").write_bytes(pdf)
+    # Same size and head, different tail: not a duplicate
+    (questions / "q000005" / "clientFilesQuestion" / "notes.pdf").write_bytes(pdf[:-1] + bytes([pdf[-1] ^ 1]))
+    os.link(questions / "q000000" / "clientFilesQuestion" / "notes.pdf", questions / "q000000" / "clientFilesQuestion" / "copy.pdf")
+
+    hashed = []
+    hash_file = assets._hash
+    monkeypatch.setattr(assets, "_hash", lambda path, limit=None: hashed.append((os.path.basename(path), limit)) or hash_file(path, limit))
+    report = assets.asset_report(str(tmp_path), top=2)
+    (duplicate,) = report["duplicates"]
+    copies = ["q000000/clientFilesQuestion/copy.pdf", "q000001/clientFilesQuestion/notes.pdf", "q000004/clientFilesQuestion/notes.pdf"]
+    assert duplicate["paths"] == [f"questions/{path}" for path in copies]
+    assert duplicate["wasted"] == report["wasted"] == 400_000
+    # Only the files whose sizes collide were hashed, and in full only if their heads collide too
+    assert "formulas.txt" not in {name for name, _ in hashed}
+    assert sum(1 for _, limit in hashed if limit is None) == 4
+    assert report["largest"][0]["size"] == 200_000
+
+    assert assets.link_duplicates(str(tmp_path), report["duplicates"]) == 400_000
+    shared = tmp_path / "clientFilesCourse" / "shared" / f"{duplicate['hash'][:12]}-copy.pdf"
+    for path in copies:
+        link = questions / path
+        assert link.is_symlink() and link.read_bytes() == pdf
+        assert os.path.samefile(link, shared)
+    assert assets.asset_report(str(tmp_path))["duplicates"] == []
+
+
+def test_optimize_images(tmp_path):
+    PIL = pytest.importorskip("PIL.Image")
+    from prairie.course import images
+
+    figures = tmp_path / "questions" / "q1" / "clientFilesQuestion"
+    figures.mkdir(parents=True)
+    (tmp_path / "questions" / "q1" / "info.json").write_text("{}")
+    PIL.new("RGB", (3000, 2000), (200, 30, 30)).save(figures / "large.png")
+    PIL.new("RGB", (40, 40), (0, 0, 0)).save(figures / "small.jpg", quality=70)
+    before = (figures / "large.png").stat().st_size
+
+    report = images.optimize_images(str(tmp_path), max_dimension=600, jobs=2)
+    assert report["optimized"] + report["unchanged"] == 2 and not report["errors"]
+    with PIL.open(figures / "large.png") as image:
+        assert image.size == (600, 400)
+    assert report["saved"]["q1"] == before - (figures / "large.png").stat().st_size
+
+    # Re-running only processes new or edited images
+    assert images.optimize_images(str(tmp_path), max_dimension=600)["skipped"] == 2
+    PIL.new("RGB", (2000, 2000), (0, 0, 200)).save(figures / "large.png")
+    report = images.optimize_images(str(tmp_path), max_dimension=600)
+    assert (report["optimized"], report["skipped"]) == (1, 1)
+
+
+def test_optimize_images_requires_pillow(tmp_path):
+    try:
+        import PIL  # noqa: F401
+        pytest.skip("Pillow is installed")
+    except ImportError:
+        pass
+    from prairie import bench
+
+    result, _ = bench.run_cli(["course", "optimize-images", "--course-dir", str(tmp_path)])
+    assert result.exit_code == 1
+    assert "optional 'Pillow' package" in result.output
+
+
+def test_pack_and_unpack(tmp_path):
+    from prairie.course import pack
+
+    course = tmp_path / "course"
+    synth.synthesize_course(str(course), questions=5, assessments_per_instance=1, assets_size=1000, seed=3)
+    (course / ".git").mkdir()
+    (course / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    (course / "questions" / "q000001" / "node_modules").mkdir(parents=True, exist_ok=True)
+    (course / "questions" / "q000001" / "node_modules" / "junk.js").write_text("//")
+    (course / "questions" / "notes").mkdir()
+    (course / "questions" / "notes" / "todo.txt").write_text("not a question")
+    (course / "questions" / "q000002" / "draft.bak").write_text("old")
+
+    files = pack.course_files(str(course), excludes=["*.bak"])
+    assert "infoCourse.json" in files
+    assert not any(".git" in path or "node_modules" in path or path.startswith("questions/notes") or path.endswith(".bak") for path in files)
+
+    first, second = tmp_path / "first.tar.gz", tmp_path / "second.tar.gz"
+    manifest = pack.pack_course(str(course), str(first), excludes=["*.bak"])
+    os.utime(course / "infoCourse.json", (0, 0))
+    pack.pack_course(str(course), str(second), excludes=["*.bak"])
+    assert first.read_bytes() == second.read_bytes()
+
+    destination = tmp_path / "copy"
+    counts = pack.unpack_course(str(first), str(destination))
+    assert counts["written"] == len(manifest["files"]) and counts["skipped"] == 0
+    assert pack.course_files(str(destination)) == files
+
+    # Only the files that differ are written again
+    (destination / "infoCourse.json").write_text("{}")
+    counts = pack.unpack_course(str(first), str(destination))
+    assert (counts["written"], counts["skipped"]) == (1, len(manifest["files"]) - 1)
+    assert (destination / "infoCourse.json").read_bytes() == (course / "infoCourse.json").read_bytes()
+
+
+def _edit_json(path, edit):
+    with open(path) as f:
+        data = json.load(f)
+    edit(data)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=4)
+
+
+def test_diff_revisions(tmp_path, monkeypatch):
+    from prairie.course import diff
+
+    if shutil.which("git") is None:
+        pytest.skip("git is not installed")
+    course = tmp_path / "repo" / "course"
+    synth.synthesize_course(str(course), questions=20, assessments_per_instance=2, seed=5)
+
+    def commit(message):
+        subprocess.run(["git", "-C", str(course.parent), "add", "-A"], check=True)
+        subprocess.run(["git", "-C", str(course.parent), "-c", "user.name=t", "-c", "user.email=t@example.com", "commit", "-qm", message], check=True)
+
+    subprocess.run(["git", "init", "-q", str(course.parent)], check=True)
+    commit("init")
+    before = tmp_path / "before"
+    shutil.copytree(course, before)
+
+    _edit_json(course / "questions" / "q000001" / "info.json", lambda info: info.update(title="Renamed", tags=info["tags"][1:] + ["new-tag"]))
+    (course / "questions" / "q000002" / "question.html").write_text("<p>Only the HTML changed</p>")
+    shutil.move(course / "questions" / "q000003", course / "questions" / "q000003-moved")
+    shutil.rmtree(course / "questions" / "q000004")
+    assessment = sorted(course.glob("courseInstances/*/assessments/*/infoAssessment.json"))[0]
+    zones = json.loads(assessment.read_text())["zones"]
+    moved = zones[0]["questions"][0]["id"]
+
+    def edit_assessment(info):
+        info["zones"][1]["questions"].append(info["zones"][0]["questions"].pop(0))
+        info["zones"][1]["questions"][0]["points"] = 42
+    _edit_json(assessment, edit_assessment)
+    commit("change")
+
+    for old, new in (("HEAD~1", "HEAD"), (str(before), str(course))):
+        report = diff.diff_courses(diff.open_side(str(course), old), diff.open_side(str(course), new))
+        questions = report["questions"]
+        assert (questions["added"], questions["removed"], questions["renamed"]) == ([], ["q000004"], [["q000003", "q000003-moved"]])
+        assert list(questions["changed"]) == ["q000001"] and questions["changed"]["q000001"]["title"][1] == "Renamed"
+        assert report["tags"]["new-tag"] == {"added": ["q000001"], "removed": []}
+        (key, changes), = report["assessments"]["changed"].items()
+        assert key.endswith(assessment.parent.name)
+        assert moved in changes["questions"]["moved"]
+        assert zones[1]["questions"][0]["id"] in changes["questions"]["points"]
+
+    # Identical subtrees are skipped: only the changed directories are listed
+    report = diff.diff_courses(diff.open_side(str(course), "HEAD~1"), diff.open_side(str(course), "HEAD"))
+    assert report["directories"] < 15
+    # Listings longer than a command line are split, and a revision can be diffed with a directory
+    monkeypatch.setattr(diff, "_ARGUMENTS_BYTES", 64)
+    mixed = diff.diff_courses(diff.open_side(str(course), "HEAD~1"), diff.open_side(str(course), str(course)))
+    assert mixed["questions"] == report["questions"] and mixed["assessments"] == report["assessments"]
+    assert mixed["directories"] > report["directories"]
+    with pytest.raises(ValueError):
+        diff.open_side(str(course), "no-such-revision")
+
+
+def test_lint_reruns_only_affected_rules(tmp_path, monkeypatch):
+    from prairie.course import lint
+
+    synth.synthesize_course(str(tmp_path), questions=10, assessments_per_instance=1, seed=2)
+    question = tmp_path / "questions" / "q000001"
+    _edit_json(question / "info.json", lambda info: info.update(title="", topic="Astrology"))
+    (question / "server.py").write_text("import random\n\ndef generate(data):\n    random.seed()  # reseed\n")
+    (question / "clientFilesQuestion").mkdir(exist_ok=True)
+    (question / "clientFilesQuestion" / "orphan.txt").write_text("nobody links here")
+
+    # House rules register themselves like the built-in ones
+    monkeypatch.setattr(lint, "RULES", dict(lint.RULES))
+
+    @lint.rule("no-todo", "No TODO in question.html.", files=("question.html",), severity="warning")
+    def no_todo(context):
+        if "TODO" in context.read("question.html"):
+            yield "question.html", "TODO left"
+
+    report = lint.lint_course(str(tmp_path))
+    found = {(finding["rule"], finding["path"]) for finding in report["findings"] if "q000001" in finding["path"]}
+    assert found == {
+        ("missing-title", "questions/q000001/info.json"),
+        ("invalid-topic", "questions/q000001/info.json"),
+        ("unseeded-random", "questions/q000001/server.py:4"),
+        ("unused-file", "questions/q000001/clientFilesQuestion/orphan.txt"),
+    }
+    assert report["cached"] == 0
+
+    # Only the rules reading question.html re-run, on the edited question
+    with open(question / "question.html", "a") as f:
+        f.write("<!-- TODO -->")
+    report = lint.lint_course(str(tmp_path))
+    assert report["evaluated"] == 3
+    assert ("no-todo", "questions/q000001/question.html") in {(finding["rule"], finding["path"]) for finding in report["findings"]}
+    assert lint.lint_course(str(tmp_path))["evaluated"] == 0
+
+
+def test_compact_index(tmp_path):
+    import tracemalloc
+
+    synth.synthesize_course(str(tmp_path), questions=2000, assessments_per_instance=2, seed=4)
+    _edit_json(tmp_path / "questions" / "q000007" / "info.json", lambda info: info.update(uuid="NOT-A-UUID", title=None, tags="odd"))
+    _edit_json(tmp_path / "questions" / "q000009" / "info.json", lambda info: info.update(topic=["x"], tags=["a", {"b": 1}]))
+    expected = json.loads((tmp_path / "questions" / "q000008" / "info.json").read_text())
+
+    tracemalloc.start()
+    try:
+        course = index.index_course(str(tmp_path))
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    question = course.questions["q000008"]
+    assert question.to_dict() == index.question_entry(expected)
+    assert (question["title"], question.get("tags"), question.get("missing", 1)) == (expected["title"], expected["tags"], 1)
+    assert (course.questions["q000007"].uuid, course.questions["q000007"].title, course.questions["q000007"].tags) == ("NOT-A-UUID", None, "odd")
+    malformed = json.loads((tmp_path / "questions" / "q000009" / "info.json").read_text())
+    assert course.questions["q000009"].to_dict() == index.question_entry(malformed)
+    assert "q000008" in course.questions and "nope" not in course.questions and len(list(course.questions)) == 2000
+
+    usage = index.memory_usage(course)
+    assert usage["questions"]["records"] == 2000 and usage["strings"]["records"] < 200
+    # The whole index of a 100k-question course fits in ~25MiB (it took ~90MiB as dictionaries)
+    assert usage["questions"]["bytes"] / 2000 < 300
+    assert retained / 2000 < 400 and peak / 2000 < 600
+
+
+def test_unpack_refuses_writes_through_links(tmp_path):
+    import io
+    import tarfile
+
+    from prairie.course import pack
+
+    # A crafted archive whose links chain up to the parent of the parent of the destination
+    links = {"a": ".", "a/b": ".", "a/b/l": "../.."}
+    evil = b"escaped"
+    manifest = {"version": pack.MANIFEST_VERSION, "links": links,
+                "files": {"a/b/l/evil.txt": {"size": len(evil), "sha256": hashlib.sha256(evil).hexdigest(), "executable": False}}}
+    archive = tmp_path / "evil.tar.gz"
+    with open(archive, "wb") as f, pack.bundle.compressed_writer(f, "gzip") as writer, tarfile.open(fileobj=writer, mode="w|") as tar:
+        data = json.dumps(manifest).encode()
+        tar.addfile(pack._tarinfo(pack.MANIFEST_NAME, len(data)), io.BytesIO(data))
+        for name, target in links.items():
+            tar.addfile(pack._tarinfo(name, link=target))
+        tar.addfile(pack._tarinfo("a/b/l/evil.txt", len(evil)), io.BytesIO(evil))
+
+    destination = tmp_path / "x" / "y" / "into"
+    destination.mkdir(parents=True)
+    with pytest.raises(pack.PackError):
+        pack.unpack_course(str(archive), str(destination))
+    assert not any(path.name == "evil.txt" and destination not in path.parents for path in tmp_path.rglob("evil.txt"))
+
+    # Links left by an earlier unpack are not followed either
+    (destination / "questions").symlink_to(tmp_path)
+    with pytest.raises(pack.PackError):
+        pack._safe_path(str(destination), "questions/q1/info.json")
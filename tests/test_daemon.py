@@ -0,0 +1,100 @@
+import json
+import os
+
+import pytest
+
+from prairie import __version__, bench
+from prairie.course import index, synth
+from prairie.daemon import server
+
+IMAGE = "prairielearn/prairielearn:us-prod-live"
+
+
+@pytest.fixture
+def daemon():
+    running = server.Daemon().start()
+    yield running
+    running.stop()
+
+
+def test_status_through_daemon(daemon, fake_docker):
+    fake_docker.add_image(IMAGE)
+    container = fake_docker.add_container(IMAGE)
+
+    for _ in range(2):
+        result, _ = bench.run_cli(["docker", "status"])
+        assert result.exit_code == 0, result.output
+        assert container["Id"] in result.output
+    assert daemon.state.requests == 2
+    assert len(daemon.state._clients) == 1
+
+    result, _ = bench.run_cli(["daemon", "stop"])
+    assert "stopped" in result.output
+    # Without the daemon, the command runs in-process
+    result, _ = bench.run_cli(["docker", "status"])
+    assert result.exit_code == 0, result.output
+    assert container["Id"] in result.output
+    assert daemon.state.requests == 2
+
+
+def test_course_index_stays_warm(daemon, tmp_path, monkeypatch):
+    synth.synthesize_course(str(tmp_path), questions=12, instances=1, assessments_per_instance=2, seed=3)
+    builds = []
+    index_course = index.index_course
+    monkeypatch.setattr(index, "index_course", lambda root: builds.append(root) or index_course(root))
+
+    for _ in range(3):
+        result, _ = bench.run_cli(["course", "info", str(tmp_path)])
+        assert result.exit_code == 0, result.output
+        assert "12 question(s)" in result.output
+    assert len(builds) == 1
+
+    info_path = tmp_path / "questions" / "q000000" / "info.json"
+    info = json.loads(info_path.read_text())
+    info_path.write_text(json.dumps(dict(info, title="Edited")) + " ")
+    assert server.call("course.summary", root=str(tmp_path))["questions"] == 12
+    assert len(builds) == 2
+    assert server.call("ping")["courses"] == [os.path.abspath(tmp_path)]
+
+
+def test_incompatible_or_stale_daemon_falls_back(daemon, tmp_path):
+    request = {"op": "course.summary", "args": {"root": str(tmp_path)}}
+    response = server._request(daemon.path, dict(request, version="0.0.0"))
+    assert response["incompatible"] and f"runs prairie {__version__}" in response["error"]
+    # The same version with other code (an edit, or a reinstall) is incompatible too
+    assert server.code_version().startswith(f"{__version__}+")
+    assert server._request(daemon.path, dict(request, version=__version__))["incompatible"]
+    assert "error" not in server._request(daemon.path, dict(request, version=server.code_version()))
+    # Any client can ask for the version of the daemon
+    assert server._request(daemon.path, {"op": "ping", "version": "0.0.0"})["result"]["version"] == server.code_version()
+
+    daemon.stop()
+    open(daemon.path, "w").close()
+    with pytest.raises(server.DaemonUnavailable):
+        server.call("ping")
+    assert server.execute("ping")["requests"] == 0
+
+
+def test_stop_and_restart_across_versions(daemon, monkeypatch):
+    # prairie is upgraded (or edited) while the daemon runs
+    monkeypatch.setattr(server, "_code_version", "0.0.3+upgraded")
+    result, _ = bench.run_cli(["daemon", "status"])
+    assert result.exit_code == 0, result.output
+    assert f"runs prairie {daemon.state.version}" in result.output
+
+    # Starting replaces the stale daemon...
+    replacement = server.Daemon().start()
+    try:
+        assert daemon._server is None
+        assert server.call("ping")["version"] == "0.0.3+upgraded"
+        with pytest.raises(server.DaemonError, match="already running"):
+            server.Daemon().start()
+    finally:
+        replacement.stop()
+
+    # ... and stopping works whatever the version
+    replacement = server.Daemon().start()
+    monkeypatch.setattr(server, "_code_version", "0.0.4+upgraded")
+    result, _ = bench.run_cli(["daemon", "stop"])
+    assert "stopped" in result.output
+    assert replacement._server is None and not os.path.exists(replacement.path)
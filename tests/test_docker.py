@@ -0,0 +1,533 @@
+from prairie import bench
+
+IMAGE = "prairielearn/prairielearn:us-prod-live"
+
+
+def test_launch(fake_docker, tmp_path):
+    result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), "--port", "3001"])
+    assert result.exit_code == 0, result.output
+    assert "started successfully" in result.output
+
+    (container,) = fake_docker.containers.values()
+    assert container["State"]["Running"]
+    assert container["HostConfig"]["AutoRemove"]
+    assert {"Source": str(tmp_path), "Destination": "/course"}.items() <= container["Mounts"][-1].items()
+    assert ("POST", "images/create") in fake_docker.requests
+
+
+def test_status(fake_docker, tmp_path):
+    fake_docker.add_image(IMAGE)
+    fake_docker.add_container(IMAGE, ports={3000: 3000}, volumes={str(tmp_path): {"bind": "/course"}})
+
+    result, _ = bench.run_cli(["docker", "status"])
+    assert result.exit_code == 0, result.output
+    assert "Status: running" in result.output
+    assert f"{tmp_path} -> /course" in result.output
+    assert "https://localhost:3000" in result.output
+
+
+def test_update(fake_docker):
+    result, _ = bench.run_cli(["docker", "update"])
+    assert result.exit_code == 0, result.output
+    assert fake_docker.images
+
+
+def test_scripted_latency_is_not_overhead(fake_docker):
+    fake_docker.add_image(IMAGE)
+    fake_docker.set_latency("images/create", 0.2)
+
+    stats = bench.measure_cli_overhead(["docker", "update"], fake_docker, repeat=1, warmup=0)
+    assert stats["wall_min"] >= 0.2
+    assert stats["overhead_min"] < stats["wall_min"] - 0.19
+
+
+def test_docker_commands_overhead_budget():
+    # Generous budget: only meant to catch gross regressions (e.g., a sleep or
+    # a redundant pull sneaking into the hot path)
+    for stats in bench.benchmark_docker_commands(repeat=2):
+        assert stats["overhead_median"] < 2.0, stats
+
+
+def test_logs_filters_with_context(fake_docker):
+    fake_docker.add_image(IMAGE)
+    container = fake_docker.add_container(IMAGE, tty=False)
+    for idx in range(10):
+        level = "error" if idx in (2, 8) else "info"
+        fake_docker.add_log(container["Id"], f'{{"level":"{level}","message":"line {idx}","timestamp":"t{idx}"}}', stream=1 + idx % 2)
+    fake_docker.add_log(container["Id"], "plain text line", stream=1)
+
+    result, _ = bench.run_cli(["docker", "logs", "--level", "error", "-C", "1"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == [
+        "t1 info    line 1", "t2 error   line 2", "t3 info    line 3", "--",
+        "t7 info    line 7", "t8 error   line 8", "t9 info    line 9",
+    ]
+
+    result, _ = bench.run_cli(["docker", "logs", "--tail", "2", "--raw"])
+    assert result.output.splitlines() == ['{"level":"info","message":"line 9","timestamp":"t9"}', "plain text line"]
+    for tail in ("-1", "ten"):
+        result, _ = bench.run_cli(["docker", "logs", "--tail", tail])
+        assert result.exit_code == 2 and "Invalid value for '--tail'" in result.output
+
+
+def test_log_filter_does_not_decode_skipped_lines():
+    from prairie.docker import logs
+
+    log_filter = logs.LogFilter(pattern="QID-42")
+    (line,) = log_filter.feed([b'{"level":"info","message":"sync QID-42"}', b"{not json at all"])
+    assert line.record["message"] == "sync QID-42"
+
+
+def test_archive_and_history_search(fake_docker, tmp_path, monkeypatch):
+    from prairie.docker import archive
+
+    monkeypatch.setenv("PRAIRIE_CACHE_DIR", str(tmp_path))
+    fake_docker.add_image(IMAGE)
+    for run in range(3):
+        container = fake_docker.add_container(IMAGE, status="exited", tty=False)
+        for idx in range(50):
+            fake_docker.add_log(container["Id"], f"info: syncing /course/questions/r{run}q{idx}/info.json")
+        if run == 1:
+            fake_docker.add_log(container["Id"], '{"level":"error","message":"sync failed","code":"ENOENT","qid":"r1q7"}')
+        if run == 2:
+            fake_docker.add_log(container["Id"], "info: syncing /course/questions/intro-q.v2/info.json")
+            fake_docker.add_log(container["Id"], "error: sync failed for r1q7")
+
+    client = fake_docker.client()
+    for container in client.containers.list(all=True):
+        index = archive.archive_container(client, container, segment_bytes=512, flush_lines=10)
+        assert len(index["segments"]) > 1
+
+    # Only the segments with a word containing the QID are read, but every line with it is found
+    segments = sum(len(index["segments"]) for index in archive.load_indexes())
+    hits = list(archive.iter_archived_lines(pattern="r1q7"))
+    assert 3 <= len(hits) < segments
+    assert sum(len(lines) for _, _, lines in archive.iter_archived_lines()) == 153
+    assert len(list(archive.iter_archived_lines(pattern="intro-q.v2"))) == 1
+    assert archive._indexed_literal("q[0-9]") is None
+
+    result, _ = bench.run_cli(["docker", "logs", "--history", "--grep", "r1q7"])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert len(lines) == 3
+    assert sum(line.endswith("info: syncing /course/questions/r1q7/info.json") for line in lines) == 1
+    assert sum("code=\"ENOENT\"" in line for line in lines) == 1
+    assert sum(line.endswith("error: sync failed for r1q7") for line in lines) == 1
+
+    # Lines are only split on \n
+    archiver = archive.LogArchiver(str(tmp_path / "other"), "c" * 64)
+    archiver.add([b"downloading 10%\rdownloading 90%", b"done"], received=2000.0)
+    archiver.close()
+    lines = [line for _, _, lines in archive.iter_archived_lines(str(tmp_path / "other"), since=1000.0) for line in lines]
+    assert lines == [b"downloading 10%\rdownloading 90%", b"done"]
+
+    # Retention: the oldest runs go first once the archive is too large
+    runs = [index["run"] for index in archive.load_indexes()]
+    assert archive.prune(max_bytes=1) == runs
+    assert archive.load_indexes() == [] and not any((tmp_path / "logs").iterdir())
+
+
+def test_stats_rates(fake_docker):
+    from prairie.docker import stats
+
+    fake_docker.stats_interval = 0.05
+    fake_docker.add_image(IMAGE)
+    fake_docker.add_image("prairielearn/grader-python")
+    fake_docker.add_image("nginx")
+    pl = fake_docker.add_container(IMAGE)
+    grader = fake_docker.add_container("prairielearn/grader-python")
+    fake_docker.add_container("nginx")
+    fake_docker.set_load(grader["Id"], cpu=1.5, memory=512 * 2 ** 20, net_rx=1e6)
+
+    collector = stats.StatsCollector(fake_docker.client(), window=4)
+    assert collector.refresh() == 2
+    samples = collector.poll(timeout=0.5)
+    collector.stop()
+
+    by_role = {container_stats.role: metrics for container_stats, metrics in samples}
+    assert set(by_role) == {"prairielearn", "grader"}
+    assert abs(by_role["grader"]["cpu_percent"] - 150) < 15
+    assert by_role["grader"]["mem_bytes"] == 512 * 2 ** 20
+    assert by_role["prairielearn"]["cpu_percent"] == 0
+    assert collector.containers[grader["Id"]].windows["cpu_percent"].count <= 4
+    assert "grader" in stats.render_table(list(collector.containers.values()))
+
+
+def test_rolling_window():
+    from prairie.docker.stats import RollingWindow
+
+    window = RollingWindow(3)
+    for value in (1, 2, 3, 10):
+        window.append(value)
+    assert (window.last, window.mean(), window.max()) == (10, 5, 10)
+
+
+def test_export_metrics(fake_docker, tmp_path, monkeypatch):
+    import time
+
+    import docker
+
+    from prairie.docker import helpers, history, metrics
+
+    fake_docker.add_image(IMAGE)
+    fake_docker.add_image("prairielearn/grader-python")
+    fake_docker.add_image("nginx")
+    fake_docker.add_container(IMAGE, ports={3000: 3000})
+    fake_docker.add_container("nginx")
+    client = fake_docker.client()
+    helpers.pull_image(client, IMAGE)
+
+    answering = set()
+    exporter = metrics.MetricsExporter(client, probe=lambda port: port in answering)
+    exporter.last_event_nano -= int(5e9)
+    exporter.last_history -= 5
+    for _ in range(2):
+        grader = client.containers.run("prairielearn/grader-python", detach=True)
+        grader.stop()
+    text = exporter.collect()
+
+    assert 'prairie_grading_jobs_total{status="success"} 2' in text
+    assert "prairie_grading_job_duration_seconds_count 2" in text
+    assert f'prairie_image_pulls_total{{image="{IMAGE}"}} 1' in text
+    assert 'role="prairielearn"' in text and "nginx" not in text
+    assert "prairie_container_time_to_ready_seconds{" not in text
+
+    # Ready between the failed probe and this one; only new pulls are read from the history
+    answering.add("3000")
+    helpers.pull_image(client, IMAGE)
+    text = exporter.collect()
+    (ready,) = history.read(event="ready")
+    assert 'prairie_container_time_to_ready_seconds{container="' in text
+    assert 0 < ready["seconds"] < time.time() - helpers.parse_docker_time(client.containers.list(filters={"ancestor": IMAGE})[0].attrs["State"]["StartedAt"])
+    assert f'prairie_image_pulls_total{{image="{IMAGE}"}} 2' in text
+    # A container already answering when first seen has no known time to ready
+    assert "prairie_container_time_to_ready_seconds{" not in metrics.MetricsExporter(client, probe=lambda port: True).collect()
+
+    # A grader removed between the listing and the inspection is skipped
+    grader = client.containers.run("prairielearn/grader-python", detach=True)
+    get = docker.models.containers.ContainerCollection.get
+
+    def get_removed(self, container_id):
+        if container_id == grader.id:
+            fake_docker.containers.pop(container_id)
+        return get(self, container_id)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(docker.models.containers.ContainerCollection, "get", get_removed)
+        assert "prairie_container_up{" in exporter.collect()
+    assert helpers.parse_docker_time("2024-01-01T00:00:00+01:00") == helpers.parse_docker_time("2023-12-31T23:00:00.000000000Z")
+
+    path = tmp_path / "prairie.prom"
+    result, _ = bench.run_cli(["docker", "export-metrics", "--textfile", str(path), "--once"])
+    assert result.exit_code == 0, result.output
+    assert "# TYPE prairie_container_up gauge" in path.read_text()
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_launch_resource_limits(fake_docker, tmp_path):
+    # Cores are those of the daemon's machine, not this one
+    fake_docker.ncpu = 8
+    for port in (3001, 3002):
+        result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), "--port", str(port),
+                                   "--cpus", "3", "--cpuset", "auto", "--memory", "2g", "--shm-size", "256m"])
+        assert result.exit_code == 0, result.output
+
+    host_configs = [container["HostConfig"] for container in fake_docker.containers.values()]
+    assert sorted(host_config["CpusetCpus"] for host_config in host_configs) == ["0-2", "3-5"]
+    assert host_configs[0]["NanoCpus"] == 3_000_000_000
+    assert host_configs[0]["Memory"] == 2 * 2 ** 30
+    assert host_configs[0]["ShmSize"] == 256 * 2 ** 20
+
+    result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), "--cpus", "3", "--cpuset", "auto"])
+    assert "only 2 core(s)" in result.output
+    assert len(fake_docker.containers) == 2
+
+
+def test_plan_cpusets():
+    from prairie.docker import placement
+
+    assert placement.plan_cpusets(2, 2, [0, 1, 2, 3, 6]) == ["0-1", "2-3"]
+    assert placement.parse_cpuset("0-2,5") == [0, 1, 2, 5]
+    assert placement.format_cpuset([5, 0, 1, 2]) == "0-2,5"
+
+
+def test_async_client_requests_concurrently(tmp_path):
+    import time
+
+    from prairie.docker import helpers
+    from prairie.docker.fake import FakeDockerDaemon
+
+    with FakeDockerDaemon(socket_path=str(tmp_path / "docker.sock")) as daemon:
+        daemon.add_image(IMAGE)
+        for _ in range(20):
+            daemon.add_container(IMAGE)
+        daemon.add_image("nginx")
+        daemon.add_container("nginx")
+        daemon.set_latency("containers/json", 0.05)
+        client = daemon.client()
+
+        start = time.perf_counter()
+        containers = helpers.list_prairielearn_containers(client)
+        assert len(containers) == 20
+        assert time.perf_counter() - start < 20 * 0.05
+        assert all(container.status == "running" for container in containers)
+        # The nginx container is not even inspected
+        assert daemon.requests.count(("GET", "containers/json")) == 20
+
+        daemon.set_latency("images/create", 0.2)
+        start = time.perf_counter()
+        images = helpers.pull_images(client, ["prairielearn/grader-python", "prairielearn/grader-r", "prairielearn/grader-c"])
+        assert time.perf_counter() - start < 3 * 0.2
+        assert images[1].tags == ["prairielearn/grader-r:latest"]
+
+
+def test_async_client_stream_errors():
+    import asyncio
+
+    import pytest
+
+    from prairie.docker import aio
+
+    answers = [b"HTTP/1.1 502 Bad Gateway\r\nContent-Length: 11\r\nConnection: close\r\n\r\nBad gateway",
+               b'HTTP/1.1 404 Not Found\r\nContent-Length: 30\r\nConnection: close\r\n\r\n{"message":"no such image: x"}',
+               b'HTTP/1.1 200 OK\r\nContent-Length: 17\r\nConnection: close\r\n\r\n{"status":"a"}\nok']
+
+    async def main():
+        async def answer(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(answers.pop(0))
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(answer, "127.0.0.1", 0)
+        client = aio.AsyncDockerClient(f"tcp://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+        errors = []
+        for _ in range(3):
+            with pytest.raises(aio.DockerAPIError) as e:
+                [message async for message in client.stream_json("POST", "/images/create")]
+            errors.append(e.value)
+        server.close()
+        return errors
+
+    errors = asyncio.run(main())
+    assert [(e.status, e.message) for e in errors] == [(502, "Bad gateway"), (404, "no such image: x"), (200, "unexpected answer: ok")]
+
+
+def test_async_client_retries_only_safe_requests():
+    import asyncio
+    import socket
+    import struct
+
+    import pytest
+
+    from prairie.docker import aio
+
+    # What the server does with each request, in order
+    behaviours = ["answer", "reset", "answer", "reset", "answer", "close", "answer"]
+    received = []
+
+    async def main():
+        async def serve(reader, writer):
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break
+                received.append(head.split(b" ", 1)[0].decode())
+                behaviour = behaviours.pop(0)
+                if behaviour == "answer":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}")
+                    await writer.drain()
+                    continue
+                if behaviour == "reset":
+                    # The request may have been run: the connection is reset instead of answered
+                    writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    writer.transport.abort()
+                    return
+                break
+            writer.close()
+
+        server = await asyncio.start_server(serve, "127.0.0.1", 0)
+        client = aio.AsyncDockerClient(f"tcp://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+        await client.request("POST", "/containers/x/start")
+        # Starting the container again on a new connection would not be harmless
+        with pytest.raises(ConnectionError):
+            await client.request("POST", "/containers/x/start")
+        await client.request("GET", "/containers/json")
+        await client.request("GET", "/containers/json")
+        # Closed without an answer: the request was not run
+        await client.request("POST", "/containers/x/start")
+        await client.close()
+        server.close()
+
+    asyncio.run(main())
+    assert received == ["POST", "POST", "GET", "GET", "GET", "POST", "POST"] and behaviours == []
+
+
+def test_launch_preflight_reports_every_failure(fake_docker, tmp_path):
+    import socket
+
+    with socket.socket() as busy:
+        busy.bind(("0.0.0.0", 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), "--port", str(port),
+                                   "--job-dir", str(tmp_path / "missing" / "jobs")])
+    assert result.exit_code != 0, result.output
+    assert "Pre-flight checks failed" in result.output
+    assert f"port {port}: already in use" in result.output
+    assert "course directories" not in result.output
+    # Nothing was pulled, created or written
+    assert ("POST", "images/create") not in fake_docker.requests
+    assert not fake_docker.containers
+    assert not (tmp_path / "missing").exists()
+
+
+def test_launch_expands_job_dir(fake_docker, tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    (tmp_path / "home").mkdir()
+    monkeypatch.chdir(tmp_path)
+    result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), "--job-dir", "~/jobs"])
+    assert result.exit_code == 0, result.output
+    assert (tmp_path / "home" / "jobs").is_dir() and not (tmp_path / "~").exists()
+    (container,) = fake_docker.containers.values()
+    assert {"Source": str(tmp_path / "home" / "jobs"), "Destination": "/jobs"}.items() <= next(
+        mount for mount in container["Mounts"] if mount["Destination"] == "/jobs").items()
+
+
+def test_launch_preflight_without_daemon(monkeypatch, tmp_path):
+    monkeypatch.setenv("DOCKER_HOST", f"unix://{tmp_path}/missing.sock")
+    for args in ([], ["--dry-run"]):
+        result, _ = bench.run_cli(["docker", "launch", "--course-dir", str(tmp_path), *args])
+        assert result.exception is None or isinstance(result.exception, SystemExit), result.output
+        assert "✖ docker daemon: cannot connect" in result.output
+        assert "course directories" in result.output if args else "course directories" not in result.output
+    assert result.exit_code == 0
+    result, _ = bench.run_cli(["docker", "status"])
+    assert result.exit_code == 1 and "Error:" in result.output
+
+
+def test_preflight_disk_space(fake_docker):
+    from prairie.docker import history, preflight
+
+    client = fake_docker.client()
+    history.record("pull", image="prairielearn/prairielearn:v2", seconds=10.0, size=10 ** 15)
+    assert preflight.check_disk_space(client, "prairielearn/prairielearn:v2").status == preflight.FAIL
+    assert preflight.check_disk_space(client, "prairielearn/prairielearn:v3").status == preflight.WARN
+
+
+def test_launch_dry_run(fake_docker, tmp_path):
+    import json
+
+    from prairie.docker import history
+
+    args = ["docker", "launch", "--course-dir", str(tmp_path), "--port", "3001", "--memory", "1g", "--dry-run"]
+    result, _ = bench.run_cli(args)
+    assert "time to ready: unknown (only measured while `prairie docker export-metrics` runs)" in result.output
+
+    history.record("pull", image=IMAGE, seconds=30.0, size=2 * 2 ** 30)
+    history.record("pull", image=IMAGE, seconds=2.0, size=2 * 2 ** 30)
+    history.record("start", image=IMAGE, seconds=0.5)
+    history.record("ready", image=IMAGE, seconds=12.0)
+
+    result, _ = bench.run_cli(args + ["--json"])
+    assert result.exit_code == 0, result.output
+    plan = json.loads(result.output)
+    assert plan["spec"]["image"] == IMAGE
+    assert plan["spec"]["volumes"][str(tmp_path)] == {"bind": "/course", "mode": "rw"}
+    assert plan["spec"]["mem_limit"] == 2 ** 30
+    assert plan["cost"]["pull"] == {"needed": True, "bytes": 2 * 2 ** 30, "image_size": 2 * 2 ** 30}
+    assert plan["cost"]["expected_seconds"] == {"pull": 30.0, "start": 0.5, "ready": 12.0, "total": 42.5}
+    assert plan["cost"]["reusable_container"] is None
+    # Nothing was pulled or created
+    assert not fake_docker.containers and not fake_docker.images
+
+    result, _ = bench.run_cli(args[:-1])
+    assert result.exit_code == 0, result.output
+    result, _ = bench.run_cli(args)
+    assert "pull: image present" in result.output
+    assert "reusable container: " in result.output and "reusable container: none" not in result.output
+    assert "history: 3 pull(s), 2 start(s)" in result.output
+
+
+def test_bundle_save_and_load_streams(fake_docker, tmp_path):
+    import json
+    import tracemalloc
+
+    from prairie.docker import bundle
+
+    course = tmp_path / "course" / "questions" / "q1"
+    course.mkdir(parents=True)
+    (course / "info.json").write_text(json.dumps({"externalGradingOptions": {"image": "prairielearn/grader-python"}}))
+    fake_docker.export_layer_bytes = 32 << 20
+    fake_docker.add_image(IMAGE)
+
+    path = tmp_path / "bundle.tar.gz"
+    tracemalloc.start()
+    try:
+        result, _ = bench.run_cli(["docker", "bundle", "save", "-o", str(path), "--course-dir", str(tmp_path / "course"), "--level", "1"])
+        assert result.exit_code == 0, result.output
+        assert tracemalloc.get_traced_memory()[1] < 16 << 20
+    finally:
+        tracemalloc.stop()
+    assert "prairielearn/grader-python" in result.output
+    assert bundle.detect_compression(str(path)) == "gzip"
+    assert path.stat().st_size < 1 << 20
+
+    fake_docker.images.clear()
+    tracemalloc.start()
+    try:
+        result, _ = bench.run_cli(["docker", "bundle", "load", str(path)])
+        assert result.exit_code == 0, result.output
+        assert tracemalloc.get_traced_memory()[1] < 16 << 20
+    finally:
+        tracemalloc.stop()
+    assert "Loaded 2 image(s)" in result.output
+    assert sorted(tag for image in fake_docker.images.values() for tag in image["RepoTags"]) == [
+        "prairielearn/grader-python:latest", IMAGE]
+
+
+def test_update_through_mirror(fake_docker, monkeypatch, tmp_path):
+    from prairie.docker import helpers, history
+
+    monkeypatch.setenv("PRAIRIE_MIRROR", "localhost:5999")
+    assert helpers.mirrored_reference("nginx", "m:5000") == ("m:5000/library/nginx", "latest")
+    assert helpers.mirrored_reference("ghcr.io/org/grader:1", "m:5000") is None
+
+    result, _ = bench.run_cli(["docker", "update", "--image", "nginx"])
+    assert result.exit_code == 0, result.output
+    client = fake_docker.client()
+    assert client.images.get("localhost:5999/library/nginx")
+    assert client.images.get("localhost:5999/prairielearn/prairielearn:us-prod-live")
+    assert IMAGE in client.images.get(IMAGE).tags
+    assert "nginx:latest" in client.images.get("nginx").tags
+    assert {entry["mirror"] for entry in history.read(event="pull")} == {"localhost:5999"}
+
+    # An unreachable mirror falls back to Docker Hub
+    fake_docker.unreachable_registries.add("localhost:5999")
+    helpers.pull_image(client, "prairielearn/prairielearn:v2")
+    assert history.read(event="pull")[-1]["mirror"] is None
+    assert client.images.get("prairielearn/prairielearn:v2")
+
+    # An invalid prairie.yaml only disables the mirror
+    monkeypatch.delenv("PRAIRIE_MIRROR")
+    (tmp_path / "prairie.yaml").write_text("mirror: https://lab-server/\n")
+    monkeypatch.chdir(tmp_path)
+    result, _ = bench.run_cli(["docker", "update", "--image", "nginx"])
+    assert result.exit_code == 0, result.output
+    assert history.read(event="pull")[-1]["mirror"] is None
+
+
+def test_mirror_serve(fake_docker, tmp_path):
+    result, _ = bench.run_cli(["docker", "mirror", "serve", "--port", "5999", "--data-dir", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "mirror: " in result.output and ":5999" in result.output
+    (container,) = fake_docker.containers.values()
+    assert container["Name"] == "/prairie-mirror"
+    assert "REGISTRY_PROXY_REMOTEURL=https://registry-1.docker.io" in container["Config"]["Env"]
+    assert container["HostConfig"]["RestartPolicy"]["Name"] == "unless-stopped"
+    assert container["HostConfig"]["PortBindings"]["5000/tcp"][0]["HostPort"] == "5999"
+
+    result, _ = bench.run_cli(["docker", "mirror", "stop"])
+    assert "stopped" in result.output
+    assert not fake_docker.containers
@@ -0,0 +1,41 @@
+import json
+
+import loguru
+import pytest
+
+from prairie import bench, logsinks
+
+
+def test_json_file_sink(tmp_path):
+    path = tmp_path / "prairie.log"
+    logsinks.configure(20, log_file=str(path), enqueue=True)
+    loguru.logger.bind(answer=42).info("hello")
+    loguru.logger.complete()
+    loguru.logger.remove()
+
+    (line,) = path.read_text().splitlines()
+    record = json.loads(line)["record"]
+    assert record["message"] == "hello"
+    assert record["extra"] == {"answer": 42}
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        logsinks.configure(20, log_format="xml")
+
+
+def test_invalid_file_option(tmp_path):
+    path = tmp_path / "prairie.log"
+    result, _ = bench.run_cli(["--log-file", str(path), "--log-rotation", "bogus", "config", "explain"])
+    assert result.exit_code == 2
+    assert "--log-rotation" in result.output and "Traceback" not in result.output
+    assert not path.exists()
+
+    sinks = logsinks.configure(20)
+    with pytest.raises(logsinks.LogOptionError) as e:
+        logsinks.configure(20, log_file=str(path), retention="bogus")
+    assert e.value.option == "retention"
+    # The current sinks are kept, and no sink was added (even briefly) to validate the options
+    loguru.logger.remove(sinks[0])
+    assert loguru.logger.add(str(path)) == sinks[0] + 1
+    loguru.logger.remove()
@@ -3,3 +3,23 @@ from prairie import __version__
 
 def test_version():
     assert __version__ == "0.0.2"
+
+
+def test_atomic_write_and_json_cache(tmp_path):
+    import pytest
+
+    from prairie import paths
+
+    path = str(tmp_path / "cache.json")
+    assert paths.load_json_cache(path, 2, files={}) == {"version": 2, "files": {}}
+    assert paths.save_json_cache(path, {"version": 2, "files": {"a": 1}})
+    assert paths.load_json_cache(path, 2, files={})["files"] == {"a": 1}
+    assert paths.load_json_cache(path, 3, files={})["files"] == {}
+
+    # A failed write leaves the file as it was, and no temporary file behind
+    with pytest.raises(RuntimeError):
+        with paths.atomic_write(path) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert paths.load_json_cache(path, 2)["files"] == {"a": 1}
+    assert [entry.name for entry in tmp_path.iterdir()] == ["cache.json"]
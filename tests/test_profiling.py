@@ -0,0 +1,36 @@
+import json
+
+from prairie import profiling
+
+
+def test_span_disabled_is_noop():
+    profiling.disable()
+    profiling.reset()
+    with profiling.span("noop"):
+        pass
+    assert profiling.span("a") is profiling.span("b")
+    assert profiling.roots() == []
+
+
+def test_span_tree_and_chrome_trace(tmp_path):
+    profiling.reset()
+    profiling.enable()
+    try:
+        with profiling.span("outer", step=1):
+            with profiling.span("inner"):
+                pass
+    finally:
+        profiling.disable()
+
+    (outer,) = profiling.roots()
+    assert [child.name for child in outer.children] == ["inner"]
+    assert outer.duration >= outer.children[0].duration
+
+    tree = profiling.render_tree()
+    assert "outer [step=1]" in tree and "└─ inner" in tree
+
+    path = tmp_path / "trace.json"
+    profiling.write_chrome_trace(str(path))
+    events = json.loads(path.read_text())["traceEvents"]
+    assert [event["name"] for event in events] == ["outer", "inner"]
+    profiling.reset()